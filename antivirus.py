@@ -1,63 +1,443 @@
 # antivirus.py
 
 import os
-import shutil
+import time
+import threading
 import numpy as np
-from feature_extractor import extract_features
-from tensorflow.keras.models import load_model
-import joblib
+from feature_extractor import MAX_READ_BYTES
+from archive import archive_kind, sample_archive
+from concurrent.futures import Future
+from engine import load_engine_async, engine_future, evict_engines
+from model_bundle import current_version, bundle_path, read_history, rollback_target, BUNDLE_DIR
+from inference import MODEL_DIR
+from signature_db import hash_file, within_hash_limit, MAX_HASH_BYTES
+from scan_cache import ScanCache, CACHE_PATH
+from quarantine import QuarantineStore
+import metrics
 import logging
 
+# A failed engine load is retried by the next scan after this long
+ENGINE_RETRY_SECONDS = 30.0
+
+class PreparedFile:
+    # A file that still needs a model verdict: the raw bytes the feature spec samples,
+    # plus what is needed to cache the verdict afterwards. Features are computed per batch,
+    # unless a worker process already computed them (then sample is None). The engine that
+    # sampled the file also classifies it, even if a new engine was swapped in meanwhile.
+    # Archives carry ArchiveMembers instead: one precomputed feature row per member.
+    __slots__ = ('sample', 'stat', 'content_hash', 'features', 'engine', 'archive')
+
+    def __init__(self, sample, stat, content_hash=None, features=None, engine=None, archive=None):
+        self.sample = sample
+        self.stat = stat
+        self.content_hash = content_hash
+        self.features = features
+        self.engine = engine
+        self.archive = archive
+
+    def rows(self):
+        return len(self.archive.names) if self.archive is not None else 1
+
 class Antivirus:
-    def __init__(self):
+    def __init__(self, backend='auto', max_read_bytes=MAX_READ_BYTES, cache_path=CACHE_PATH, quarantine=True,
+                 cascade_config=None, watch_bundles=True, bundle_dir=BUNDLE_DIR, watch_interval=5.0,
+                 scan_archives=True, archive_limits=None, max_hash_bytes=MAX_HASH_BYTES):
         self.quarantine_dir = os.path.join(os.getcwd(), 'quarantine')
-        os.makedirs(self.quarantine_dir, exist_ok=True)
+        # Indexed, content-addressed store; quarantine_store.listeners get one event per file
+        self.quarantine_store = QuarantineStore(self.quarantine_dir)
+
+        # With quarantine disabled detections are only reported (status 'Detected')
+        self.quarantine = quarantine
+
+        # Feature reads never exceed this; hashing for signatures always reads the whole file
+        self.max_read_bytes = max_read_bytes
+        # Unless it is larger than this (see signature_db.MAX_HASH_BYTES; None hashes every file)
+        self.max_hash_bytes = max_hash_bytes
+
+        # zip and tar files are classified by their members (ArchiveLimits bounds the unpacking)
+        self.scan_archives = scan_archives
+        self.archive_limits = archive_limits
+
+        # Model, signatures and cascade load in the background and are shared per process;
+        # the first scan waits for them, use ready() to check without blocking
+        self.backend_name = backend
+        self.cascade_config = cascade_config
+        self.bundle_dir = bundle_dir
+        self.bundle_version = current_version(bundle_dir)
+        self._loaded_engine = None
+        self._reload_lock = threading.Lock()
+        # Called with the new engine after each swap (from the reloading thread)
+        self.engine_listeners = []
+        # Activated bundle that failed to load or validate; not retried until CURRENT changes
+        self.rejected_version = None
+        self._engine_lock = threading.Lock()
+        self._engine_requested = time.monotonic()
+        self._engine = self.load_initial_engine()
+
+        # Opened once the engine version is known
+        self.cache_path = cache_path
+        self._cache = None
+        self._cache_lock = threading.Lock()
+
+        # Poll models/bundles/CURRENT and swap engines when another bundle is activated
+        self._stop_watching = threading.Event()
+        if watch_bundles:
+            threading.Thread(target=self.watch_bundles, args=(watch_interval,), name='bundle-watcher',
+                             daemon=True).start()
+
+    def model_dir(self, version):
+        return bundle_path(version, self.bundle_dir) if version else MODEL_DIR
+
+    def load_initial_engine(self):
+        # The active bundle, or if it cannot be loaded, the bundles activated before it
+        # (newest first), so a broken CURRENT does not leave the scanner without an engine
+        if not self.bundle_version:
+            return load_engine_async(self.backend_name, self.cascade_config, MODEL_DIR)
+        candidates = [self.bundle_version]
+        for version in reversed(read_history(self.bundle_dir)):
+            if version not in candidates:
+                candidates.append(version)
+        future = Future()
+
+        def load():
+            error = None
+            for version in candidates:
+                try:
+                    engine = load_engine_async(self.backend_name, self.cascade_config, self.model_dir(version)).result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if version != candidates[0]:
+                    logging.error(f'Active bundle {candidates[0]} is unusable, falling back to bundle {version}')
+                    with self._reload_lock:
+                        # watch_bundles retries CURRENT only once it names another bundle
+                        self.rejected_version = candidates[0]
+                        self.bundle_version = version
+                future.set_result(engine)
+                return
+            future.set_exception(error)
+
+        threading.Thread(target=load, name='engine-fallback', daemon=True).start()
+        return future
+
+    def watch_bundles(self, interval):
+        while not self._stop_watching.wait(interval):
+            try:
+                self.reload()
+            except Exception:
+                # Already logged by reload(); the current engine keeps scanning
+                pass
+
+    def stop_watching(self):
+        self._stop_watching.set()
+
+    def reload(self):
+        # Loads and validates the active bundle off the scan path, then swaps it in with one
+        # assignment. Scans already holding the old engine finish on it. Returns True on a swap,
+        # False if the active bundle is already loaded, and raises if it cannot be used.
+        with self._reload_lock:
+            version = current_version(self.bundle_dir)
+            if version == self.bundle_version or version == self.rejected_version:
+                return False
+            try:
+                engine = load_engine_async(self.backend_name, self.cascade_config, self.model_dir(version)).result()
+                engine.validate()
+            except Exception as e:
+                logging.error(f'Keeping engine {self.bundle_version or "models/"}: bundle {version} is unusable: {e}')
+                self.rejected_version = version
+                raise
+            previous = self._loaded_engine
+            self._engine = engine_future(engine)
+            self._loaded_engine = engine
+            self.bundle_version = version
+            self.rejected_version = None
+            if self._cache is not None:
+                self._cache.set_engine_version(engine.version)
+            # Keep the engine in use and the one rollback() would return to
+            evict_engines([self.model_dir(version), self.model_dir(rollback_target(self.bundle_dir))])
+            logging.info(f'Switched engine to bundle {version or "models/"} ({engine.version}, '
+                         f'was {previous.version if previous else "not loaded"})')
+        for listener in self.engine_listeners:
+            try:
+                listener(engine)
+            except Exception:
+                logging.exception('Engine listener failed')
+        return True
+
+    def ready(self):
+        return self._engine.done()
+
+    @property
+    def engine(self):
+        # Blocks until the engine has loaded (and raises its load error, if any)
+        engine = self._loaded_engine
+        if engine is None:
+            engine = self._loaded_engine = self.pending_engine().result()
+        return engine
+
+    def pending_engine(self):
+        # The pending or loaded engine; a load that failed is requested again once
+        # ENGINE_RETRY_SECONDS have passed, so a transient error does not last for good
+        with self._engine_lock:
+            future = self._engine
+            if (future.done() and future.exception() is not None and
+                    time.monotonic() - self._engine_requested >= ENGINE_RETRY_SECONDS):
+                logging.info('Retrying the engine load that failed')
+                self._engine_requested = time.monotonic()
+                future = self._engine = self.load_initial_engine()
+            return future
+
+    @property
+    def backend(self):
+        return self.engine.backend
+
+    @property
+    def feature_spec(self):
+        return self.engine.feature_spec
 
-        # Load the trained neural network model
-        model_path = 'models/malware_detector.h5'
-        self.model = load_model(model_path)
+    @property
+    def signatures(self):
+        return self.engine.signatures
 
-        # Load the scaler
-        scaler_path = 'models/scaler.pkl'
-        self.scaler = joblib.load(scaler_path)
+    @property
+    def cascade(self):
+        return self.engine.cascade
 
-        # Log the expected number of features
-        logging.debug(f"Scaler expects {self.scaler.n_features_in_} features.")
-        logging.debug(f"Model expects input shape: {self.model.input_shape}")
+    @property
+    def engine_version(self):
+        return self.engine.version
+
+    @property
+    def cache(self):
+        if self._cache is None and self.cache_path:
+            engine_version = self.engine_version
+            with self._cache_lock:
+                if self._cache is None:
+                    self._cache = ScanCache(self.cache_path, engine_version)
+        return self._cache
+
+    def flush_cache(self):
+        # Without loading the engine: nothing to flush if the cache was never opened
+        if self._cache is not None:
+            self._cache.flush()
 
     def scan_file(self, file_path):
+        [(_, message, status)] = self.scan_files([file_path], batch_size=1)
+        return message, status
+
+    def scan_files(self, file_paths, batch_size=64):
+        # Scan many files with one scaler/model call per batch.
+        # Yields (file_path, message, status) in the order the paths were given.
+        batch = []
+        try:
+            for file_path in file_paths:
+                batch.append((file_path, self.prepare_file(file_path)))
+                if len(batch) >= batch_size:
+                    yield from self.classify_batch(batch)
+                    batch = []
+            if batch:
+                yield from self.classify_batch(batch)
+        finally:
+            self.flush_cache()
+
+    def prepare_file(self, file_path):
+        # Returns either a final (message, status) result or a PreparedFile for the model
         if not os.path.isfile(file_path):
             return f'File not found: {file_path}', None
 
         try:
-            features = extract_features(file_path)
-            if features is not None:
-                # Reshape and scale features for prediction
-                features = features.reshape(1, -1)
-                logging.debug(f'Features shape: {features.shape}')
-                features = self.scaler.transform(features)
-                logging.debug(f'Scaled features shape: {features.shape}')
-
-                # Predict using the neural network
-                prediction = self.model.predict(features)
-                logging.debug(f'Prediction shape: {prediction.shape}')
-                probability = prediction[0][0]
-                logging.debug(f'Predicted probability: {probability}')
-                if probability > 0.5:
-                    self.quarantine_file(file_path)
-                    return f'Malware detected and quarantined: {file_path}', 'Quarantined'
-                else:
-                    return f'File is clean: {file_path}', 'Clean'
+            stat = os.stat(file_path)
+            result = self.cached_verdict(file_path, stat)
+            if result is not None:
+                return result
+
+            content_hash = None
+            if within_hash_limit(stat.st_size, self.max_hash_bytes):
+                md5_digest, content_hash = hash_file(file_path)
+                metrics.READ_BYTES.inc('hash', amount=stat.st_size)
+                result = self.match_hashes(file_path, md5_digest, content_hash)
+                if result is not None:
+                    return result
             else:
+                self.skipped_hash(file_path, stat.st_size)
+
+            engine = self.engine
+            sample = engine.feature_spec.read_sample(file_path, self.max_read_bytes)
+            metrics.READ_BYTES.inc('features', amount=len(sample))
+            if len(sample) == 0:
+                logging.error(f"No data in file: {file_path}")
                 return f'Could not extract features from {file_path}. Classified as Unknown.', 'Unknown'
+            # The sample starts with the file header, so recognising archives costs no extra read
+            if self.scan_archives and archive_kind(sample):
+                archive = sample_archive(file_path, engine.feature_spec, self.max_read_bytes, self.archive_limits)
+                if archive is not None:
+                    metrics.READ_BYTES.inc('archive', amount=archive.decompressed_bytes)
+                    result = self.match_members(file_path, archive, content_hash)
+                    if result is not None:
+                        return result
+                    return PreparedFile(None, stat, content_hash, archive.features, engine, archive)
+            return PreparedFile(sample, stat, content_hash, engine=engine)
         except Exception as e:
             logging.exception(f"Exception occurred during scanning of {file_path}")
-            error_message = f'Error scanning {file_path}: {str(e)}'
-            return error_message, 'Unknown'
+            return f'Error scanning {file_path}: {str(e)}', 'Unknown'
+
+    def cached_verdict(self, file_path, stat):
+        # Final result for an unchanged file that was scanned clean before, else None
+        if not self.cache:
+            return None
+        if self.cache.get(file_path, stat) == 'Clean':
+            metrics.CACHE_LOOKUPS.inc('hit')
+            return f'File is clean: {file_path}', 'Clean'
+        metrics.CACHE_LOOKUPS.inc('miss')
+        return None
+
+    def skipped_hash(self, file_path, size):
+        logging.warning(f'Not checking signatures of {file_path}: {size} bytes is over the hash limit '
+                        f'of {self.max_hash_bytes}')
+        metrics.UNHASHED_FILES.inc()
+
+    def match_hashes(self, file_path, md5_digest, sha256_digest):
+        # Signature and allowlist checks; returns a final (message, status) or None
+        signature = self.signatures.lookup(md5_digest, sha256_digest)
+        if signature is not None:
+            logging.info(f'Signature match {signature} for {file_path}')
+            metrics.SIGNATURE_MATCHES.inc()
+            return self.detected(file_path, f'Malware signature matched ({signature})', content_hash=sha256_digest)
+        if self.cascade and self.cascade.is_allowlisted(md5_digest, sha256_digest):
+            self.cascade.count('allowlist')
+            metrics.CASCADE_RESOLVED.inc('allowlist')
+            return f'File is clean: {file_path}', 'Clean'
+        return None
+
+    def match_members(self, file_path, archive, content_hash=None):
+        # Signature check of every archive member; a match names the member. The allowlist
+        # does not apply here: a known-good member says nothing about the rest of the archive.
+        for name, md5_digest, sha256_digest in archive.hashes:
+            signature = self.signatures.lookup(md5_digest, sha256_digest)
+            if signature is not None:
+                logging.info(f'Signature match {signature} for {name} in {file_path}')
+                metrics.SIGNATURE_MATCHES.inc()
+                return self.detected(file_path, f'Malware signature matched ({signature}) in {name}',
+                                     content_hash=content_hash)
+        return None
+
+    def batch_features(self, prepared_files, engine=None):
+        # Feature rows for a list of PreparedFile (PreparedFile.rows() each, in order);
+        # samples are featurised in one vectorised call
+        feature_spec = (engine or self.engine).feature_spec
+        missing = [j for j, prepared in enumerate(prepared_files) if prepared.features is None]
+        if len(missing) == len(prepared_files):
+            return feature_spec.features_from_samples(
+                [prepared.sample for prepared in prepared_files], [prepared.stat.st_size for prepared in prepared_files])
+        offsets = np.cumsum([0] + [prepared.rows() for prepared in prepared_files])
+        features = np.empty((offsets[-1], feature_spec.n_features), dtype=np.float32)
+        for j, prepared in enumerate(prepared_files):
+            if prepared.features is not None:
+                features[offsets[j]:offsets[j + 1]] = prepared.features
+        if missing:
+            features[offsets[missing]] = feature_spec.features_from_samples(
+                [prepared_files[j].sample for j in missing], [prepared_files[j].stat.st_size for j in missing])
+        return features
+
+    def classify_batch(self, batch):
+        # batch is a list of (file_path, prepared) pairs from prepare_file
+        pending = [i for i, (_, prepared) in enumerate(batch) if isinstance(prepared, PreparedFile)]
+        # Normally one group; two only for batches that straddle an engine swap
+        groups = {}
+        for i in pending:
+            engine = batch[i][1].engine or self.engine
+            groups.setdefault(engine, []).append(i)
+        probabilities = {}
+        errors = {}
+        for engine, indices in groups.items():
+            try:
+                # One vectorised feature computation for the whole batch
+                with metrics.FEATURE_SECONDS.time():
+                    features = self.batch_features([batch[i][1] for i in indices], engine)
+                if logging.root.isEnabledFor(logging.DEBUG):
+                    logging.debug(f'Features shape: {features.shape}')
+                with metrics.INFERENCE_SECONDS.time():
+                    group_probabilities = self.predict_cascade(features, engine) if len(features) else []
+                # Archives get one probability per member
+                offsets = np.cumsum([0] + [batch[i][1].rows() for i in indices])
+                for j, i in enumerate(indices):
+                    probabilities[i] = group_probabilities[offsets[j]:offsets[j + 1]]
+            except Exception as e:
+                logging.exception('Exception occurred during batch prediction')
+                errors.update(dict.fromkeys(indices, e))
+
+        for i, (file_path, prepared) in enumerate(batch):
+            if i in probabilities:
+                if prepared.archive is not None:
+                    message, status = self.archive_verdict(file_path, probabilities[i], prepared)
+                else:
+                    message, status = self.verdict(file_path, probabilities[i][0], prepared.content_hash)
+                # Verdicts of an engine swapped out mid-scan are not worth keeping
+                if status == 'Clean' and self.cache and (prepared.engine or self.engine) is self.engine:
+                    self.cache.put(prepared.stat, status, prepared.content_hash)
+            elif i in errors:
+                message, status = f'Error scanning {file_path}: {str(errors[i])}', 'Unknown'
+            else:
+                message, status = prepared
+            metrics.VERDICTS.inc(str(status))
+            yield file_path, message, status
+
+    def predict_cascade(self, features, engine=None):
+        # Linear tier first (if any); only rows it cannot decide go to the model
+        engine = engine or self.engine
+        cascade = engine.cascade
+        if cascade is None:
+            metrics.INFERENCE_FILES.inc(amount=len(features))
+            return self.predict(features, engine)
+        probabilities, escalate = cascade.split(features)
+        escalated = int(escalate.sum())
+        if escalated == len(features):
+            probabilities = self.predict(features, engine)
+        elif escalated:
+            probabilities[escalate] = self.predict(features[escalate], engine)
+        cascade.count('linear', len(features) - escalated)
+        cascade.count('model', escalated)
+        metrics.CASCADE_RESOLVED.inc('linear', amount=len(features) - escalated)
+        metrics.CASCADE_RESOLVED.inc('model', amount=escalated)
+        metrics.INFERENCE_FILES.inc(amount=escalated)
+        return probabilities
+
+    def predict(self, features, engine=None):
+        # Scale a (n, n_features) matrix and return n malware probabilities
+        return (engine or self.engine).backend.predict(features)
+
+    def verdict(self, file_path, probability, content_hash=None, member=None):
+        if logging.root.isEnabledFor(logging.DEBUG):
+            logging.debug(f'Predicted probability for {file_path}: {probability}')
+        if probability > 0.5:
+            reason = f'Malware detected in {member}' if member else 'Malware detected'
+            return self.detected(file_path, reason, float(probability), content_hash)
+        return f'File is clean: {file_path}', 'Clean'
+
+    def archive_verdict(self, file_path, probabilities, prepared):
+        # The archive is as bad as its worst member, and the verdict names that member
+        archive = prepared.archive
+        if len(probabilities):
+            worst = int(np.argmax(probabilities))
+            if probabilities[worst] > 0.5:
+                return self.verdict(file_path, probabilities[worst], prepared.content_hash, archive.names[worst])
+        if archive.incomplete:
+            return (f'Could not fully scan {file_path}: {archive.incomplete} ({len(archive.names)} scanned). '
+                    'Classified as Unknown.', 'Unknown')
+        return f'File is clean: {file_path}', 'Clean'
+
+    def detected(self, file_path, reason, probability=None, content_hash=None):
+        if not self.quarantine:
+            return f'{reason}: {file_path}', 'Detected'
+        self.quarantine_file(file_path, reason, probability, content_hash)
+        return f'{reason} and quarantined: {file_path}', 'Quarantined'
 
-    def quarantine_file(self, file_path):
+    def quarantine_file(self, file_path, verdict='Malware detected', probability=None, content_hash=None):
         try:
-            shutil.move(file_path, self.quarantine_dir)
+            with metrics.QUARANTINE_SECONDS.time():
+                self.quarantine_store.add(file_path, verdict, probability, content_hash)
+            metrics.QUARANTINE_MOVES.inc('ok')
             logging.info(f'File quarantined: {file_path}')
         except Exception as e:
+            metrics.QUARANTINE_MOVES.inc('failed')
             logging.error(f'Failed to quarantine {file_path}: {e}')
@@ -0,0 +1,221 @@
+# archive.py
+#
+# Containers (zip, tar and compressed tar) are scanned member by member without extracting
+# anything to disk. Each member is streamed through the feature spec's sampler, and the
+# archive's feature rows join the next model batch like any other file. Nested archives
+# are opened in memory. Every member is also read to its end and hashed, so signatures
+# match files inside archives too. Depth, member count and decompressed bytes are limited
+# per top-level archive, so a zip bomb costs at most the byte budget.
+
+import io
+import hashlib
+import tarfile
+import zipfile
+import logging
+from collections import namedtuple
+import numpy as np
+from feature_extractor import MAX_READ_BYTES
+from signature_db import HASH_CHUNK_SIZE
+
+ArchiveLimits = namedtuple('ArchiveLimits', 'max_depth max_members max_bytes',
+                           defaults=(3, 10000, 256 * 1024 * 1024))
+
+# Nested archives up to this size are unpacked in memory, larger ones are sampled as one member
+MAX_NESTED_BYTES = 32 * 1024 * 1024
+
+# Members sampled before their features are computed; bounds memory to one chunk of samples
+FEATURE_CHUNK = 64
+
+# Between the levels of a nested member name: 'outer/inner.zip!payload.exe'
+NESTED_SEPARATOR = '!'
+
+class ArchiveLimitExceeded(Exception):
+    pass
+
+def archive_kind(head):
+    # 'zip', 'tar' or None from the first bytes of a file. Compressed streams count as
+    # 'tar' here; tarfile decides whether they really hold one.
+    if head[:4] in (b'PK\x03\x04', b'PK\x05\x06'):
+        return 'zip'
+    if head[:2] == b'\x1f\x8b' or head[:3] == b'BZh' or head[:6] == b'\xfd7zXZ\x00' or head[257:262] == b'ustar':
+        return 'tar'
+    return None
+
+class MemberReader:
+    # read() over an archive member that charges every decompressed byte to the archive's
+    # budget and hashes it, and replays bytes already taken with peek()
+
+    def __init__(self, stream, archive):
+        self.stream = stream
+        self.archive = archive
+        self.buffer = b''
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def _read(self, size):
+        data = self.stream.read(size)
+        self.archive.charge(len(data))
+        self.md5.update(data)
+        self.sha256.update(data)
+        return data
+
+    def drain(self):
+        # Reads the rest of the member, so the digests cover all of it
+        while self._read(HASH_CHUNK_SIZE):
+            pass
+
+    def digests(self):
+        return self.md5.digest(), self.sha256.digest()
+
+    def peek(self, size):
+        if len(self.buffer) < size:
+            self.buffer += self._read(size - len(self.buffer))
+        return self.buffer[:size]
+
+    def read(self, size):
+        if not self.buffer:
+            return self._read(size)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        if len(data) < size:
+            data += self._read(size - len(data))
+        return data
+
+class ArchiveMembers:
+    # Feature rows of the members of one archive, in the order they were found, and the
+    # (name, md5, sha256) of every member read in full, nested archives included.
+    # incomplete says why unpacking stopped early (a limit, a corrupt container), else None.
+
+    def __init__(self, spec, limits, max_read_bytes):
+        self.spec = spec
+        self.limits = limits
+        self.max_read_bytes = max_read_bytes
+        self.names = []
+        self.hashes = []
+        self.member_count = 0
+        self.decompressed_bytes = 0
+        self.unreadable = 0
+        self.incomplete = None
+        self._blocks = []
+        self._samples, self._sizes = [], []
+        self.features = None
+
+    def __getstate__(self):
+        # Sent back from worker processes: only the results
+        return {'names': self.names, 'hashes': self.hashes, 'member_count': self.member_count,
+                'unreadable': self.unreadable, 'decompressed_bytes': self.decompressed_bytes, 'incomplete': self.incomplete,
+                'features': self.features}
+
+    def charge(self, size):
+        self.decompressed_bytes += size
+        if self.decompressed_bytes > self.limits.max_bytes:
+            raise ArchiveLimitExceeded(f'more than {self.limits.max_bytes} decompressed bytes')
+
+    def count_member(self):
+        self.member_count += 1
+        if self.member_count > self.limits.max_members:
+            raise ArchiveLimitExceeded(f'more than {self.limits.max_members} members')
+
+    def add(self, name, sample, size):
+        if not sample:
+            return
+        self.names.append(name)
+        self._samples.append(sample)
+        self._sizes.append(size)
+        if len(self._samples) >= FEATURE_CHUNK:
+            self._featurise()
+
+    def _featurise(self):
+        if self._samples:
+            self._blocks.append(self.spec.features_from_samples(self._samples, self._sizes))
+            self._samples, self._sizes = [], []
+
+    def finish(self):
+        self._featurise()
+        if self._blocks:
+            self.features = np.vstack(self._blocks).astype(np.float32, copy=False)
+        else:
+            self.features = np.empty((0, self.spec.n_features), dtype=np.float32)
+        self._blocks = []
+        return self
+
+    def scan_member(self, name, stream, size, depth):
+        reader = MemberReader(stream, self)
+        head = reader.peek(512)
+        if depth < self.limits.max_depth and size <= MAX_NESTED_BYTES and archive_kind(head):
+            data = reader.read(size)
+            reader.drain()
+            self.hashes.append((name, *reader.digests()))
+            try:
+                if self.scan_container(io.BytesIO(data), name + NESTED_SEPARATOR, depth + 1):
+                    return
+            except ArchiveLimitExceeded:
+                raise
+            except Exception as e:
+                logging.debug(f'{name} looked like an archive but could not be opened: {e}')
+            self.add(name, self.spec.read_sample_stream(io.BytesIO(data), len(data), self.max_read_bytes), size)
+            return
+        # Sampled before the rest is read, so a member that runs into the byte budget still
+        # gets a model verdict (the archive is then reported as incomplete)
+        self.add(name, self.spec.read_sample_stream(reader, size, self.max_read_bytes), size)
+        reader.drain()
+        self.hashes.append((name, *reader.digests()))
+
+    def scan_container(self, fileobj, prefix, depth):
+        # Samples every regular member; returns False if fileobj is not a zip or tar
+        head = fileobj.read(512)
+        fileobj.seek(0)
+        kind = archive_kind(head)
+        if kind == 'zip':
+            with zipfile.ZipFile(fileobj) as container:
+                for info in container.infolist():
+                    if info.is_dir():
+                        continue
+                    self.count_member()
+                    name = prefix + info.filename
+                    try:
+                        with container.open(info) as member:
+                            self.scan_member(name, member, info.file_size, depth)
+                    except ArchiveLimitExceeded:
+                        raise
+                    except Exception as e:
+                        # Encrypted, corrupt or unsupported members are reported, not fatal
+                        logging.warning(f'Cannot read archive member {name}: {e}')
+                        self.unreadable += 1
+            return True
+        if kind == 'tar':
+            try:
+                container = tarfile.open(fileobj=fileobj, mode='r|*')
+            except tarfile.TarError:
+                return False
+            with container:
+                for info in container:
+                    if not info.isfile():
+                        continue
+                    self.count_member()
+                    name = prefix + info.name
+                    self.scan_member(name, container.extractfile(info), info.size, depth)
+            return True
+        return False
+
+def sample_archive(file_path, spec, max_read_bytes=MAX_READ_BYTES, limits=None):
+    # ArchiveMembers for file_path, or None if it is not an archive (or holds no data to sample)
+    archive = ArchiveMembers(spec, limits or ArchiveLimits(), max_read_bytes)
+    try:
+        with open(file_path, 'rb') as f:
+            if not archive.scan_container(f, '', 1):
+                return None
+    except ArchiveLimitExceeded as e:
+        logging.warning(f'Stopped unpacking {file_path}: {e}')
+        archive.incomplete = str(e)
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        if not archive.names:
+            logging.debug(f'{file_path} could not be opened as an archive: {e}')
+            return None
+        archive.incomplete = f'corrupt archive ({e})'
+    if archive.unreadable and archive.incomplete is None:
+        # Encrypted members are the usual way to hide a payload from scanners: never Clean
+        archive.incomplete = f'{archive.unreadable} unreadable members'
+    archive.finish()
+    if not archive.names and archive.incomplete is None:
+        return None
+    return archive
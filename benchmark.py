@@ -0,0 +1,378 @@
+# benchmark.py
+#
+# Reproducible scanner benchmarks on synthetic file trees.
+#   python benchmark.py corpus DIR      generate a corpus only
+#   python benchmark.py suite           per-stage latency and end-to-end throughput as JSON
+#   python benchmark.py io              bytes read by feature extraction on large files
+#   python benchmark.py pipeline [DIR]  serial vs pipelined directory scan
+#   python benchmark.py processes [DIR] reader threads vs worker processes
+
+import os
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+from feature_extractor import extract_features, HEADER_BYTES
+
+def bytes_read_by_process():
+    # rchar counts every byte returned by read() calls (Linux only)
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('rchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+def legacy_extract_features(file_path):
+    # The original extractor: read the whole file, then keep the first 1024 bytes
+    with open(file_path, 'rb') as f:
+        content = f.read()
+    byte_array = np.frombuffer(content[:HEADER_BYTES], dtype=np.uint8)
+    byte_histogram = np.bincount(byte_array, minlength=256)
+    return (byte_histogram / byte_histogram.sum())[:54]
+
+def file_sizes(count, distribution, mean_kb, rng):
+    mean = mean_kb * 1024
+    if distribution == 'fixed':
+        sizes = np.full(count, mean)
+    elif distribution == 'uniform':
+        sizes = rng.uniform(0, 2 * mean, count)
+    elif distribution == 'lognormal':
+        # Heavy tail like real file systems; sigma=1.5 keeps the mean at mean_kb
+        sigma = 1.5
+        sizes = rng.lognormal(np.log(mean) - sigma ** 2 / 2, sigma, count)
+    else:
+        raise ValueError(f'Unknown size distribution: {distribution}')
+    return np.maximum(sizes.astype(np.int64), 1)
+
+def generate_corpus(directory, count=1000, distribution='lognormal', mean_kb=32, depth=2, fanout=10, seed=0):
+    # Deterministic for a given seed: same paths, sizes and contents
+    rng = np.random.default_rng(seed)
+    sizes = file_sizes(count, distribution, mean_kb, rng)
+    kinds = rng.choice(['random', 'text', 'sparse'], size=count, p=[0.5, 0.3, 0.2])
+    text_alphabet = np.frombuffer(b'abcdefghijklmnopqrstuvwxyz     \n0123456789', dtype=np.uint8)
+    paths = []
+    for i, (size, kind) in enumerate(zip(sizes, kinds)):
+        parts = [f'd{(i // fanout ** level) % fanout}' for level in range(1, depth + 1)]
+        subdirectory = os.path.join(directory, *parts)
+        os.makedirs(subdirectory, exist_ok=True)
+        path = os.path.join(subdirectory, f'file_{i}.{kind[:3]}')
+        with open(path, 'wb') as f:
+            if kind == 'random':
+                f.write(rng.bytes(int(size)))
+            elif kind == 'text':
+                f.write(rng.choice(text_alphabet, int(size)).tobytes())
+            else:
+                f.write(rng.bytes(min(int(size), HEADER_BYTES)))
+                f.truncate(int(size))
+        paths.append(path)
+    return paths
+
+def tree_size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, files in os.walk(directory) for name in files)
+
+def summarize(latencies):
+    # Latencies in seconds -> microsecond summary
+    if not latencies:
+        return {'count': 0}
+    values = np.asarray(latencies) * 1e6
+    return {
+        'count': len(values),
+        'mean_us': round(float(values.mean()), 2),
+        'p50_us': round(float(np.percentile(values, 50)), 2),
+        'p99_us': round(float(np.percentile(values, 99)), 2),
+        'max_us': round(float(values.max()), 2),
+    }
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+def measure_stages(antivirus, paths, batch_size):
+    stages = {name: [] for name in ('open_read', 'features_single', 'features_batch', 'predict_single',
+                                    'predict_batch', 'quarantine')}
+    spec = antivirus.feature_spec
+    samples, sizes = [], []
+    for path in paths:
+        sample, elapsed = timed(spec.read_sample, path)
+        stages['open_read'].append(elapsed)
+        if len(sample):
+            samples.append(sample)
+            sizes.append(os.path.getsize(path))
+
+    for sample, size in zip(samples[:1000], sizes):
+        _, elapsed = timed(spec.features_from_samples, [sample], [size])
+        stages['features_single'].append(elapsed)
+    features = []
+    for start in range(0, len(samples), batch_size):
+        batch, elapsed = timed(spec.features_from_samples, samples[start:start + batch_size], sizes[start:start + batch_size])
+        stages['features_batch'].append(elapsed)
+        features.append(batch)
+    features = np.vstack(features)
+    for row in features[:1000]:
+        _, elapsed = timed(antivirus.predict, row.reshape(1, -1))
+        stages['predict_single'].append(elapsed)
+    for start in range(0, len(features), batch_size):
+        _, elapsed = timed(antivirus.predict, features[start:start + batch_size])
+        stages['predict_batch'].append(elapsed)
+
+    # Scaling is its own stage only when the backend keeps a separate scaler
+    scaler = getattr(antivirus.backend, 'scaler', None)
+    if scaler is not None:
+        stages['scale'] = [timed(scaler.transform, features[start:start + batch_size])[1]
+                           for start in range(0, len(features), batch_size)]
+
+    # Quarantine moves copies of the files into a scratch quarantine store
+    from quarantine import QuarantineStore
+    scratch = tempfile.mkdtemp(prefix='av_quarantine_bench_')
+    original_store = antivirus.quarantine_store
+    antivirus.quarantine_store = QuarantineStore(os.path.join(scratch, 'quarantine'))
+    try:
+        for i, path in enumerate(paths[:200]):
+            copy = os.path.join(scratch, f'copy_{i}')
+            shutil.copyfile(path, copy)
+            _, elapsed = timed(antivirus.quarantine_file, copy)
+            stages['quarantine'].append(elapsed)
+    finally:
+        antivirus.quarantine_store.close()
+        antivirus.quarantine_store = original_store
+        shutil.rmtree(scratch)
+
+    result = {name: summarize(latencies) for name, latencies in stages.items()}
+    result['features_batch']['batch_size'] = batch_size
+    result['predict_batch']['batch_size'] = batch_size
+    result['feature_version'] = spec.version
+    return result
+
+def measure_throughput(antivirus, directory, workers, batch_size):
+    from scan_pipeline import ScanPipeline, walk_files
+
+    total_bytes = tree_size(directory)
+    runs = {
+        'scan_file_serial': lambda: [antivirus.scan_file(path) for path in walk_files(directory)],
+        'scan_files_batched': lambda: list(antivirus.scan_files(walk_files(directory), batch_size=batch_size)),
+        'pipeline': lambda: list(ScanPipeline(antivirus, workers=workers, batch_size=batch_size).scan_directory(directory)),
+    }
+    results = {}
+    for name, run in runs.items():
+        verdicts, elapsed = timed(run)
+        results[name] = {
+            'files': len(verdicts),
+            'seconds': round(elapsed, 4),
+            'files_per_second': round(len(verdicts) / elapsed, 1),
+            'mb_per_second': round(total_bytes / 1e6 / elapsed, 2),
+        }
+    return results
+
+def measure_realtime(event_count=20000, unique_paths=2000):
+    # Event queue overhead: puts with heavy duplication, then draining the coalesced paths
+    from real_time_protection import EventQueue
+
+    event_queue = EventQueue(quiet_period=0, max_pending=unique_paths)
+    put_latencies = []
+    for i in range(event_count):
+        _, elapsed = timed(event_queue.put, f'/watched/file_{i % unique_paths}')
+        put_latencies.append(elapsed)
+    drained, elapsed = timed(lambda: sum(len(event_queue.get_batch(256)) for _ in range(unique_paths // 256 + 1)))
+    return {
+        'put': summarize(put_latencies),
+        'events': event_count,
+        'coalesced': event_queue.coalesced,
+        'drained_paths': drained,
+        'drain_seconds': round(elapsed, 4),
+    }
+
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        revision = ''
+    return {
+        'revision': revision,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+def run_suite(args):
+    from antivirus import Antivirus
+
+    directory = args.directory or tempfile.mkdtemp(prefix='av_bench_')
+    try:
+        if not args.directory:
+            paths = generate_corpus(directory, args.count, args.distribution, args.mean_kb, args.depth, args.fanout, args.seed)
+        else:
+            from scan_pipeline import walk_files
+            paths = list(walk_files(directory))
+
+        # No cache and no quarantine, so every run does the same work on the same tree
+        antivirus = Antivirus(backend=args.backend, cache_path=None, quarantine=False)
+        report = {
+            'environment': environment(),
+            'corpus': {
+                'files': len(paths),
+                'bytes': tree_size(directory),
+                'distribution': args.distribution,
+                'mean_kb': args.mean_kb,
+                'depth': args.depth,
+                'seed': args.seed,
+            },
+            'backend': antivirus.backend.name,
+            'stages': measure_stages(antivirus, paths, args.batch_size),
+            'throughput': measure_throughput(antivirus, directory, args.workers, args.batch_size),
+            'realtime': measure_realtime(),
+        }
+    finally:
+        if not args.directory:
+            shutil.rmtree(directory)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f'Benchmark results written to {args.output}')
+    else:
+        print(output)
+
+def create_large_file_tree(directory, count, size_mb):
+    # Sparse files with a random header: cheap to create, expensive to read in full
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f'large_{i}.img')
+        with open(path, 'wb') as f:
+            f.write(os.urandom(HEADER_BYTES))
+            f.truncate(size_mb * 1024 * 1024)
+        paths.append(path)
+    return paths
+
+def measure_io(extract, paths):
+    rchar_before = bytes_read_by_process()
+    start = time.perf_counter()
+    for path in paths:
+        extract(path)
+    elapsed = time.perf_counter() - start
+    rchar_after = bytes_read_by_process()
+    read_bytes = rchar_after - rchar_before if rchar_before is not None else None
+    return elapsed, read_bytes
+
+def run_io_benchmark(count, size_mb):
+    directory = tempfile.mkdtemp(prefix='av_io_bench_')
+    try:
+        paths = create_large_file_tree(directory, count, size_mb)
+        results = {
+            'full read': measure_io(legacy_extract_features, paths),
+            'bounded read': measure_io(extract_features, paths),
+        }
+        print(f'{count} files x {size_mb} MB')
+        for name, (elapsed, read_bytes) in results.items():
+            read_mb = f'{read_bytes / 1e6:,.2f} MB' if read_bytes is not None else 'n/a'
+            print(f'{name:>13}: {elapsed:8.3f}s, read {read_mb}')
+    finally:
+        shutil.rmtree(directory)
+
+def run_pipeline_benchmark(directory, count, size_kb, depth, workers, batch_size):
+    from antivirus import Antivirus
+
+    generated = directory is None
+    if generated:
+        directory = tempfile.mkdtemp(prefix='av_scan_bench_')
+        generate_corpus(directory, count, 'fixed', size_kb, depth)
+    try:
+        # No cache and no quarantine, so both runs see the same tree and do the same work
+        antivirus = Antivirus(cache_path=None, quarantine=False)
+        results = measure_throughput(antivirus, directory, workers, batch_size)
+        for name, result in results.items():
+            print(f"{name:>18}: {result['seconds']:8.3f}s, {result['files_per_second']:10,.0f} files/s, "
+                  f"{result['mb_per_second']:8,.1f} MB/s")
+    finally:
+        if generated:
+            shutil.rmtree(directory)
+
+def run_process_benchmark(directory, count, size_kb, depth, worker_counts, batch_size):
+    from antivirus import Antivirus
+    from scan_pipeline import ScanPipeline, ProcessScanPipeline
+
+    generated = directory is None
+    if generated:
+        directory = tempfile.mkdtemp(prefix='av_process_bench_')
+        generate_corpus(directory, count, 'fixed', size_kb, depth)
+    try:
+        antivirus = Antivirus(cache_path=None, quarantine=False)
+        total_bytes = tree_size(directory)
+        print(f'{os.cpu_count()} CPUs, feature spec v{antivirus.feature_spec.version}')
+        for workers in worker_counts:
+            for mode, pipeline_class in (('threads', ScanPipeline), ('processes', ProcessScanPipeline)):
+                pipeline = pipeline_class(antivirus, workers=workers, batch_size=batch_size)
+                verdicts, elapsed = timed(lambda: list(pipeline.scan_directory(directory)))
+                print(f'{mode:>9} x{workers:<3}: {elapsed:8.3f}s, {len(verdicts) / elapsed:10,.0f} files/s, '
+                      f'{total_bytes / 1e6 / elapsed:8,.1f} MB/s')
+    finally:
+        if generated:
+            shutil.rmtree(directory)
+
+def add_corpus_arguments(parser):
+    parser.add_argument('--count', type=int, default=2000)
+    parser.add_argument('--distribution', default='lognormal', choices=['fixed', 'uniform', 'lognormal'])
+    parser.add_argument('--mean-kb', type=int, default=32)
+    parser.add_argument('--depth', type=int, default=2)
+    parser.add_argument('--fanout', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Scanner benchmarks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    corpus_parser = subparsers.add_parser('corpus', help='Generate a synthetic corpus')
+    corpus_parser.add_argument('directory')
+    add_corpus_arguments(corpus_parser)
+
+    suite_parser = subparsers.add_parser('suite', help='Per-stage latency and end-to-end throughput')
+    suite_parser.add_argument('directory', nargs='?', help='Existing tree to use (default: generate one)')
+    add_corpus_arguments(suite_parser)
+    suite_parser.add_argument('--backend', default='auto', choices=['auto', 'numpy', 'float16', 'keras'])
+    suite_parser.add_argument('--workers', type=int, default=4)
+    suite_parser.add_argument('--batch-size', type=int, default=256)
+    suite_parser.add_argument('--output', help='Write JSON results to this file')
+
+    io_parser = subparsers.add_parser('io', help='Bytes read by feature extraction on large files')
+    io_parser.add_argument('--count', type=int, default=8)
+    io_parser.add_argument('--size-mb', type=int, default=256)
+
+    pipeline_parser = subparsers.add_parser('pipeline', help='Directory scan throughput, serial vs pipelined')
+    pipeline_parser.add_argument('directory', nargs='?', help='Tree to scan (default: generate one)')
+    pipeline_parser.add_argument('--count', type=int, default=5000)
+    pipeline_parser.add_argument('--size-kb', type=int, default=16)
+    pipeline_parser.add_argument('--depth', type=int, default=2)
+    pipeline_parser.add_argument('--workers', type=int, default=4)
+    pipeline_parser.add_argument('--batch-size', type=int, default=256)
+
+    process_parser = subparsers.add_parser('processes', help='Directory scan throughput, threads vs processes')
+    process_parser.add_argument('directory', nargs='?', help='Tree to scan (default: generate one)')
+    process_parser.add_argument('--count', type=int, default=5000)
+    process_parser.add_argument('--size-kb', type=int, default=16)
+    process_parser.add_argument('--depth', type=int, default=2)
+    process_parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, os.cpu_count() or 4])
+    process_parser.add_argument('--batch-size', type=int, default=64)
+
+    args = parser.parse_args()
+    if args.command == 'corpus':
+        paths = generate_corpus(args.directory, args.count, args.distribution, args.mean_kb, args.depth, args.fanout, args.seed)
+        print(f'Generated {len(paths)} files ({tree_size(args.directory) / 1e6:,.1f} MB) in {args.directory}')
+    elif args.command == 'suite':
+        run_suite(args)
+    elif args.command == 'io':
+        run_io_benchmark(args.count, args.size_mb)
+    elif args.command == 'pipeline':
+        run_pipeline_benchmark(args.directory, args.count, args.size_kb, args.depth, args.workers, args.batch_size)
+    elif args.command == 'processes':
+        run_process_benchmark(args.directory, args.count, args.size_kb, args.depth, args.workers, args.batch_size)
@@ -0,0 +1,117 @@
+# cascade.py
+#
+# Cheap first tiers in front of the neural network:
+#   allowlist  known-good SHA-256/MD5 digests, resolved as Clean right after hashing
+#   linear     logistic regression on the same features (scaler folded in, like the .npz export)
+# Only files the linear tier is unsure about are escalated to the model.
+
+import os
+import time
+import threading
+import logging
+import numpy as np
+from signature_db import SignatureIndex
+from inference import MODEL_DIR
+
+CASCADE_PATH = os.path.join(MODEL_DIR, 'cascade.npz')
+ALLOWLIST_PATH = os.path.join(MODEL_DIR, 'allowlist.npz')
+
+class CascadeConfig:
+    def __init__(self, benign_threshold=0.02, malicious_threshold=None):
+        # Linear probability below benign_threshold -> Clean without running the model.
+        # Above malicious_threshold (if set) -> malware without running the model.
+        self.benign_threshold = benign_threshold
+        self.malicious_threshold = malicious_threshold
+
+class LinearTier:
+    def __init__(self, weights, bias, feature_version):
+        self.weights = np.asarray(weights, dtype=np.float32)
+        self.bias = np.float32(bias)
+        self.feature_version = feature_version
+        self.n_features = len(self.weights)
+
+    def predict(self, features):
+        logits = np.asarray(features, dtype=np.float32) @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-np.clip(logits, -50, 50)))
+
+    def save(self, path=CASCADE_PATH):
+        np.savez(path, weights=self.weights, bias=self.bias, feature_version=np.array(self.feature_version))
+
+    @classmethod
+    def load(cls, path=CASCADE_PATH):
+        with np.load(path) as data:
+            return cls(data['weights'], data['bias'], int(data['feature_version']))
+
+    @classmethod
+    def from_sklearn(cls, classifier, scaler, feature_version):
+        # Fold the StandardScaler into the weights: w . (x - mean) / scale + b
+        weights = classifier.coef_[0] / scaler.scale_
+        bias = classifier.intercept_[0] - np.dot(scaler.mean_ / scaler.scale_, classifier.coef_[0])
+        return cls(weights, bias, feature_version)
+
+class Cascade:
+    def __init__(self, linear=None, allowlist=None, config=None):
+        self.linear = linear
+        self.allowlist = allowlist
+        self.config = config or CascadeConfig()
+        self.resolved = {'allowlist': 0, 'linear': 0, 'model': 0}
+        self._lock = threading.Lock()
+
+    def count(self, tier, amount=1):
+        with self._lock:
+            self.resolved[tier] += amount
+
+    def is_allowlisted(self, md5_digest, sha256_digest):
+        return self.allowlist is not None and self.allowlist.lookup(md5_digest, sha256_digest) is not None
+
+    def split(self, features):
+        # Returns (probabilities from the linear tier, mask of rows it cannot decide)
+        if self.linear is None:
+            return None, np.ones(len(features), dtype=bool)
+        probabilities = self.linear.predict(features)
+        escalate = probabilities >= self.config.benign_threshold
+        if self.config.malicious_threshold is not None:
+            escalate &= probabilities <= self.config.malicious_threshold
+        return probabilities, escalate
+
+    def stats(self):
+        with self._lock:
+            resolved = dict(self.resolved)
+        total = sum(resolved.values())
+        return {tier: {'files': count, 'fraction': count / total if total else 0.0} for tier, count in resolved.items()}
+
+def load_cascade(feature_version, config=None, cascade_path=CASCADE_PATH, allowlist_path=ALLOWLIST_PATH):
+    # Returns None when no tier is available for this feature version
+    linear = None
+    if cascade_path and os.path.isfile(cascade_path):
+        linear = LinearTier.load(cascade_path)
+        if linear.feature_version != feature_version:
+            logging.warning(f'Ignoring {cascade_path}: trained on feature spec v{linear.feature_version}, '
+                            f'model uses v{feature_version}')
+            linear = None
+    allowlist = SignatureIndex.load(allowlist_path) if allowlist_path and os.path.isfile(allowlist_path) else None
+    if linear is None and allowlist is None:
+        return None
+    return Cascade(linear, allowlist, config)
+
+def evaluate_cascade(linear, model_predict, features, labels, thresholds=(0.0, 0.005, 0.01, 0.02, 0.05, 0.1)):
+    # Accuracy and throughput on a held-out set for each benign threshold (0.0 = model only)
+    features = np.asarray(features, dtype=np.float32)
+    labels = np.asarray(labels)
+    rows = []
+    for threshold in thresholds:
+        start = time.perf_counter()
+        cascade = Cascade(linear, config=CascadeConfig(benign_threshold=threshold))
+        probabilities, escalate = cascade.split(features)
+        if escalate.any():
+            probabilities[escalate] = model_predict(features[escalate])
+        elapsed = time.perf_counter() - start
+        predictions = (probabilities > 0.5).astype(int)
+        rows.append({
+            'benign_threshold': threshold,
+            'resolved_by_linear': float(1 - escalate.mean()),
+            'accuracy': float((predictions == labels).mean()),
+            'missed_malware': int(((predictions == 0) & (labels == 1)).sum()),
+            'files_per_second': len(labels) / elapsed if elapsed > 0 else float('inf'),
+        })
+    return rows
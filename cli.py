@@ -0,0 +1,232 @@
+# cli.py
+#
+# Headless scanner: python -m cli scan PATH... | daemon PATH | serve | quarantine list|restore|delete
+# Heavy modules are imported inside the commands that need them, so a scan never loads
+# the GUI, PDF or plotting libraries (nor TensorFlow unless --backend keras is chosen).
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import logging
+from scan_cache import CACHE_PATH
+
+EXIT_CLEAN = 0
+EXIT_THREATS = 1
+EXIT_ERROR = 2
+
+THREAT_STATUSES = ('Quarantined', 'Detected')
+
+def make_antivirus(args, quarantine=True):
+    from antivirus import Antivirus
+    return Antivirus(
+        backend=args.backend,
+        cache_path=None if args.no_cache else args.cache,
+        quarantine=quarantine and not args.no_quarantine,
+        max_hash_bytes=args.max_hash_bytes,
+        scan_archives=not args.no_archives)
+
+def print_result(args, file_path, message, status):
+    if args.json:
+        print(json.dumps({'path': file_path, 'status': status, 'message': message, 'time': time.time()}), flush=True)
+    elif status != 'Clean' or args.verbose:
+        print(message, flush=True)
+
+def make_rules(args, antivirus):
+    from scan_rules import ScanRules, default_rules, DEFAULT_PRUNE_DIRS
+    if args.no_default_excludes:
+        return ScanRules(args.exclude, args.include, prune_dirs=args.exclude_dir, max_size=args.max_size)
+    # The daemon's tree state is written while it watches; scans have none
+    state_path = None if getattr(args, 'no_state', True) else args.state
+    return default_rules(antivirus, state_path, exclude_globs=args.exclude, include_globs=args.include,
+                         prune_dirs=DEFAULT_PRUNE_DIRS + tuple(args.exclude_dir), max_size=args.max_size)
+
+def iter_targets(paths, rules=None):
+    # Rules apply to directory walks; files named on the command line are always scanned
+    from scan_pipeline import walk_files
+    for path in paths:
+        if os.path.isdir(path):
+            yield from walk_files(path, rules)
+        else:
+            yield path
+
+def run_scan(args):
+    from scan_pipeline import ScanPipeline, ProcessScanPipeline
+
+    antivirus = make_antivirus(args)
+    pipeline_class = ProcessScanPipeline if args.mode == 'processes' else ScanPipeline
+    pipeline = pipeline_class(antivirus, workers=args.workers, batch_size=args.batch_size)
+    threats = errors = 0
+    for file_path, message, status in pipeline.scan_paths(iter_targets(args.paths, make_rules(args, antivirus))):
+        print_result(args, file_path, message, status)
+        if status in THREAT_STATUSES:
+            threats += 1
+        elif status != 'Clean':
+            errors += 1
+
+    progress = pipeline.progress
+    summary = {
+        'files_scanned': progress.files_scanned,
+        'threats': threats,
+        'unknown': errors,
+        'files_per_second': round(progress.files_per_second(), 1),
+    }
+    if antivirus.cache:
+        summary['cache_hit_rate'] = round(antivirus.cache.hit_rate(), 4)
+    if antivirus.cascade:
+        summary['cascade'] = {tier: round(stats['fraction'], 4) for tier, stats in antivirus.cascade.stats().items()}
+    if args.json:
+        print(json.dumps({'summary': summary}), flush=True)
+    else:
+        print(', '.join(f'{key}: {value}' for key, value in summary.items()), file=sys.stderr)
+    return EXIT_THREATS if threats else EXIT_CLEAN
+
+def run_daemon(args):
+    from real_time_protection import RealTimeProtection
+
+    threats = []
+    def on_result(file_path, message, status):
+        print_result(args, file_path, message, status)
+        if status in THREAT_STATUSES:
+            threats.append(file_path)
+
+    antivirus = make_antivirus(args)
+    protection = RealTimeProtection(
+        args.path, workers=args.workers, batch_size=args.batch_size, quiet_period=args.quiet_period,
+        antivirus=antivirus, on_result=on_result, state_path=None if args.no_state else args.state,
+        rules=make_rules(args, antivirus))
+
+    stopping = []
+    def request_stop(signum, frame):
+        stopping.append(signum)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    protection.start()
+    while not stopping:
+        time.sleep(0.5)
+    protection.stop()
+    logging.info(f'Real-time protection stats: {protection.stats()}')
+    return EXIT_THREATS if threats else EXIT_CLEAN
+
+def run_serve(args):
+    import asyncio
+    from scan_service import ScanService, SOCKET_PATH
+
+    # Clients name the files, so the service only reports unless --quarantine is given
+    service = ScanService(
+        make_antivirus(args, quarantine=args.quarantine), args.socket or SOCKET_PATH, args.port,
+        batch_size=args.batch_size, max_delay=args.max_delay, io_workers=args.workers)
+    try:
+        asyncio.run(service.serve())
+    except KeyboardInterrupt:
+        pass
+    return EXIT_CLEAN
+
+def run_quarantine(args):
+    from quarantine import QuarantineStore
+
+    store = QuarantineStore(args.directory)
+    if args.action == 'list':
+        for entry in store.entries(args.limit):
+            if args.json:
+                print(json.dumps(entry._asdict()), flush=True)
+            else:
+                probability = '' if entry.probability is None else f'{entry.probability:.3f}'
+                quarantined_at = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(entry.quarantined_at))
+                print(f'{entry.id:>6}  {quarantined_at}  {probability:>5}  {entry.verdict}  {entry.original_path}')
+    elif args.action == 'restore':
+        print(f'Restored to {store.restore(args.id, args.to)}')
+    else:
+        store.delete(args.id)
+    return EXIT_CLEAN
+
+def add_rule_arguments(parser):
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB',
+                        help='Skip matching files and directories (a name, or a path if it contains /)')
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB',
+                        help='Only scan matching files')
+    parser.add_argument('--exclude-dir', action='append', default=[], metavar='NAME',
+                        help='Never walk directories with this name')
+    parser.add_argument('--max-size', type=int, metavar='BYTES', help='Skip larger files')
+    parser.add_argument('--no-default-excludes', action='store_true',
+                        help='Also walk .git, node_modules, caches and the app\'s own quarantine, log and databases')
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description='Headless neural network antivirus.')
+    parser.add_argument('--backend', default='auto', choices=['auto', 'numpy', 'float16', 'keras'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--json', action='store_true', help='Write one JSON object per verdict')
+    parser.add_argument('--verbose', action='store_true', help='Also print clean files')
+    parser.add_argument('--cache', default=CACHE_PATH, help='Verdict cache shared by all runs of this user (default: %(default)s)')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--no-quarantine', action='store_true', help='Report detections without moving files')
+    parser.add_argument('--max-hash-bytes', type=int, metavar='BYTES',
+                        help='Skip signature checks for larger files (default: hash every file in full)')
+    parser.add_argument('--no-archives', action='store_true', help='Scan zip and tar files as plain files')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--metrics', help='Write scan metrics on exit (.prom for Prometheus text, otherwise JSON)')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    scan_parser = subparsers.add_parser('scan', help='Scan files and directories, exit 1 if threats are found')
+    scan_parser.add_argument('paths', nargs='+')
+    scan_parser.add_argument('--mode', default='threads', choices=['threads', 'processes'],
+                             help='Extract features in reader threads or in --workers worker processes')
+    add_rule_arguments(scan_parser)
+    scan_parser.set_defaults(handler=run_scan)
+
+    daemon_parser = subparsers.add_parser('daemon', help='Run real-time protection until SIGINT/SIGTERM')
+    daemon_parser.add_argument('path', nargs='?', default='.')
+    daemon_parser.add_argument('--quiet-period', type=float, default=0.5)
+    daemon_parser.add_argument('--state', default='tree_state.db',
+                               help='Tree state used to scan files changed while the daemon was not running')
+    daemon_parser.add_argument('--no-state', action='store_true')
+    add_rule_arguments(daemon_parser)
+    daemon_parser.set_defaults(handler=run_daemon)
+
+    serve_parser = subparsers.add_parser('serve', help='Share one loaded model with local clients over a socket')
+    serve_parser.add_argument('--socket', help='Unix socket path (default: antivirus.sock in $XDG_RUNTIME_DIR '
+                                               'or a private per-user directory in the temp dir)')
+    serve_parser.add_argument('--port', type=int, help='Listen on localhost TCP instead of a Unix socket')
+    serve_parser.add_argument('--quarantine', action='store_true',
+                              help='Quarantine detected files (by default the service only reports them)')
+    serve_parser.add_argument('--max-delay', type=float, default=0.002, help='Seconds a request may wait for a batch')
+    serve_parser.set_defaults(handler=run_serve)
+
+    quarantine_parser = subparsers.add_parser('quarantine', help='List, restore or delete quarantined files')
+    quarantine_parser.add_argument('--directory', default='quarantine')
+    actions = quarantine_parser.add_subparsers(dest='action', required=True)
+    list_parser = actions.add_parser('list', help='Newest entries first')
+    list_parser.add_argument('--limit', type=int)
+    restore_parser = actions.add_parser('restore')
+    restore_parser.add_argument('id', type=int)
+    restore_parser.add_argument('--to', help='Restore here instead of the original path')
+    delete_parser = actions.add_parser('delete')
+    delete_parser.add_argument('id', type=int)
+    quarantine_parser.set_defaults(handler=run_quarantine)
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s:%(message)s')
+    try:
+        return args.handler(args)
+    except Exception as e:
+        logging.error(f'{args.command} failed: {e}', exc_info=True)
+        return EXIT_ERROR
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics)
+
+def write_metrics(path):
+    from metrics import REGISTRY
+    if path.endswith('.prom'):
+        REGISTRY.write_prometheus(path)
+    else:
+        REGISTRY.write_json(path)
+
+if __name__ == '__main__':
+    sys.exit(main())
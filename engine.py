@@ -0,0 +1,115 @@
+# engine.py
+#
+# The read-only scan engine: inference backend, feature spec, signatures and cascade,
+# all read from one artifact directory (models/ or a bundle from model_bundle.py).
+# Engines are loaded in a background thread, at most once per process for a given
+# directory and backend/cascade setting, and shared by every Antivirus that asks for them.
+
+import os
+import time
+import threading
+import logging
+import numpy as np
+from concurrent.futures import Future
+from feature_extractor import get_feature_spec
+from inference import load_backend, artifact_version, MODEL_DIR, MODEL_PATH, SCALER_PATH, NPZ_PATH
+from cascade import load_cascade, CASCADE_PATH, ALLOWLIST_PATH
+from signature_db import load_signatures, SIGNATURE_PATH
+from model_bundle import verify_bundle, BundleError, MANIFEST_NAME
+
+class Engine:
+    def __init__(self, backend='auto', cascade_config=None, model_dir=MODEL_DIR):
+        started = time.perf_counter()
+        self.model_dir = model_dir
+
+        def artifact(default_path):
+            return os.path.join(model_dir, os.path.basename(default_path))
+
+        # Bundles are checked against their manifest before anything is loaded from them
+        self.bundle_version = None
+        if os.path.isfile(os.path.join(model_dir, MANIFEST_NAME)):
+            self.bundle_version = verify_bundle(model_dir)['version']
+
+        # Load the trained model ('numpy' avoids importing TensorFlow, 'keras' uses the .h5 model)
+        self.backend = load_backend(backend, artifact(MODEL_PATH), artifact(SCALER_PATH), artifact(NPZ_PATH))
+
+        # Extract exactly the feature spec version the model was trained on
+        self.feature_spec = get_feature_spec(self.backend.feature_version)
+        # An engine that cannot classify fails to load instead of reporting ready
+        self.validate()
+
+        # Known-bad hashes are checked before the model runs
+        self.signatures = load_signatures(artifact(SIGNATURE_PATH))
+
+        # Optional allowlist and linear tier that resolve obvious files before the model
+        cascade_path, allowlist_path = artifact(CASCADE_PATH), artifact(ALLOWLIST_PATH)
+        self.cascade = load_cascade(self.feature_spec.version, cascade_config, cascade_path, allowlist_path)
+
+        # Verdicts for unchanged files are reused until the model, signatures or cascade change
+        self.version = f'{self.backend.version}-{self.signatures.version()}'
+        cascade_files = [path for path in (cascade_path, allowlist_path) if self.cascade and os.path.isfile(path)]
+        if cascade_files:
+            self.version += f'-{artifact_version(*cascade_files)}'
+
+        self.load_seconds = time.perf_counter() - started
+        logging.info(f'Loaded {self.backend.name} engine {self.version} from {model_dir} in {self.load_seconds:.3f}s')
+
+    def validate(self):
+        # Raises BundleError if this engine cannot scan (every engine is checked when it loads)
+        if self.feature_spec.n_features != self.backend.n_features:
+            raise BundleError(f'Feature spec v{self.feature_spec.version} yields {self.feature_spec.n_features} '
+                              f'features but the model expects {self.backend.n_features}')
+        probabilities = self.backend.predict(np.zeros((2, self.backend.n_features), dtype=np.float32))
+        if len(probabilities) != 2 or not np.all(np.isfinite(probabilities)):
+            raise BundleError('Model returned invalid probabilities')
+
+# (model_dir, backend, cascade thresholds) -> Future of the shared Engine
+_engines = {}
+_engines_lock = threading.Lock()
+
+def _engine_key(backend, cascade_config, model_dir):
+    if cascade_config is None:
+        return model_dir, backend, None
+    return model_dir, backend, (cascade_config.benign_threshold, cascade_config.malicious_threshold)
+
+def _load(future, backend, cascade_config, model_dir):
+    try:
+        future.set_result(Engine(backend, cascade_config, model_dir))
+    except BaseException as e:
+        logging.error(f'Failed to load the {backend} engine from {model_dir}: {e}', exc_info=True)
+        future.set_exception(e)
+
+def load_engine_async(backend='auto', cascade_config=None, model_dir=MODEL_DIR):
+    # Returns a Future; the first caller starts the load, later callers share it.
+    # A failed load is retried by the next caller.
+    key = _engine_key(backend, cascade_config, model_dir)
+    with _engines_lock:
+        future = _engines.get(key)
+        if future is None or (future.done() and future.exception() is not None):
+            future = _engines[key] = Future()
+            threading.Thread(target=_load, args=(future, backend, cascade_config, model_dir),
+                             name='engine-loader', daemon=True).start()
+    return future
+
+def load_engine(backend='auto', cascade_config=None, model_dir=MODEL_DIR):
+    return load_engine_async(backend, cascade_config, model_dir).result()
+
+def clear_engines():
+    # Forget loaded engines so the next request reads the artifacts again
+    with _engines_lock:
+        _engines.clear()
+
+def evict_engines(keep_dirs):
+    # Drop registry entries for every other model directory, so a long-running process holds
+    # the engines it uses instead of one per definition update. Engines still referenced
+    # elsewhere stay alive until those references go.
+    keep_dirs = {os.path.abspath(model_dir) for model_dir in keep_dirs}
+    with _engines_lock:
+        for key in [key for key in _engines if os.path.abspath(key[0]) not in keep_dirs]:
+            del _engines[key]
+
+def engine_future(engine):
+    # A completed Future holding an already loaded engine
+    future = Future()
+    future.set_result(engine)
+    return future
@@ -1,34 +1,214 @@
 # feature_extractor.py
+#
+# Feature specs are versioned: a model is trained on one spec version and the scanner
+# must extract exactly that version. Each spec separates bounded file I/O (read_sample)
+# from feature computation (features_from_samples), which runs vectorised over a batch.
 
+import os
+import mmap
 import numpy as np
 import logging
 
-def extract_features(file_path):
-    try:
+# Spec used for new training runs
+LATEST_FEATURE_VERSION = 2
+
+# Number of leading bytes the version 1 histogram features are computed from
+HEADER_BYTES = 1024
+
+# Hard cap on bytes read from any single file, whatever the feature window
+MAX_READ_BYTES = 64 * 1024 * 1024
+
+# Windows larger than this are mapped instead of copied with read()
+MMAP_THRESHOLD = 1024 * 1024
+
+def read_window(file_path, size, max_bytes=MAX_READ_BYTES):
+    # Read at most min(size, max_bytes) bytes from the start of the file
+    size = min(size, max_bytes)
+    with open(file_path, 'rb') as f:
+        if size <= MMAP_THRESHOLD:
+            return f.read(size)
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:size]
+        except ValueError:
+            # Empty files cannot be mapped
+            return b''
+
+def skip_stream(stream, count, chunk_size=1024 * 1024):
+    # Forward-only streams (archive members) cannot seek, so skipped bytes are read and dropped
+    while count > 0:
+        chunk = stream.read(min(count, chunk_size))
+        if not chunk:
+            return
+        count -= len(chunk)
+
+def batch_histograms(samples, groups_per_sample=None, group_ids=None):
+    # Byte counts for every sample in one np.bincount call.
+    # Returns an (n, 256) matrix, or (n * groups_per_sample, 256) when bytes are split into groups.
+    lengths = np.fromiter((len(sample) for sample in samples), dtype=np.int64, count=len(samples))
+    data = np.frombuffer(b''.join(samples), dtype=np.uint8).astype(np.int64)
+    rows = np.repeat(np.arange(len(samples), dtype=np.int64), lengths)
+    if groups_per_sample is not None:
+        rows = rows * groups_per_sample + group_ids
+    bins = len(samples) * (groups_per_sample or 1)
+    return np.bincount(rows * 256 + data, minlength=bins * 256).reshape(bins, 256)
+
+# c * log2(c) for every count a sample window can hold, so entropy needs no per-element log
+_C_LOG_C = np.zeros(3 * 4096 + 1)
+_C_LOG_C[1:] = np.arange(1, len(_C_LOG_C)) * np.log2(np.arange(1, len(_C_LOG_C)))
+
+def normalized_entropy(counts):
+    # Shannon entropy of each row of byte counts, scaled to [0, 1] (8 bits = 1):
+    # H = log2(T) - sum(c * log2(c)) / T
+    totals = counts.sum(axis=-1)
+    if counts.max(initial=0) < len(_C_LOG_C):
+        c_log_c = _C_LOG_C[counts].sum(axis=-1)
+    else:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c_log_c = np.where(counts > 0, counts * np.log2(counts), 0.0).sum(axis=-1)
+    safe_totals = np.maximum(totals, 1)
+    return np.maximum(np.log2(safe_totals) - c_log_c / safe_totals, 0.0) / 8.0
+
+class HeaderHistogramSpec:
+    # Version 1: normalized byte histogram of the first 1024 bytes, first 54 bins only
+    version = 1
+    n_features = 54
+
+    def read_sample(self, file_path, max_bytes=MAX_READ_BYTES):
+        return read_window(file_path, HEADER_BYTES, max_bytes)
+
+    def read_sample_stream(self, stream, size, max_bytes=MAX_READ_BYTES):
+        return stream.read(min(HEADER_BYTES, size, max_bytes))
+
+    def features_from_samples(self, samples, sizes=None):
+        counts = batch_histograms(samples)
+        histograms = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+        return histograms[:, :self.n_features].astype(np.float32)
+
+class SampledEntropySpec:
+    # Version 2, per file:
+    #   256  normalized byte histogram over the head, middle and tail windows
+    #     1  entropy of all sampled bytes
+    #     3  entropy of the head, middle and tail windows
+    #     4  min / max / mean / std of entropy over 256-byte blocks of the sample
+    #     1  log2(file size) / 64
+    version = 2
+    n_features = 265
+    window_bytes = 4096
+    block_bytes = 256
+    # Files per vectorised step; keeps the (files, blocks, 256) count matrix a few MB
+    chunk_files = 64
+
+    def window_offsets(self, limit):
+        # Start of the head, middle and tail windows within the first limit bytes
+        window = self.window_bytes
+        return 0, limit // 2 - window // 2, limit - window
+
+    def read_sample(self, file_path, max_bytes=MAX_READ_BYTES):
+        # Head, middle and tail windows via seek; small files are read whole
+        window = self.window_bytes
         with open(file_path, 'rb') as f:
-            content = f.read()
-            if len(content) == 0:
-                logging.error(f"No data in file: {file_path}")
-                return None
+            size = os.fstat(f.fileno()).st_size
+            limit = min(size, max_bytes)
+            if limit <= 3 * window:
+                return f.read(limit)
+            parts = []
+            for offset in self.window_offsets(limit):
+                f.seek(offset)
+                parts.append(f.read(window))
+            return b''.join(parts)
+
+    def read_sample_stream(self, stream, size, max_bytes=MAX_READ_BYTES):
+        # The same windows from a forward-only stream of size bytes (an archive member)
+        window = self.window_bytes
+        limit = min(size, max_bytes)
+        if limit <= 3 * window:
+            return stream.read(limit)
+        parts = []
+        position = 0
+        for offset in self.window_offsets(limit):
+            skip_stream(stream, offset - position)
+            parts.append(stream.read(window))
+            position = offset + window
+        return b''.join(parts)
+
+    def features_from_samples(self, samples, sizes=None):
+        if sizes is None:
+            sizes = [len(sample) for sample in samples]
+        if len(samples) > self.chunk_files:
+            step = self.chunk_files
+            return np.vstack([self.features_from_samples(samples[i:i + step], sizes[i:i + step])
+                              for i in range(0, len(samples), step)])
+
+        n = len(samples)
+        window, block = self.window_bytes, self.block_bytes
+        lengths = np.fromiter((len(sample) for sample in samples), dtype=np.int64, count=n)
+        # Position of every byte inside its own sample
+        offsets = np.arange(lengths.sum(), dtype=np.int64) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+
+        # One bincount over 256-byte blocks; window and whole-sample counts are sums of blocks
+        blocks_per_window = window // block
+        blocks_per_sample = 3 * blocks_per_window
+        block_counts = batch_histograms(samples, blocks_per_sample, offsets // block).reshape(n, blocks_per_sample, 256)
+        window_counts = block_counts.reshape(n, 3, blocks_per_window, 256).sum(axis=2)
+        counts = window_counts.sum(axis=1)
 
-        # Limit to the first N bytes (e.g., 1024 bytes)
-        content = content[:1024]
+        # Whole-sample histogram and entropy
+        histograms = counts / np.maximum(counts.sum(axis=1, keepdims=True), 1)
+        sample_entropy = normalized_entropy(counts)
 
-        # Convert to numpy array
-        byte_array = np.frombuffer(content, dtype=np.uint8)
+        # Head / middle / tail windows (the sample is the three windows back to back)
+        window_entropy = normalized_entropy(window_counts)
 
-        # Calculate byte histogram (256 bins)
-        byte_histogram = np.bincount(byte_array, minlength=256)
-        histogram_sum = byte_histogram.sum()
-        if histogram_sum == 0:
-            logging.error(f"Empty byte histogram for file: {file_path}")
-            return None
-        byte_histogram = byte_histogram / histogram_sum  # Normalize
+        # Sliding 256-byte blocks; blocks past the end of a sample are empty and masked out
+        block_entropy = normalized_entropy(block_counts)
+        valid = block_counts.sum(axis=2) > 0
+        block_count = np.maximum(valid.sum(axis=1), 1)
+        block_mean = np.where(valid, block_entropy, 0).sum(axis=1) / block_count
+        block_std = np.sqrt(np.where(valid, (block_entropy - block_mean[:, None]) ** 2, 0).sum(axis=1) / block_count)
+        block_min = np.where(valid, block_entropy, 1.0).min(axis=1)
+        block_max = np.where(valid, block_entropy, 0.0).max(axis=1)
 
-        # Select the first 54 features if needed
-        features = byte_histogram[:54]
+        log_size = np.log2(np.maximum(np.asarray(sizes, dtype=np.float64), 1)) / 64.0
 
-        return features
+        return np.column_stack([
+            histograms, sample_entropy, window_entropy,
+            block_min, block_max, block_mean, block_std, log_size,
+        ]).astype(np.float32)
+
+FEATURE_SPECS = {spec.version: spec for spec in (HeaderHistogramSpec(), SampledEntropySpec())}
+
+def get_feature_spec(version):
+    try:
+        return FEATURE_SPECS[version]
+    except KeyError:
+        raise ValueError(f'Unknown feature spec version: {version}') from None
+
+def extract_features_batch(file_paths, version=LATEST_FEATURE_VERSION, max_bytes=MAX_READ_BYTES):
+    # Returns (features, paths) for the files that had data; unreadable or empty files are skipped
+    spec = get_feature_spec(version)
+    samples, sizes, extracted = [], [], []
+    for file_path in file_paths:
+        try:
+            sample = spec.read_sample(file_path, max_bytes)
+            size = os.path.getsize(file_path)
+        except OSError as e:
+            logging.error(f"Error extracting features from {file_path}: {e}")
+            continue
+        if len(sample) == 0:
+            logging.error(f"No data in file: {file_path}")
+            continue
+        samples.append(sample)
+        sizes.append(size)
+        extracted.append(file_path)
+    if not samples:
+        return np.empty((0, spec.n_features), dtype=np.float32), []
+    return spec.features_from_samples(samples, sizes), extracted
+
+def extract_features(file_path, max_bytes=MAX_READ_BYTES, version=1):
+    try:
+        features, extracted = extract_features_batch([file_path], version, max_bytes)
+        return features[0] if extracted else None
     except Exception as e:
         logging.error(f"Error extracting features from {file_path}: {e}", exc_info=True)
         return None
@@ -0,0 +1,174 @@
+# feature_store.py
+#
+# On-disk training features: <store_dir>/v<feature version>/ holds
+#   features-<generation>.f32   float32 matrix, one row per sample (memory-mapped on load)
+#   index-<generation>.csv      path, label, size, mtime_ns for each row
+#   manifest.json               feature version, row and column counts, and the data file names
+#
+# Every build writes new data files and then replaces manifest.json; that rename is the commit
+# point, so a crash mid-build leaves the previous manifest and the files it names untouched.
+
+import os
+import re
+import csv
+import json
+import time
+import argparse
+import logging
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from feature_extractor import extract_features_batch, LATEST_FEATURE_VERSION
+
+STORE_DIR = 'data/features'
+MANIFEST_NAME = 'manifest.json'
+DATA_FILE_PATTERN = re.compile(r'(features|index)(-\d+)?\.(f32|csv)$')
+
+def version_dir(store_dir, version):
+    return os.path.join(store_dir, f'v{version}')
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    # Stores built before data files were versioned use fixed names
+    manifest.setdefault('features', 'features.f32')
+    manifest.setdefault('index', 'index.csv')
+    manifest.setdefault('generation', 0)
+    return manifest
+
+def write_manifest(directory, manifest):
+    manifest_tmp = os.path.join(directory, f'{MANIFEST_NAME}.tmp')
+    with open(manifest_tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_tmp, os.path.join(directory, MANIFEST_NAME))
+
+def remove_unreferenced(directory, manifest):
+    # Data files of earlier generations, or of builds that crashed before their manifest was written
+    for name in os.listdir(directory):
+        if DATA_FILE_PATTERN.match(name) and name not in (manifest['features'], manifest['index']):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError as e:
+                logging.warning(f'Could not remove old feature data {name}: {e}')
+
+def extract_chunk(args):
+    # Process pool task: vectorised extraction of one chunk, aligned with the input paths
+    paths, version = args
+    features, extracted = extract_features_batch(paths, version)
+    by_path = dict(zip(extracted, features))
+    return [by_path.get(path) for path in paths]
+
+def collect_files(sources):
+    # sources is a list of (directory, label); directories are walked recursively
+    entries = []
+    for directory, label in sources:
+        for root, _, files in os.walk(directory):
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, label, stat.st_size, stat.st_mtime_ns))
+    return entries
+
+def load_feature_store(store_dir=STORE_DIR, version=LATEST_FEATURE_VERSION, mode='r'):
+    # Returns (features memmap, labels, paths) without reading the matrix into memory
+    directory = version_dir(store_dir, version)
+    manifest = read_manifest(directory)
+    if manifest['feature_version'] != version:
+        raise ValueError(f"Feature store version {manifest['feature_version']} does not match {version}")
+
+    paths, labels = [], []
+    with open(os.path.join(directory, manifest['index']), newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            paths.append(row['path'])
+            labels.append(int(row['label']))
+
+    shape = (manifest['rows'], manifest['columns'])
+    if manifest['rows'] == 0:
+        return np.empty(shape, dtype=np.float32), np.array(labels, dtype=np.int8), paths
+    features = np.memmap(os.path.join(directory, manifest['features']), dtype=np.float32, mode=mode, shape=shape)
+    return features, np.array(labels, dtype=np.int8), paths
+
+def load_previous_rows(store_dir, version):
+    # path -> (size, mtime_ns, row) for the existing store, its memmap and its generation
+    directory = version_dir(store_dir, version)
+    try:
+        features, _, _ = load_feature_store(store_dir, version)
+        manifest = read_manifest(directory)
+    except (OSError, ValueError, KeyError):
+        return {}, None, 0
+    previous = {}
+    with open(os.path.join(directory, manifest['index']), newline='', encoding='utf-8') as f:
+        for row_number, row in enumerate(csv.DictReader(f)):
+            previous[row['path']] = (int(row['size']), int(row['mtime_ns']), row_number)
+    return previous, features, manifest['generation']
+
+def build_feature_store(sources, store_dir=STORE_DIR, workers=None, chunksize=64, version=LATEST_FEATURE_VERSION):
+    directory = version_dir(store_dir, version)
+    os.makedirs(directory, exist_ok=True)
+    started = time.perf_counter()
+
+    entries = collect_files(sources)
+    previous, previous_features, previous_generation = load_previous_rows(store_dir, version)
+
+    # Only files that are new or changed since the last build go through the process pool
+    changed = [path for path, _, size, mtime_ns in entries
+               if previous.get(path, (None, None))[:2] != (size, mtime_ns)]
+    logging.info(f'{len(entries)} files, {len(changed)} new or changed')
+
+    # New data files are unreferenced until the manifest naming them replaces the old one
+    generation = previous_generation + 1
+    features_name = f'features-{generation}.f32'
+    index_name = f'index-{generation}.csv'
+    rows = 0
+    columns = previous_features.shape[1] if previous_features is not None else None
+    with ProcessPoolExecutor(max_workers=workers) as pool, \
+            open(os.path.join(directory, features_name), 'wb') as features_file, \
+            open(os.path.join(directory, index_name), 'w', newline='', encoding='utf-8') as index_file:
+        chunks = [(changed[i:i + chunksize], version) for i in range(0, len(changed), chunksize)]
+        extracted = (vector for vectors in pool.map(extract_chunk, chunks) for vector in vectors)
+        writer = csv.writer(index_file)
+        writer.writerow(['path', 'label', 'size', 'mtime_ns'])
+        for path, label, size, mtime_ns in entries:
+            cached = previous.get(path)
+            if cached is not None and cached[:2] == (size, mtime_ns):
+                vector = previous_features[cached[2]]
+            else:
+                vector = next(extracted)
+                if vector is None:
+                    continue
+            if columns is None:
+                columns = len(vector)
+            features_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+            writer.writerow([path, label, size, mtime_ns])
+            rows += 1
+        features_file.flush()
+        os.fsync(features_file.fileno())
+        index_file.flush()
+        os.fsync(index_file.fileno())
+
+    del previous_features
+    manifest = {'feature_version': version, 'rows': rows, 'columns': columns or 0, 'created': time.time(),
+                'generation': generation, 'features': features_name, 'index': index_name}
+    write_manifest(directory, manifest)
+    remove_unreferenced(directory, manifest)
+
+    logging.info(f'Feature store {directory}: {rows} rows, {len(changed)} extracted in {time.perf_counter() - started:.1f}s')
+    return manifest
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or update the training feature store.')
+    parser.add_argument('--benign', default='data/benign')
+    parser.add_argument('--malware', default='data/malware')
+    parser.add_argument('--store', default=STORE_DIR)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--feature-version', type=int, default=LATEST_FEATURE_VERSION)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s:%(message)s')
+    manifest = build_feature_store([(args.benign, 0), (args.malware, 1)], args.store, args.workers,
+                                   version=args.feature_version)
+    print(f"Feature store has {manifest['rows']} samples with {manifest['columns']} features.")
@@ -6,13 +6,14 @@ from ttkbootstrap.constants import *
 from tkinter import filedialog, messagebox, END
 import threading
 from antivirus import Antivirus
-import shutil
+from scan_pipeline import ScanPipeline, ProcessScanPipeline
+from scan_rules import default_rules
+from history import ThreatHistory, export_csv, export_pdf, PAGE_SIZE
 import time
-from datetime import datetime
+from datetime import datetime, timedelta
 from concurrent.futures import ThreadPoolExecutor
+from collections import deque
 import logging
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
 
 try:
     from plyer import notification
@@ -27,6 +28,60 @@ except ImportError:
     pystray = None
     print("Warning: 'pystray' module not found. System tray icon will be disabled.")
 
+# The Tk loop applies queued updates this often, whatever the scan rate
+UPDATE_INTERVAL_MS = 100
+
+# The newest threat history page is reloaded at most this often while threats come in
+HISTORY_REFRESH_SECONDS = 0.5
+
+# Lines kept in the scan output box; older lines are trimmed
+MAX_LOG_LINES = 5000
+
+class UiUpdates:
+    # Scan threads publish here instead of touching widgets. Each frame the Tk loop takes
+    # everything at once: the newest log lines (at most MAX_LOG_LINES), the latest value of
+    # each progress bar and any queued calls, so per-frame work does not grow with scan rate.
+
+    def __init__(self, max_lines=MAX_LOG_LINES):
+        self._lock = threading.Lock()
+        self._lines = deque(maxlen=max_lines)
+        self._dropped = 0
+        self._progress = {}
+        self._calls = []
+        self._last_scan = None
+
+    def log(self, line):
+        with self._lock:
+            if len(self._lines) == self._lines.maxlen:
+                self._dropped += 1
+            self._lines.append(line)
+
+    def progress(self, key, value, maximum):
+        with self._lock:
+            self._progress[key] = (value, maximum)
+
+    def finish(self, key):
+        # None removes the bar on the next frame
+        with self._lock:
+            self._progress[key] = None
+
+    def scanned(self):
+        with self._lock:
+            self._last_scan = datetime.now()
+
+    def call(self, function, *args):
+        with self._lock:
+            self._calls.append((function, args))
+
+    def drain(self):
+        with self._lock:
+            lines, self._lines = list(self._lines), deque(maxlen=self._lines.maxlen)
+            dropped, self._dropped = self._dropped, 0
+            progress, self._progress = self._progress, {}
+            calls, self._calls = self._calls, []
+            last_scan, self._last_scan = self._last_scan, None
+        return lines, dropped, progress, calls, last_scan
+
 class AntivirusGUI:
     def __init__(self, master):
         self.master = master
@@ -39,13 +94,28 @@ class AntivirusGUI:
 
         self.antivirus = Antivirus()
         self.executor = ThreadPoolExecutor(max_workers=5)
+        self.scan_batch_size = 64
+        self.scan_workers = 4
+        # Directory scans extract features in this many worker processes (0: reader threads)
+        self.scan_processes = 0
+        # Skips .git, node_modules, caches and the app's own quarantine, log and databases;
+        # executables and recent downloads are scanned first
+        self.scan_rules = default_rules(self.antivirus)
         self.notifications = []
-        self.threat_history = []
-
-        # Configure logging
+        # Only the Tk thread touches widgets; everything else goes through this queue
+        self.updates = UiUpdates()
+        self.progress_bars = {}
+        # Persistent threat history; the tab shows one page of it at a time
+        self.history = ThreatHistory()
+        self.history.listeners.append(self.on_history_recorded)
+        self.antivirus.engine_listeners.append(lambda engine: self.updates.call(self.show_engine_status))
+        self.history_dirty = False
+        self.history_refreshed = 0.0
+
+        # Configure logging (DEBUG formats several lines per scanned file, so it is opt-in)
         logging.basicConfig(
             filename='antivirus.log',
-            level=logging.DEBUG,
+            level=os.environ.get('ANTIVIRUS_LOG_LEVEL', 'INFO').upper(),
             format='%(asctime)s %(levelname)s:%(message)s',
             encoding='utf-8'
         )
@@ -61,6 +131,55 @@ class AntivirusGUI:
         # Handle window closing
         self.master.protocol('WM_DELETE_WINDOW', self.on_closing)
 
+        self.master.after(UPDATE_INTERVAL_MS, self.apply_updates)
+
+    def apply_updates(self):
+        try:
+            lines, dropped, progress, calls, last_scan = self.updates.drain()
+            if dropped:
+                lines.insert(0, f'... {dropped} lines not shown ...')
+            if lines:
+                # One insert per frame, then trim the oldest lines past the cap
+                self.output_text.insert(END, '\n'.join(lines) + '\n')
+                excess = int(self.output_text.index('end-1c').split('.')[0]) - 1 - MAX_LOG_LINES
+                if excess > 0:
+                    self.output_text.delete('1.0', f'{excess + 1}.0')
+            for key, state in progress.items():
+                bar = self.progress_bars.get(key)
+                if state is None:
+                    if bar is not None:
+                        self.progress_bars.pop(key).destroy()
+                    continue
+                if bar is None:
+                    bar = self.progress_bars[key] = ttk.Progressbar(self.scan_tab, maximum=1)
+                    bar.pack(fill=X, padx=10, pady=5)
+                value, maximum = state
+                bar['maximum'] = max(maximum, 1)
+                bar['value'] = value
+            if last_scan is not None:
+                self.last_scan_time.config(text=last_scan.strftime('%Y-%m-%d %H:%M:%S'))
+            for function, args in calls:
+                function(*args)
+            if not self.engine_ready and self.antivirus.ready():
+                self.show_engine_status()
+            if self.history_dirty and time.monotonic() - self.history_refreshed >= HISTORY_REFRESH_SECONDS:
+                self.load_history_page()
+        except Exception:
+            logging.exception('Failed to apply GUI updates')
+        self.master.after(UPDATE_INTERVAL_MS, self.apply_updates)
+
+    def show_engine_status(self):
+        self.engine_ready = True
+        try:
+            engine = self.antivirus.engine
+        except Exception as e:
+            self.engine_status.config(text=f'Engine failed to load: {e}', foreground='red')
+            return
+        bundle = f', bundle {engine.bundle_version}' if engine.bundle_version else ''
+        self.engine_status.config(
+            text=f'Engine ready ({engine.backend.name}{bundle}, loaded in {engine.load_seconds:.2f}s)',
+            foreground='green')
+
     def create_menu(self):
         menu_bar = ttk.Menu(self.master)
 
@@ -137,6 +256,11 @@ class AntivirusGUI:
         self.last_scan_time = ttk.Label(parent, text='Never', font=('Helvetica', 12))
         self.last_scan_time.pack(pady=5)
 
+        # The engine loads in the background; scans started before it is ready wait for it
+        self.engine_status = ttk.Label(parent, text='Loading engine...', font=('Helvetica', 12), foreground='orange')
+        self.engine_status.pack(pady=5)
+        self.engine_ready = False
+
         # Real-Time Protection Toggle
         self.real_time_var = ttk.BooleanVar(value=True)
         real_time_toggle = ttk.Checkbutton(
@@ -178,10 +302,13 @@ class AntivirusGUI:
 
     def create_quarantine_tab(self, parent):
         # Quarantine Manager
-        columns = ('#1', '#2')
+        columns = ('#1', '#2', '#3', '#4', '#5')
         self.quarantine_tree = ttk.Treeview(parent, columns=columns, show='headings')
         self.quarantine_tree.heading('#1', text='File Name')
-        self.quarantine_tree.heading('#2', text='Date Quarantined')
+        self.quarantine_tree.heading('#2', text='Original Path')
+        self.quarantine_tree.heading('#3', text='Verdict')
+        self.quarantine_tree.heading('#4', text='Probability')
+        self.quarantine_tree.heading('#5', text='Date Quarantined')
         self.quarantine_tree.pack(fill=BOTH, expand=True)
 
         # Buttons to restore or delete files
@@ -192,9 +319,27 @@ class AntivirusGUI:
         ttk.Button(button_frame, text='Delete File', command=self.delete_file).pack(side=LEFT, padx=5)
 
         self.load_quarantine()
+        # Later changes arrive one entry at a time instead of reloading the list
+        self.antivirus.quarantine_store.listeners.append(self.on_quarantine_change)
 
     def create_history_tab(self, parent):
-        # Threat History
+        # Filters: date range (YYYY-MM-DD, both inclusive) and action
+        filter_frame = ttk.Frame(parent)
+        filter_frame.pack(fill=X, padx=10, pady=5)
+        ttk.Label(filter_frame, text='From').pack(side=LEFT)
+        self.history_since = ttk.Entry(filter_frame, width=12)
+        self.history_since.pack(side=LEFT, padx=5)
+        ttk.Label(filter_frame, text='To').pack(side=LEFT)
+        self.history_until = ttk.Entry(filter_frame, width=12)
+        self.history_until.pack(side=LEFT, padx=5)
+        ttk.Label(filter_frame, text='Action').pack(side=LEFT)
+        self.history_action = ttk.Combobox(filter_frame, values=['All', 'Quarantined', 'Detected', 'Unknown'],
+                                           state='readonly', width=12)
+        self.history_action.set('All')
+        self.history_action.pack(side=LEFT, padx=5)
+        ttk.Button(filter_frame, text='Apply', command=self.apply_history_filter).pack(side=LEFT, padx=5)
+
+        # Threat History: the tree only ever holds the current page
         columns = ('#1', '#2', '#3')
         self.history_tree = ttk.Treeview(parent, columns=columns, show='headings')
         self.history_tree.heading('#1', text='Date')
@@ -202,6 +347,13 @@ class AntivirusGUI:
         self.history_tree.heading('#3', text='Action')
         self.history_tree.pack(fill=BOTH, expand=True)
 
+        page_frame = ttk.Frame(parent)
+        page_frame.pack(pady=5)
+        ttk.Button(page_frame, text='< Newer', command=self.history_newer_page).pack(side=LEFT, padx=5)
+        self.history_page_label = ttk.Label(page_frame, text='')
+        self.history_page_label.pack(side=LEFT, padx=5)
+        ttk.Button(page_frame, text='Older >', command=self.history_older_page).pack(side=LEFT, padx=5)
+
         # Add buttons for deleting and saving history
         button_frame = ttk.Frame(parent)
         button_frame.pack(pady=10)
@@ -212,52 +364,124 @@ class AntivirusGUI:
         save_history_btn = ttk.Button(button_frame, text='Save History as PDF', command=self.save_history_as_pdf)
         save_history_btn.pack(side=LEFT, padx=5)
 
+        save_csv_btn = ttk.Button(button_frame, text='Save History as CSV', command=self.save_history_as_csv)
+        save_csv_btn.pack(side=LEFT, padx=5)
+
+        # Keyset pagination: before_id of every page shown so far (None is the newest page)
+        self.history_filter = {}
+        self.history_pages = [None]
+        self.history_last_id = None
+        self.load_history_page()
+
+    def history_filter_from_inputs(self):
+        def day(entry, offset=0):
+            text = entry.get().strip()
+            if not text:
+                return None
+            return (datetime.strptime(text, '%Y-%m-%d') + timedelta(days=offset)).timestamp()
+
+        action = self.history_action.get()
+        return {
+            'since': day(self.history_since),
+            'until': day(self.history_until, offset=1),
+            'actions': None if action == 'All' else [action],
+        }
+
+    def apply_history_filter(self):
+        try:
+            self.history_filter = self.history_filter_from_inputs()
+        except ValueError:
+            messagebox.showerror('Threat History', 'Dates must be in YYYY-MM-DD format.')
+            return
+        self.history_pages = [None]
+        self.load_history_page()
+
+    def load_history_page(self):
+        self.history_dirty = False
+        self.history_refreshed = time.monotonic()
+        entries = self.history.page(before_id=self.history_pages[-1], **self.history_filter)
+        for item in self.history_tree.get_children():
+            self.history_tree.delete(item)
+        for entry in entries:
+            values = (datetime.fromtimestamp(entry.detected_at).strftime('%Y-%m-%d %H:%M:%S'), entry.file_path, entry.action)
+            self.history_tree.insert('', END, values=values)
+        self.history_last_id = entries[-1].id if len(entries) == PAGE_SIZE else None
+        total = self.history.count(**self.history_filter)
+        self.history_page_label.config(text=f'Page {len(self.history_pages)} of {max((total + PAGE_SIZE - 1) // PAGE_SIZE, 1)} ({total} entries)')
+
+    def history_older_page(self):
+        if self.history_last_id is not None:
+            self.history_pages.append(self.history_last_id)
+            self.load_history_page()
+
+    def history_newer_page(self):
+        if len(self.history_pages) > 1:
+            self.history_pages.pop()
+            self.load_history_page()
+
+    def record_threat(self, file_path, message, status):
+        # Add to threat history if malware detected or unknown
+        if status in ['Quarantined', 'Detected', 'Unknown']:
+            self.history.record(file_path, status, message)
+
+    def on_history_recorded(self, entry):
+        # Called from scan threads; apply_updates reloads the newest page if it is showing
+        if len(self.history_pages) == 1:
+            self.history_dirty = True
+
     def delete_history(self):
         confirm = messagebox.askyesno('Delete History', 'Are you sure you want to delete the scan history?')
         if confirm:
-            # Clear the threat history list and treeview
-            self.threat_history.clear()
-            for item in self.history_tree.get_children():
-                self.history_tree.delete(item)
+            self.history.clear()
+            self.history_pages = [None]
+            self.load_history_page()
             messagebox.showinfo('Delete History', 'Scan history has been deleted.')
 
     def save_history_as_pdf(self):
         file_path = filedialog.asksaveasfilename(defaultextension='.pdf', filetypes=[('PDF files', '*.pdf')])
         if file_path:
-            try:
-                c = canvas.Canvas(file_path, pagesize=letter)
-                width, height = letter
-
-                c.setFont('Helvetica-Bold', 16)
-                c.drawString(50, height - 50, 'Threat History Report')
-
-                c.setFont('Helvetica', 12)
-                y_position = height - 80
-
-                for entry in self.threat_history:
-                    date_str, file_name, action = entry
-                    line = f'Date: {date_str} | File: {file_name} | Action: {action}'
-                    c.drawString(50, y_position, line)
-                    y_position -= 20
-                    if y_position < 50:
-                        c.showPage()
-                        y_position = height - 50
-
-                c.save()
-                messagebox.showinfo('Save History', f'Scan history has been saved as {file_path}.')
-            except Exception as e:
-                messagebox.showerror('Error', f'Failed to save history as PDF: {e}')
+            self.executor.submit(self.export_history_thread, export_pdf, file_path, dict(self.history_filter))
+
+    def save_history_as_csv(self):
+        file_path = filedialog.asksaveasfilename(defaultextension='.csv', filetypes=[('CSV files', '*.csv')])
+        if file_path:
+            self.executor.submit(self.export_history_thread, export_csv, file_path, dict(self.history_filter))
+
+    def export_history_thread(self, export, file_path, history_filter):
+        # Streams the filtered history from the store; the Tk thread only shows the outcome
+        try:
+            self.history.flush()
+            rows = export(self.history, file_path, **history_filter)
+            self.updates.call(messagebox.showinfo, 'Save History', f'{rows} history entries have been saved as {file_path}.')
+        except Exception as e:
+            logging.error(f'Failed to export history to {file_path}: {e}', exc_info=True)
+            self.updates.call(messagebox.showerror, 'Error', f'Failed to save history: {e}')
 
     def load_quarantine(self):
         # Clear existing items
         for item in self.quarantine_tree.get_children():
             self.quarantine_tree.delete(item)
 
-        quarantine_dir = self.antivirus.quarantine_dir
-        for file_name in os.listdir(quarantine_dir):
-            file_path = os.path.join(quarantine_dir, file_name)
-            date_quarantined = time.ctime(os.path.getctime(file_path))
-            self.quarantine_tree.insert('', END, values=(file_name, date_quarantined))
+        # The store index is newest first; one query, no directory listing
+        for entry in self.antivirus.quarantine_store.entries():
+            self.insert_quarantine_entry(entry, END)
+
+    def insert_quarantine_entry(self, entry, index=0):
+        probability = '' if entry.probability is None else f'{entry.probability:.3f}'
+        values = (os.path.basename(entry.original_path), entry.original_path, entry.verdict, probability,
+                  time.ctime(entry.quarantined_at))
+        self.quarantine_tree.insert('', index, iid=str(entry.id), values=values)
+
+    def on_quarantine_change(self, event, entry):
+        # Called from scan threads; the Treeview is only touched from the Tk event loop
+        self.updates.call(self.apply_quarantine_change, event, entry)
+
+    def apply_quarantine_change(self, event, entry):
+        iid = str(entry.id)
+        if event == 'added' and not self.quarantine_tree.exists(iid):
+            self.insert_quarantine_entry(entry)
+        elif event == 'removed' and self.quarantine_tree.exists(iid):
+            self.quarantine_tree.delete(iid)
 
     def toggle_real_time_protection(self):
         if self.real_time_var.get():
@@ -268,9 +492,18 @@ class AntivirusGUI:
             # Stop real-time protection
 
     def update_definitions(self):
-        # Simulate checking for updates
-        messagebox.showinfo('Update', 'Virus definitions are up to date.')
-        # In a real application, implement actual update logic
+        # Loading and validating a bundle takes a while; the swap itself never blocks scans
+        self.executor.submit(self.update_definitions_thread)
+
+    def update_definitions_thread(self):
+        try:
+            if self.antivirus.reload():
+                self.updates.call(messagebox.showinfo, 'Update',
+                                  f'Switched to engine bundle {self.antivirus.bundle_version}.')
+            else:
+                self.updates.call(messagebox.showinfo, 'Update', 'Virus definitions are up to date.')
+        except Exception as e:
+            self.updates.call(messagebox.showerror, 'Update', f'Could not load the new engine bundle: {e}')
 
     def scan_file(self):
         file_path = filedialog.askopenfilename()
@@ -280,20 +513,15 @@ class AntivirusGUI:
     def scan_file_thread(self, file_path):
         try:
             message, status = self.antivirus.scan_file(file_path)
-            self.output_text.insert(END, message + '\n')
-            # Update last scan time
-            self.last_scan_time.config(text=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-            # Add to threat history if malware detected or unknown
-            if status in ['Quarantined', 'Unknown']:
-                self.threat_history.append((datetime.now().strftime('%Y-%m-%d %H:%M:%S'), os.path.basename(file_path), status))
-                self.history_tree.insert('', END, values=self.threat_history[-1])
-                if status == 'Quarantined':
-                    self.load_quarantine()
+            self.updates.log(message)
+            self.updates.scanned()
+            self.record_threat(file_path, message, status)
+            self.history.flush()
             if notification:
-                self.master.after(0, self.notify_user, 'Scan Complete', f'Scan of {file_path} completed.')
+                self.updates.call(self.notify_user, 'Scan Complete', f'Scan of {file_path} completed.')
         except Exception as e:
             error_message = f'Error scanning {file_path}: {str(e)}'
-            self.output_text.insert(END, error_message + '\n')
+            self.updates.log(error_message)
             logging.error(error_message, exc_info=True)
 
     def scan_directory(self):
@@ -302,36 +530,40 @@ class AntivirusGUI:
             self.executor.submit(self.scan_directory_thread, directory)
 
     def scan_directory_thread(self, directory):
+        # One progress bar per running scan
+        progress_key = object()
         try:
-            total_files = sum(len(files) for _, _, files in os.walk(directory))
             scanned_files = 0
-
-            progress = ttk.Progressbar(self.scan_tab, maximum=total_files)
-            progress.pack(fill=X, padx=10, pady=5)
-
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    message, status = self.antivirus.scan_file(file_path)
-                    self.output_text.insert(END, message + '\n')
-                    scanned_files += 1
-                    progress['value'] = scanned_files
-                    # Update last scan time
-                    self.last_scan_time.config(text=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                    # Add to threat history if malware detected or unknown
-                    if status in ['Quarantined', 'Unknown']:
-                        self.threat_history.append((datetime.now().strftime('%Y-%m-%d %H:%M:%S'), os.path.basename(file_path), status))
-                        self.history_tree.insert('', END, values=self.threat_history[-1])
-                        if status == 'Quarantined':
-                            self.load_quarantine()
-
-            progress.destroy()
+            cache = self.antivirus.cache
+            hits_before, misses_before = (cache.hits, cache.misses) if cache else (0, 0)
+
+            if self.scan_processes:
+                pipeline = ProcessScanPipeline(self.antivirus, workers=self.scan_processes,
+                                               batch_size=self.scan_batch_size, rules=self.scan_rules)
+            else:
+                pipeline = ScanPipeline(self.antivirus, workers=self.scan_workers, batch_size=self.scan_batch_size,
+                                        rules=self.scan_rules)
+            for file_path, message, status in pipeline.scan_directory(directory):
+                self.updates.log(message)
+                scanned_files += 1
+                # The total grows while the walk runs, so the bar maximum follows the files found so far
+                self.updates.progress(progress_key, scanned_files, pipeline.progress.estimated_total())
+                self.record_threat(file_path, message, status)
+            self.updates.scanned()
+
+            self.history.flush()
+            if cache:
+                hits, misses = cache.hits - hits_before, cache.misses - misses_before
+                hit_rate = hits / (hits + misses) if hits + misses else 0.0
+                self.updates.log(f'Scanned {scanned_files} files, cache hit rate {hit_rate:.1%} ({hits} unchanged files skipped)')
             if notification:
-                self.master.after(0, self.notify_user, 'Scan Complete', f'Scan of {directory} completed.')
+                self.updates.call(self.notify_user, 'Scan Complete', f'Scan of {directory} completed.')
         except Exception as e:
             error_message = f'Error scanning directory {directory}: {str(e)}'
-            self.output_text.insert(END, error_message + '\n')
+            self.updates.log(error_message)
             logging.error(error_message, exc_info=True)
+        finally:
+            self.updates.finish(progress_key)
 
     def clear_output(self):
         self.output_text.delete('1.0', END)
@@ -339,13 +571,14 @@ class AntivirusGUI:
     def restore_file(self):
         selected_item = self.quarantine_tree.selection()
         if selected_item:
-            file_name = self.quarantine_tree.item(selected_item)['values'][0]
-            quarantine_path = os.path.join(self.antivirus.quarantine_dir, file_name)
-            original_path = filedialog.askdirectory(title='Select Restore Location')
+            entry = self.antivirus.quarantine_store.get(int(selected_item[0]))
+            file_name = os.path.basename(entry.original_path)
+            original_path = filedialog.askdirectory(title='Select Restore Location',
+                                                    initialdir=os.path.dirname(entry.original_path))
             if original_path:
                 try:
-                    shutil.move(quarantine_path, os.path.join(original_path, file_name))
-                    self.quarantine_tree.delete(selected_item)
+                    # The store listener removes the row
+                    self.antivirus.quarantine_store.restore(entry.id, os.path.join(original_path, file_name))
                     messagebox.showinfo('Restore File', f'File {file_name} has been restored.')
                 except Exception as e:
                     messagebox.showerror('Error', f'Failed to restore file: {e}')
@@ -355,13 +588,12 @@ class AntivirusGUI:
     def delete_file(self):
         selected_item = self.quarantine_tree.selection()
         if selected_item:
+            entry_id = int(selected_item[0])
             file_name = self.quarantine_tree.item(selected_item)['values'][0]
-            quarantine_path = os.path.join(self.antivirus.quarantine_dir, file_name)
             confirm = messagebox.askyesno('Delete File', f'Are you sure you want to delete {file_name}?')
             if confirm:
                 try:
-                    os.remove(quarantine_path)
-                    self.quarantine_tree.delete(selected_item)
+                    self.antivirus.quarantine_store.delete(entry_id)
                     messagebox.showinfo('Delete File', f'File {file_name} has been deleted.')
                 except Exception as e:
                     messagebox.showerror('Error', f'Failed to delete file: {e}')
@@ -420,6 +652,7 @@ class AntivirusGUI:
     def exit_application(self, icon=None, item=None):
         if icon:
             icon.stop()
+        self.history.close()
         self.master.quit()
 
     def on_closing(self):
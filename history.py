@@ -0,0 +1,162 @@
+# history.py
+#
+# Threat history persisted in SQLite. Views read it one page at a time (keyset pagination
+# on the row id, so deep pages cost the same as the first) and exports stream it in
+# chunks, so neither ever holds the whole history in memory.
+
+import csv
+import time
+import sqlite3
+import threading
+import logging
+from collections import namedtuple
+
+HISTORY_PATH = 'threat_history.db'
+PAGE_SIZE = 200
+
+# Pending records are committed in groups, like the scan cache
+COMMIT_EVERY = 256
+
+# Rows fetched per query while exporting
+EXPORT_CHUNK = 1000
+
+HistoryEntry = namedtuple('HistoryEntry', 'id detected_at file_path action message')
+
+_COLUMNS = ', '.join(HistoryEntry._fields)
+
+class ThreatHistory:
+    def __init__(self, path=HISTORY_PATH):
+        self.path = path
+        # Called with each new HistoryEntry (from the recording thread)
+        self.listeners = []
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS events ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, detected_at REAL, file_path TEXT, action TEXT, message TEXT)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS events_detected_at ON events (detected_at)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS events_action ON events (action, detected_at)')
+        self.conn.commit()
+
+    def record(self, file_path, action, message='', detected_at=None):
+        detected_at = time.time() if detected_at is None else detected_at
+        with self._lock:
+            cursor = self.conn.execute(
+                'INSERT INTO events (detected_at, file_path, action, message) VALUES (?, ?, ?, ?)',
+                (detected_at, file_path, action, message))
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.conn.commit()
+                self._pending = 0
+        entry = HistoryEntry(cursor.lastrowid, detected_at, file_path, action, message)
+        for listener in self.listeners:
+            try:
+                listener(entry)
+            except Exception:
+                logging.exception('History listener failed')
+        return entry
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self.conn.commit()
+                self._pending = 0
+
+    @staticmethod
+    def _where(since=None, until=None, actions=None, before_id=None, after_id=None):
+        clauses, params = [], []
+        if since is not None:
+            clauses.append('detected_at >= ?')
+            params.append(since)
+        if until is not None:
+            clauses.append('detected_at < ?')
+            params.append(until)
+        if actions:
+            clauses.append(f'action IN ({", ".join("?" * len(actions))})')
+            params.extend(actions)
+        if before_id is not None:
+            clauses.append('id < ?')
+            params.append(before_id)
+        if after_id is not None:
+            clauses.append('id > ?')
+            params.append(after_id)
+        return (' WHERE ' + ' AND '.join(clauses) if clauses else ''), params
+
+    def page(self, since=None, until=None, actions=None, before_id=None, limit=PAGE_SIZE):
+        # Newest first; pass the last id of a page as before_id to get the next one
+        where, params = self._where(since, until, actions, before_id=before_id)
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {_COLUMNS} FROM events{where} ORDER BY id DESC LIMIT ?', (*params, limit)).fetchall()
+        return [HistoryEntry(*row) for row in rows]
+
+    def count(self, since=None, until=None, actions=None):
+        where, params = self._where(since, until, actions)
+        with self._lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM events{where}', params).fetchone()[0]
+
+    def iter_entries(self, since=None, until=None, actions=None, chunk_size=EXPORT_CHUNK):
+        # Oldest first, one short query per chunk so recording is never blocked for long
+        last_id = 0
+        while True:
+            where, params = self._where(since, until, actions, after_id=last_id)
+            with self._lock:
+                rows = self.conn.execute(
+                    f'SELECT {_COLUMNS} FROM events{where} ORDER BY id LIMIT ?', (*params, chunk_size)).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield HistoryEntry(*row)
+            last_id = rows[-1][0]
+
+    def clear(self):
+        with self._lock:
+            self.conn.execute('DELETE FROM events')
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self.conn.close()
+
+def format_time(timestamp):
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+def export_csv(history, path, since=None, until=None, actions=None):
+    # Returns the number of rows written
+    rows = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['date', 'file', 'action', 'message'])
+        for entry in history.iter_entries(since, until, actions):
+            writer.writerow([format_time(entry.detected_at), entry.file_path, entry.action, entry.message])
+            rows += 1
+    return rows
+
+def export_pdf(history, path, since=None, until=None, actions=None):
+    # One line per entry, page breaks as the cursor reaches the bottom margin
+    from reportlab.lib.pagesizes import letter
+    from reportlab.pdfgen import canvas
+
+    c = canvas.Canvas(path, pagesize=letter)
+    width, height = letter
+    c.setFont('Helvetica-Bold', 16)
+    c.drawString(50, height - 50, 'Threat History Report')
+    c.setFont('Helvetica', 10)
+    y_position = height - 80
+    rows = 0
+    for entry in history.iter_entries(since, until, actions):
+        c.drawString(50, y_position, f'Date: {format_time(entry.detected_at)} | File: {entry.file_path} | Action: {entry.action}')
+        rows += 1
+        y_position -= 16
+        if y_position < 50:
+            c.showPage()
+            c.setFont('Helvetica', 10)
+            y_position = height - 50
+    c.save()
+    return rows
@@ -0,0 +1,264 @@
+# inference.py
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import logging
+import numpy as np
+from feature_extractor import FEATURE_SPECS
+
+# Artifacts live next to the code, so scans work from any working directory
+MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'models')
+
+MODEL_PATH = os.path.join(MODEL_DIR, 'malware_detector.h5')
+SCALER_PATH = os.path.join(MODEL_DIR, 'scaler.pkl')
+NPZ_PATH = os.path.join(MODEL_DIR, 'malware_detector.npz')
+# Which feature spec the Keras model/scaler were trained on (the .npz carries its own)
+MODEL_INFO_PATH = os.path.join(MODEL_DIR, 'model_info.json')
+# Half-precision copy of the .npz written by export_float16 (backend 'float16')
+FLOAT16_NPZ_PATH = os.path.join(MODEL_DIR, 'malware_detector_fp16.npz')
+
+ACTIVATIONS = {
+    'relu': lambda x: np.maximum(x, 0, out=x),
+    'sigmoid': lambda x: 1.0 / (1.0 + np.exp(-x)),
+    'linear': lambda x: x,
+}
+
+def artifact_version(*paths):
+    # Content hash of the model artifacts, used to invalidate cached verdicts
+    sha256 = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            sha256.update(f.read())
+    return sha256.hexdigest()[:16]
+
+class KerasBackend:
+    # Original TensorFlow path: scaler.transform followed by model.predict
+    name = 'keras'
+
+    def __init__(self, model_path=MODEL_PATH, scaler_path=SCALER_PATH):
+        from tensorflow.keras.models import load_model
+        import joblib
+
+        self.model = load_model(model_path)
+        self.scaler = joblib.load(scaler_path)
+        self.n_features = self.scaler.n_features_in_
+        self.version = artifact_version(model_path, scaler_path)
+        # model_info.json sits next to the model it describes
+        self.feature_version = read_feature_version(
+            os.path.join(os.path.dirname(model_path), os.path.basename(MODEL_INFO_PATH)))
+        if self.feature_version is None:
+            self.feature_version = infer_feature_version(self.n_features, model_path)
+
+    def predict(self, features):
+        features = self.scaler.transform(features)
+        return self.model.predict(features, verbose=0)[:, 0]
+
+class NumpyBackend:
+    # Pure NumPy forward pass over weights exported by export_npz (or export_float16).
+    # The scaler is already folded into the first dense layer.
+    name = 'numpy'
+
+    def __init__(self, npz_path=NPZ_PATH):
+        with np.load(npz_path) as data:
+            self.feature_version = int(data['feature_version']) if 'feature_version' in data else None
+            layer_count = int(data['layer_count'])
+            self.layers = []
+            for i in range(layer_count):
+                self.layers.append((data[f'kernel_{i}'], data[f'bias_{i}'], ACTIVATIONS[str(data[f'activation_{i}'])]))
+        self.n_features = self.layers[0][0].shape[0]
+        if self.feature_version is None:
+            self.feature_version = infer_feature_version(self.n_features, npz_path)
+        # float16 weights stay half size in memory; each product is still computed in float32
+        self.weight_dtype = self.layers[0][0].dtype
+        if self.weight_dtype != np.float32:
+            self.name = f'numpy-{self.weight_dtype}'
+        self.weight_bytes = sum(kernel.nbytes + bias.nbytes for kernel, bias, _ in self.layers)
+        self.version = artifact_version(npz_path)
+
+    def predict(self, features):
+        x = np.asarray(features, dtype=np.float32)
+        for kernel, bias, activation in self.layers:
+            x = activation(x @ kernel.astype(np.float32, copy=False) + bias)
+        return x[:, 0]
+
+def read_feature_version(model_info_path=MODEL_INFO_PATH):
+    # None if the model predates versioned feature specs
+    if not os.path.isfile(model_info_path):
+        return None
+    with open(model_info_path) as f:
+        feature_version = json.load(f).get('feature_version')
+    return None if feature_version is None else int(feature_version)
+
+def infer_feature_version(n_features, artifact_path):
+    # For artifacts without a recorded spec: only an input width that belongs to exactly one
+    # spec is trusted, anything else would classify the wrong features
+    versions = [version for version, spec in FEATURE_SPECS.items() if spec.n_features == n_features]
+    if len(versions) != 1:
+        raise ValueError(f'{artifact_path} records no feature spec and its {n_features} inputs '
+                         f'match no known spec; re-export it with train_model.py')
+    return versions[0]
+
+def write_model_info(feature_version, model_info_path=MODEL_INFO_PATH):
+    with open(model_info_path, 'w') as f:
+        json.dump({'feature_version': feature_version}, f, indent=2)
+
+def fold_scaler(kernel, bias, scaler):
+    # (x - mean) / scale @ W + b  ==  x @ (W / scale) + (b - (mean / scale) @ W)
+    kernel = np.asarray(kernel, dtype=np.float64)
+    bias = np.asarray(bias, dtype=np.float64)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones(kernel.shape[0])
+    mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(kernel.shape[0])
+    folded_kernel = kernel / scale[:, None]
+    folded_bias = bias - (mean / scale) @ kernel
+    return folded_kernel, folded_bias
+
+def export_npz(model, scaler, npz_path=NPZ_PATH, feature_version=1):
+    # Collect the dense layers of a trained Keras model (dropout has no weights at inference)
+    dense_layers = [layer for layer in model.layers if layer.get_weights()]
+    arrays = {'layer_count': np.array(len(dense_layers)), 'feature_version': np.array(feature_version)}
+    for i, layer in enumerate(dense_layers):
+        kernel, bias = layer.get_weights()
+        if i == 0:
+            kernel, bias = fold_scaler(kernel, bias, scaler)
+        arrays[f'kernel_{i}'] = kernel.astype(np.float32)
+        arrays[f'bias_{i}'] = bias.astype(np.float32)
+        arrays[f'activation_{i}'] = np.array(layer.get_config().get('activation', 'linear'))
+    np.savez(npz_path, **arrays)
+    logging.info(f'Exported {len(dense_layers)} layers to {npz_path}')
+    return npz_path
+
+def export_float16(npz_path=NPZ_PATH, output_path=FLOAT16_NPZ_PATH):
+    # Half-precision copy of an export: weights take half the disk and memory. Compare it with
+    # the float32 model (compare_backends) before shipping it.
+    with np.load(npz_path) as data:
+        arrays = {key: data[key] for key in data.files}
+    for i in range(int(arrays['layer_count'])):
+        arrays[f'kernel_{i}'] = arrays[f'kernel_{i}'].astype(np.float16)
+        arrays[f'bias_{i}'] = arrays[f'bias_{i}'].astype(np.float16)
+    np.savez(output_path, **arrays)
+    logging.info(f'Wrote float16 weights to {output_path}')
+    return output_path
+
+def compare_backends(reference, candidate, features, labels=None, batch_size=256, repeats=5):
+    # Accuracy delta, probability drift, latency and weight memory of candidate vs reference
+    features = np.asarray(features, dtype=np.float32)
+    report = {}
+    for name, backend in (('reference', reference), ('candidate', candidate)):
+        probabilities = backend.predict(features)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for offset in range(0, len(features), batch_size):
+                backend.predict(features[offset:offset + batch_size])
+        elapsed = (time.perf_counter() - start) / repeats
+        report[name] = {
+            'backend': backend.name,
+            'weight_bytes': getattr(backend, 'weight_bytes', None),
+            'us_per_file': elapsed / len(features) * 1e6,
+            'probabilities': probabilities,
+        }
+        if labels is not None:
+            report[name]['accuracy'] = float(((probabilities > 0.5) == np.asarray(labels)).mean())
+    expected = report['reference'].pop('probabilities')
+    actual = report['candidate'].pop('probabilities')
+    report['max_probability_diff'] = float(np.max(np.abs(expected - actual)))
+    report['verdict_agreement'] = float(((expected > 0.5) == (actual > 0.5)).mean())
+    if labels is not None:
+        report['accuracy_delta'] = report['candidate']['accuracy'] - report['reference']['accuracy']
+    return report
+
+def format_comparison(report):
+    reference, candidate = report['reference'], report['candidate']
+    lines = [f"{'':10} {'backend':>14} {'weights':>10} {'us/file':>9} {'accuracy':>9}"]
+    for name, entry in (('reference', reference), ('candidate', candidate)):
+        accuracy = f"{entry['accuracy']:.4f}" if 'accuracy' in entry else 'n/a'
+        lines.append(f"{name:10} {entry['backend']:>14} {entry['weight_bytes'] or 0:>10,} "
+                     f"{entry['us_per_file']:>9.2f} {accuracy:>9}")
+    summary = (f"max probability diff {report['max_probability_diff']:.2e}, "
+               f"verdict agreement {report['verdict_agreement']:.2%}")
+    if 'accuracy_delta' in report:
+        summary += f", accuracy delta {report['accuracy_delta']:+.4f}"
+    lines.append(summary)
+    return '\n'.join(lines)
+
+def load_backend(backend='auto', model_path=MODEL_PATH, scaler_path=SCALER_PATH, npz_path=NPZ_PATH):
+    # 'auto' prefers the NumPy export and only falls back to TensorFlow when it is missing
+    if backend == 'auto':
+        backend = 'numpy' if os.path.isfile(npz_path) else 'keras'
+    if backend == 'numpy':
+        return NumpyBackend(npz_path)
+    if backend == 'float16':
+        # The half-precision copy sits next to the .npz it was made from
+        return NumpyBackend(os.path.join(os.path.dirname(npz_path), os.path.basename(FLOAT16_NPZ_PATH)))
+    if backend == 'keras':
+        return KerasBackend(model_path, scaler_path)
+    raise ValueError(f'Unknown inference backend: {backend}')
+
+def sample_files(paths, limit):
+    # Up to limit regular files from the given files and directories
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+        for dirpath, _, filenames in os.walk(path):
+            files.extend(os.path.join(dirpath, filename) for filename in sorted(filenames))
+        if len(files) >= limit:
+            break
+    return files[:limit]
+
+def check_parity(paths, model_path=MODEL_PATH, scaler_path=SCALER_PATH, npz_path=NPZ_PATH, limit=1000, atol=1e-5):
+    # Runs both backends on features extracted from real files, so an export that does not
+    # match the feature spec it claims fails here instead of at scan time
+    from feature_extractor import extract_features_batch, get_feature_spec
+    keras_backend = KerasBackend(model_path, scaler_path)
+    numpy_backend = NumpyBackend(npz_path)
+    if keras_backend.feature_version != numpy_backend.feature_version:
+        raise ValueError(f'Keras model uses feature spec {keras_backend.feature_version}, '
+                         f'NumPy export uses spec {numpy_backend.feature_version}')
+    spec = get_feature_spec(numpy_backend.feature_version)
+    for backend in (keras_backend, numpy_backend):
+        if backend.n_features != spec.n_features:
+            raise ValueError(f'{backend.name} backend takes {backend.n_features} features, '
+                             f'feature spec {spec.version} gives {spec.n_features}')
+
+    features, extracted = extract_features_batch(sample_files(paths, limit), spec.version)
+    if not extracted:
+        raise ValueError('No readable files to compare the backends on')
+    expected = keras_backend.predict(features)
+    actual = numpy_backend.predict(features)
+    max_diff = float(np.max(np.abs(expected - actual)))
+    return max_diff <= atol, max_diff, len(extracted)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the Keras model to NumPy (float32 or float16) and check '
+                                                 'backend parity.')
+    parser.add_argument('command', choices=['export', 'check', 'float16'])
+    parser.add_argument('--model', default=MODEL_PATH)
+    parser.add_argument('--scaler', default=SCALER_PATH)
+    parser.add_argument('--npz', default=NPZ_PATH)
+    parser.add_argument('paths', nargs='*', default=[os.path.dirname(os.path.abspath(__file__))],
+                        help='Files or directories whose features the parity check runs on')
+    args = parser.parse_args()
+
+    if args.command == 'float16':
+        from feature_extractor import extract_features_batch
+        reference = NumpyBackend(args.npz)
+        output_path = export_float16(args.npz, os.path.join(os.path.dirname(args.npz),
+                                                            os.path.basename(FLOAT16_NPZ_PATH)))
+        print(f'float16 weights saved to {output_path}')
+        features, extracted = extract_features_batch(sample_files(args.paths, 10000), reference.feature_version)
+        print(f'Compared on {len(extracted)} files (no labels; train_model.py reports accuracy on the test split):')
+        print(format_comparison(compare_backends(reference, NumpyBackend(output_path), features)))
+        raise SystemExit(0)
+
+    if args.command == 'export':
+        keras_backend = KerasBackend(args.model, args.scaler)
+        export_npz(keras_backend.model, keras_backend.scaler, args.npz, keras_backend.feature_version)
+        print(f'NumPy weights saved to {args.npz}')
+
+    ok, max_diff, files = check_parity(args.paths, args.model, args.scaler, args.npz)
+    print(f'Max probability difference between keras and numpy backends over {files} files: {max_diff:.2e}')
+    if not ok:
+        raise SystemExit(1)
@@ -0,0 +1,152 @@
+# metrics.py
+#
+# Minimal in-process counters and histograms for the scan hot path. Updates are a dict
+# lookup and an add under a lock; reading is through snapshot(), to_prometheus() or write_json().
+
+import json
+import time
+import bisect
+import threading
+
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0)
+
+def _label_text(label_names, label_values):
+    if not label_names:
+        return ''
+    pairs = ','.join(f'{name}="{value}"' for name, value in zip(label_names, label_values))
+    return '{' + pairs + '}'
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self.values.get(label_values, 0)
+
+    def snapshot(self):
+        with self._lock:
+            return {_label_text(self.label_names, key) or 'value': value for key, value in self.values.items()}
+
+    def prometheus_lines(self):
+        with self._lock:
+            items = list(self.values.items())
+        return [f'{self.name}{_label_text(self.label_names, key)} {value}' for key, value in items]
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.total += value
+            self.count += 1
+
+    def time(self):
+        return _Timer(self)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'count': self.count,
+                'sum': self.total,
+                'buckets': dict(zip([*map(str, self.buckets), '+Inf'], self.counts)),
+            }
+
+    def prometheus_lines(self):
+        with self._lock:
+            counts, total, count = list(self.counts), self.total, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip([*map(str, self.buckets), '+Inf'], counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_sum {total}')
+        lines.append(f'{self.name}_count {count}')
+        return lines
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            # Registering the same name twice returns the existing metric
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, buckets))
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def to_prometheus(self):
+        with self._lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help_text}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.prometheus_lines())
+        return '\n'.join(lines) + '\n'
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump({'time': time.time(), 'metrics': self.snapshot()}, f, indent=2)
+
+    def write_prometheus(self, path):
+        with open(path, 'w') as f:
+            f.write(self.to_prometheus())
+
+# Process-wide registry used by the scanner
+REGISTRY = MetricsRegistry()
+
+READ_BYTES = REGISTRY.counter('antivirus_read_bytes_total', 'Bytes read from scanned files', ('stage',))
+FEATURE_SECONDS = REGISTRY.histogram('antivirus_feature_seconds', 'Feature computation time per batch')
+INFERENCE_SECONDS = REGISTRY.histogram('antivirus_inference_seconds', 'Model inference time per batch')
+INFERENCE_FILES = REGISTRY.counter('antivirus_inference_files_total', 'Files classified by the model')
+CASCADE_RESOLVED = REGISTRY.counter('antivirus_cascade_resolved_total', 'Files resolved per cascade tier', ('tier',))
+VERDICTS = REGISTRY.counter('antivirus_verdicts_total', 'Scan verdicts', ('status',))
+CACHE_LOOKUPS = REGISTRY.counter('antivirus_cache_lookups_total', 'Scan cache lookups', ('result',))
+SIGNATURE_MATCHES = REGISTRY.counter('antivirus_signature_matches_total', 'Files matched by hash signature')
+UNHASHED_FILES = REGISTRY.counter('antivirus_unhashed_files_total', 'Files above the hash size limit (no signature check)')
+QUARANTINE_MOVES = REGISTRY.counter('antivirus_quarantine_moves_total', 'Quarantine moves', ('result',))
+QUARANTINE_SECONDS = REGISTRY.histogram('antivirus_quarantine_seconds', 'Time to quarantine a file')
@@ -0,0 +1,194 @@
+# model_bundle.py
+#
+# Versioned engine bundles: models/bundles/<version>/ holds a copy of the model, scaler,
+# signature and cascade artifacts plus manifest.json with their SHA-256 checksums.
+# models/bundles/CURRENT names the active bundle; every Antivirus polls it and swaps
+# engines without a restart. HISTORY lists activations, so rollback steps back one.
+# The CLI loads a bundle and runs a test prediction before activating it.
+#
+#   python model_bundle.py [--no-check] create [--version V] [--no-activate]
+#   python model_bundle.py list | verify V | activate V | rollback
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import argparse
+from inference import MODEL_DIR, MODEL_PATH, SCALER_PATH, NPZ_PATH, FLOAT16_NPZ_PATH, MODEL_INFO_PATH
+from signature_db import SIGNATURE_PATH
+from cascade import CASCADE_PATH, ALLOWLIST_PATH
+
+BUNDLE_DIR = os.path.join(MODEL_DIR, 'bundles')
+MANIFEST_NAME = 'manifest.json'
+CURRENT_NAME = 'CURRENT'
+HISTORY_NAME = 'HISTORY'
+
+# Artifact file names a bundle may contain (all optional except a model)
+ARTIFACT_NAMES = [os.path.basename(path) for path in (NPZ_PATH, FLOAT16_NPZ_PATH, MODEL_PATH, SCALER_PATH,
+                                                      MODEL_INFO_PATH, SIGNATURE_PATH, CASCADE_PATH, ALLOWLIST_PATH)]
+
+class BundleError(ValueError):
+    pass
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def bundle_path(version, bundle_dir=BUNDLE_DIR):
+    return os.path.join(bundle_dir, version)
+
+def write_atomic(path, text):
+    partial_path = f'{path}.{os.getpid()}.partial'
+    with open(partial_path, 'w') as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(partial_path, path)
+
+def create_bundle(version=None, source_dir=MODEL_DIR, bundle_dir=BUNDLE_DIR, activate_bundle=True, check=False):
+    # Snapshot the artifacts in source_dir as a new bundle; returns its version
+    version = version or time.strftime('%Y%m%d-%H%M%S')
+    target = bundle_path(version, bundle_dir)
+    if os.path.exists(target):
+        raise BundleError(f'Bundle {version} already exists')
+    names = [name for name in ARTIFACT_NAMES if os.path.isfile(os.path.join(source_dir, name))]
+    if not any(name in names for name in (os.path.basename(NPZ_PATH), os.path.basename(MODEL_PATH))):
+        raise BundleError(f'No model found in {source_dir}')
+
+    # Built under a temporary name and renamed, so watchers never see a half-written bundle
+    partial = f'{target}.partial'
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+    files = {}
+    for name in names:
+        shutil.copyfile(os.path.join(source_dir, name), os.path.join(partial, name))
+        files[name] = {'sha256': file_sha256(os.path.join(partial, name)),
+                       'size': os.path.getsize(os.path.join(partial, name))}
+    manifest = {'version': version, 'created_at': time.time(), 'files': files}
+    with open(os.path.join(partial, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(partial, target)
+    if activate_bundle:
+        activate(version, bundle_dir, check=check)
+    return version
+
+def read_manifest(directory):
+    with open(os.path.join(directory, MANIFEST_NAME)) as f:
+        return json.load(f)
+
+def verify_bundle(directory):
+    # Raises BundleError unless every file listed in the manifest matches its checksum
+    try:
+        manifest = read_manifest(directory)
+    except (OSError, ValueError) as e:
+        raise BundleError(f'Unreadable manifest in {directory}: {e}') from None
+    for name, info in manifest['files'].items():
+        path = os.path.join(directory, name)
+        if not os.path.isfile(path):
+            raise BundleError(f'{name} is missing from bundle {manifest["version"]}')
+        if file_sha256(path) != info['sha256']:
+            raise BundleError(f'{name} in bundle {manifest["version"]} does not match its checksum')
+    return manifest
+
+def list_bundles(bundle_dir=BUNDLE_DIR):
+    # Oldest first
+    if not os.path.isdir(bundle_dir):
+        return []
+    manifests = []
+    for entry in os.scandir(bundle_dir):
+        if entry.is_dir() and os.path.isfile(os.path.join(entry.path, MANIFEST_NAME)):
+            manifests.append(read_manifest(entry.path))
+    return sorted(manifests, key=lambda manifest: manifest['created_at'])
+
+def current_version(bundle_dir=BUNDLE_DIR):
+    try:
+        with open(os.path.join(bundle_dir, CURRENT_NAME)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def active_model_dir(bundle_dir=BUNDLE_DIR):
+    # The active bundle, or the plain models directory when no bundle was ever activated
+    version = current_version(bundle_dir)
+    return bundle_path(version, bundle_dir) if version else MODEL_DIR
+
+def read_history(bundle_dir=BUNDLE_DIR):
+    try:
+        with open(os.path.join(bundle_dir, HISTORY_NAME)) as f:
+            return [line.strip() for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+
+def check_bundle(version, bundle_dir=BUNDLE_DIR, backend='auto'):
+    # Load the bundle as a scan engine would and make sure it can classify; raises if not
+    from engine import Engine
+    Engine(backend, model_dir=bundle_path(version, bundle_dir)).validate()
+
+def activate(version, bundle_dir=BUNDLE_DIR, record=True, check=False):
+    # Running scanners pick the new CURRENT up on their next poll
+    verify_bundle(bundle_path(version, bundle_dir))
+    if check:
+        check_bundle(version, bundle_dir)
+    if record:
+        history = read_history(bundle_dir)
+        write_atomic(os.path.join(bundle_dir, HISTORY_NAME), '\n'.join(history + [version]) + '\n')
+    write_atomic(os.path.join(bundle_dir, CURRENT_NAME), version + '\n')
+
+def rollback_target(bundle_dir=BUNDLE_DIR):
+    # The bundle rollback() would re-activate, or None
+    history = read_history(bundle_dir)
+    return history[-2] if len(history) >= 2 else None
+
+def rollback(bundle_dir=BUNDLE_DIR):
+    # Re-activate the bundle that was active before the current one; returns its version
+    history = read_history(bundle_dir)
+    if len(history) < 2:
+        raise BundleError('No earlier bundle to roll back to')
+    history.pop()
+    previous = history[-1]
+    activate(previous, bundle_dir, record=False)
+    write_atomic(os.path.join(bundle_dir, HISTORY_NAME), '\n'.join(history) + '\n')
+    return previous
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Create, verify, activate and roll back engine bundles.')
+    parser.add_argument('--bundle-dir', default=BUNDLE_DIR)
+    parser.add_argument('--no-check', action='store_true',
+                        help='Activate without loading the bundle first to check that it can scan')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    create_parser = subparsers.add_parser('create', help='Snapshot the current model artifacts as a bundle')
+    create_parser.add_argument('--version')
+    create_parser.add_argument('--source', default=MODEL_DIR)
+    create_parser.add_argument('--no-activate', action='store_true')
+    subparsers.add_parser('list')
+    verify_parser = subparsers.add_parser('verify')
+    verify_parser.add_argument('version')
+    activate_parser = subparsers.add_parser('activate')
+    activate_parser.add_argument('version')
+    subparsers.add_parser('rollback')
+    args = parser.parse_args()
+
+    if args.command == 'create':
+        version = create_bundle(args.version, args.source, args.bundle_dir, not args.no_activate, not args.no_check)
+        print(f'Created bundle {version}' + ('' if args.no_activate else ' (active)'))
+    elif args.command == 'list':
+        active = current_version(args.bundle_dir)
+        for manifest in list_bundles(args.bundle_dir):
+            marker = '*' if manifest['version'] == active else ' '
+            created = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(manifest['created_at']))
+            print(f"{marker} {manifest['version']}  {created}  {', '.join(sorted(manifest['files']))}")
+    elif args.command == 'verify':
+        verify_bundle(bundle_path(args.version, args.bundle_dir))
+        print(f'Bundle {args.version} is intact')
+    elif args.command == 'activate':
+        activate(args.version, args.bundle_dir, check=not args.no_check)
+        print(f'Activated bundle {args.version}')
+    else:
+        print(f'Rolled back to bundle {rollback(args.bundle_dir)}')
@@ -0,0 +1,181 @@
+# quarantine.py
+#
+# Quarantined files are stored content-addressed and gzip-compressed under
+# <quarantine>/objects/<first two hex digits>/<sha256>.gz, with one SQLite row per
+# quarantine event. Same-named files never collide, identical files share one object,
+# and listing or adding entries never rescans the directory.
+
+import os
+import gzip
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+import logging
+from collections import namedtuple
+
+INDEX_NAME = 'index.db'
+OBJECTS_DIR = 'objects'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+QuarantineEntry = namedtuple(
+    'QuarantineEntry', 'id original_path sha256 verdict probability quarantined_at size stored_size')
+
+_COLUMNS = ', '.join(QuarantineEntry._fields)
+
+def sha256_file(file_path, chunk_size=COPY_CHUNK_SIZE):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.digest()
+
+class QuarantineStore:
+    def __init__(self, directory='quarantine', compress_level=6):
+        self.directory = directory
+        self.objects_dir = os.path.join(directory, OBJECTS_DIR)
+        os.makedirs(self.objects_dir, exist_ok=True)
+        # gzip level for stored objects (0 stores them uncompressed inside the gzip wrapper)
+        self.compress_level = compress_level
+        # Called with ('added', entry) or ('removed', entry) so views update one row at a time
+        self.listeners = []
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(os.path.join(directory, INDEX_NAME), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS entries ('
+            'id INTEGER PRIMARY KEY AUTOINCREMENT, original_path TEXT, sha256 TEXT, verdict TEXT, '
+            'probability REAL, quarantined_at REAL, size INTEGER, stored_size INTEGER)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_sha256 ON entries (sha256)')
+        self.conn.commit()
+        self.import_loose_files()
+
+    def object_path(self, sha256_hex):
+        return os.path.join(self.objects_dir, sha256_hex[:2], sha256_hex + '.gz')
+
+    def add(self, file_path, verdict, probability=None, sha256_digest=None):
+        # Moves file_path into the store and returns its QuarantineEntry
+        original_path = os.path.abspath(file_path)
+        size = os.path.getsize(original_path)
+        sha256_hex = (sha256_digest or sha256_file(original_path)).hex()
+        object_path = self.object_path(sha256_hex)
+        # Compressed outside the lock; usually the object is still missing when it is linked
+        partial_path = None if os.path.exists(object_path) else self.write_partial(original_path, object_path)
+
+        quarantined_at = time.time()
+        with self._lock:
+            # Linking the object and inserting its row are one write transaction, so remove()
+            # (in this or another process) cannot unlink the object in between
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                if not os.path.exists(object_path):
+                    if partial_path is None:
+                        partial_path = self.write_partial(original_path, object_path)
+                    os.replace(partial_path, object_path)
+                    partial_path = None
+                stored_size = os.path.getsize(object_path)
+                cursor = self.conn.execute(
+                    f'INSERT INTO entries ({_COLUMNS}) VALUES (NULL, ?, ?, ?, ?, ?, ?, ?)',
+                    (original_path, sha256_hex, verdict, probability, quarantined_at, size, stored_size))
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+            finally:
+                # Another add linked the same content first
+                if partial_path is not None:
+                    os.remove(partial_path)
+        os.remove(original_path)
+        entry = QuarantineEntry(cursor.lastrowid, original_path, sha256_hex, verdict, probability,
+                                quarantined_at, size, stored_size)
+        self.notify('added', entry)
+        return entry
+
+    def write_partial(self, original_path, object_path):
+        # Written under a temporary name, so a crash never leaves a truncated object
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        partial_path = f'{object_path}.{os.getpid()}.{threading.get_ident()}.partial'
+        with open(original_path, 'rb') as source, \
+                gzip.open(partial_path, 'wb', compresslevel=self.compress_level) as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        return partial_path
+
+    def get(self, entry_id):
+        with self._lock:
+            row = self.conn.execute(f'SELECT {_COLUMNS} FROM entries WHERE id = ?', (entry_id,)).fetchone()
+        if row is None:
+            raise KeyError(f'No quarantine entry {entry_id}')
+        return QuarantineEntry(*row)
+
+    def entries(self, limit=None, offset=0):
+        # Newest first
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT {_COLUMNS} FROM entries ORDER BY id DESC LIMIT ? OFFSET ?',
+                (-1 if limit is None else limit, offset)).fetchall()
+        return [QuarantineEntry(*row) for row in rows]
+
+    def count(self):
+        with self._lock:
+            return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def restore(self, entry_id, destination=None):
+        # Decompresses the entry to destination (default: its original path) and drops it
+        entry = self.get(entry_id)
+        destination = destination or entry.original_path
+        if os.path.exists(destination):
+            raise FileExistsError(f'{destination} already exists')
+        os.makedirs(os.path.dirname(os.path.abspath(destination)), exist_ok=True)
+        with gzip.open(self.object_path(entry.sha256), 'rb') as source, open(destination, 'xb') as target:
+            shutil.copyfileobj(source, target, COPY_CHUNK_SIZE)
+        self.remove(entry)
+        return destination
+
+    def delete(self, entry_id):
+        self.remove(self.get(entry_id))
+
+    def remove(self, entry):
+        with self._lock:
+            # Same write transaction as add(): the reference count and the unlink are atomic
+            # with respect to a concurrent add of identical content
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                self.conn.execute('DELETE FROM entries WHERE id = ?', (entry.id,))
+                shared = self.conn.execute('SELECT 1 FROM entries WHERE sha256 = ? LIMIT 1',
+                                           (entry.sha256,)).fetchone()
+                # Objects are shared by identical files; the last reference removes it
+                if shared is None:
+                    try:
+                        os.remove(self.object_path(entry.sha256))
+                    except FileNotFoundError:
+                        pass
+                self.conn.commit()
+            except BaseException:
+                self.conn.rollback()
+                raise
+        self.notify('removed', entry)
+
+    def notify(self, event, entry):
+        for listener in self.listeners:
+            try:
+                listener(event, entry)
+            except Exception:
+                logging.exception('Quarantine listener failed')
+
+    def import_loose_files(self):
+        # Files moved into the flat quarantine directory by older versions
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and entry.name != INDEX_NAME and not entry.name.startswith(INDEX_NAME + '-'):
+                try:
+                    self.add(entry.path, 'Quarantined by an earlier version')
+                except OSError as e:
+                    logging.error(f'Could not import {entry.path} into the quarantine store: {e}')
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
@@ -2,37 +2,233 @@
 
 import os
 import time
+import threading
+from collections import OrderedDict, deque
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 from antivirus import Antivirus
+from tree_state import TreeState, TREE_STATE_PATH
+from scan_rules import default_rules, NORMAL, LOW
+import logging
+
+class EventQueue:
+    # Pending paths in order of their last event, one queue per scan priority. Repeated events
+    # for a path move it to the back of its queue and restart its quiet period, so a file being
+    # written is scanned once, after it settles. Settled high-priority paths are taken first,
+    # and a full queue drops low-priority paths first.
+
+    def __init__(self, quiet_period=0.5, max_pending=10000, overflow='drop_oldest', levels=LOW + 1):
+        if overflow not in ('drop_oldest', 'drop_newest'):
+            raise ValueError(f'Unknown overflow policy: {overflow}')
+        self.quiet_period = quiet_period
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.coalesced = 0
+        self.dropped = 0
+        self._levels = [OrderedDict() for _ in range(levels)]  # path -> (first_seen, last_seen)
+        self._level_of = {}  # path -> index into _levels
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def put(self, path, priority=NORMAL):
+        with self._condition:
+            now = time.monotonic()
+            level = self._level_of.get(path)
+            if level is not None:
+                first_seen, _ = self._levels[level].pop(path)
+                self._levels[level][path] = (first_seen, now)
+                self.coalesced += 1
+                return True
+            if len(self._level_of) >= self.max_pending:
+                self.dropped += 1
+                # The oldest path of the lowest non-empty priority goes, unless the new one ranks lower still
+                lowest = max(level for level, pending in enumerate(self._levels) if pending)
+                if self.overflow == 'drop_newest' or priority > lowest:
+                    logging.warning(f'Real-time queue full, dropping event for {path}')
+                    return False
+                dropped_path, _ = self._levels[lowest].popitem(last=False)
+                del self._level_of[dropped_path]
+                logging.warning(f'Real-time queue full, dropping event for {dropped_path}')
+            self._levels[priority][path] = (now, now)
+            self._level_of[path] = priority
+            self._condition.notify()
+            return True
+
+    def get_batch(self, max_items):
+        # Blocks until at least one path has been quiet for quiet_period.
+        # Returns a list of (path, first_seen) pairs, or [] once the queue is closed.
+        with self._condition:
+            while not self._closed:
+                wait = None
+                if self._level_of:
+                    # Each queue is ordered by last event, so only its first path can be the next to settle
+                    last_seen = min(next(iter(pending.values()))[1] for pending in self._levels if pending)
+                    wait = last_seen + self.quiet_period - time.monotonic()
+                    if wait <= 0:
+                        return self._take_ready(max_items)
+                self._condition.wait(wait)
+            return []
+
+    def _take_ready(self, max_items):
+        ready = []
+        deadline = time.monotonic() - self.quiet_period
+        for pending in self._levels:
+            while pending and len(ready) < max_items:
+                path, (first_seen, last_seen) = next(iter(pending.items()))
+                if last_seen > deadline:
+                    break
+                del pending[path]
+                del self._level_of[path]
+                ready.append((path, first_seen))
+        if ready:
+            self._condition.notify_all()
+        return ready
+
+    def depth(self):
+        with self._condition:
+            return len(self._level_of)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def wait_below(self, depth, timeout=None):
+        # Blocks until fewer than depth paths are pending (or the queue is closed)
+        with self._condition:
+            return self._condition.wait_for(lambda: self._closed or len(self._level_of) < depth, timeout)
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
 
 class RealTimeProtectionHandler(FileSystemEventHandler):
-    def __init__(self, antivirus):
-        self.antivirus = antivirus
+    def __init__(self, event_queue, rules=None):
+        self.event_queue = event_queue
+        # Events for excluded paths (including the app's own log and databases) are ignored
+        self.rules = rules
+
+    def queue(self, path):
+        if self.rules is None:
+            self.event_queue.put(path)
+            return
+        priority = self.rules.path_priority(path)
+        if priority is not None:
+            self.event_queue.put(path, priority)
 
     def on_created(self, event):
         if not event.is_directory:
-            result = self.antivirus.scan_file(event.src_path)
-            print(result)
+            self.queue(event.src_path)
 
     def on_modified(self, event):
         if not event.is_directory:
-            result = self.antivirus.scan_file(event.src_path)
-            print(result)
+            self.queue(event.src_path)
 
 class RealTimeProtection:
-    def __init__(self, path='.'):
+    def __init__(self, path='.', workers=2, batch_size=32, quiet_period=0.5, max_pending=10000, overflow='drop_oldest',
+                 antivirus=None, on_result=None, state_path=TREE_STATE_PATH, rules=None):
         self.path = path
-        self.antivirus = Antivirus()
+        self.antivirus = antivirus or Antivirus()
+        # Which files are watched and in what order they are scanned
+        self.rules = rules or default_rules(self.antivirus, state_path)
+        # Called with (file_path, message, status) for every verdict, defaults to printing it
+        self.on_result = on_result or (lambda file_path, message, status: print((message, status)))
         self.observer = Observer()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.event_queue = EventQueue(quiet_period, max_pending, overflow)
+        self.worker_threads = []
+        # Files changed while protection was off are found by diffing this persisted state
+        # of the tree on start; None disables the catch-up
+        self.tree_state = TreeState(path, state_path) if state_path else None
+        self.catch_up_thread = None
+        self.caught_up = 0
+        # Updated by every scan worker
+        self.scanned = 0
+        self.failed_batches = 0
+        self._stats_lock = threading.Lock()
+        # Event-to-verdict latencies (seconds) of the most recent scans
+        self.latencies = deque(maxlen=1000)
 
     def start(self):
-        event_handler = RealTimeProtectionHandler(self.antivirus)
+        event_handler = RealTimeProtectionHandler(self.event_queue, self.rules)
         self.observer.schedule(event_handler, self.path, recursive=True)
+        for i in range(self.workers):
+            thread = threading.Thread(target=self.scan_worker, name=f'realtime-scan-{i}', daemon=True)
+            thread.start()
+            self.worker_threads.append(thread)
+        # The observer runs first, so nothing changed during the catch-up walk is missed
         self.observer.start()
+        if self.tree_state:
+            self.catch_up_thread = threading.Thread(target=self.catch_up, name='realtime-catch-up', daemon=True)
+            self.catch_up_thread.start()
         print(f'Real-time protection started on {os.path.abspath(self.path)}')
 
+    def catch_up(self):
+        # Queue files added or changed while protection was off. Only half the queue is
+        # used, so a large backlog is fed in as the workers drain it and live events keep room.
+        started = time.monotonic()
+        try:
+            for file_path, priority in self.tree_state.reconcile(self.rules):
+                self.event_queue.wait_below(max(1, self.event_queue.max_pending // 2))
+                if self.event_queue.closed:
+                    break
+                self.event_queue.put(file_path, priority)
+                self.caught_up += 1
+        except Exception:
+            logging.exception('Catching up on offline changes failed')
+        logging.info(f'Queued {self.caught_up} files changed while offline '
+                     f'({time.monotonic() - started:.2f}s to compare the tree)')
+
+    def scan_worker(self):
+        while True:
+            batch = self.event_queue.get_batch(self.batch_size)
+            if not batch:
+                return
+            first_seen = dict(batch)
+            # A failing batch is logged and dropped; the worker keeps draining the queue
+            try:
+                for file_path, message, status in self.antivirus.scan_files(first_seen, batch_size=self.batch_size):
+                    self.latencies.append(time.monotonic() - first_seen[file_path])
+                    with self._stats_lock:
+                        self.scanned += 1
+                    if self.tree_state:
+                        self.tree_state.record(file_path)
+                    try:
+                        self.on_result(file_path, message, status)
+                    except Exception:
+                        logging.exception(f'Result callback failed for {file_path}')
+            except Exception:
+                with self._stats_lock:
+                    self.failed_batches += 1
+                logging.exception(f'Scanning a batch of {len(batch)} files failed')
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+        def percentile(p):
+            return latencies[min(len(latencies) - 1, int(p * len(latencies)))] if latencies else 0.0
+        return {
+            'queue_depth': self.event_queue.depth(),
+            'coalesced_events': self.event_queue.coalesced,
+            'dropped_events': self.event_queue.dropped,
+            'files_scanned': self.scanned,
+            'failed_batches': self.failed_batches,
+            'offline_changes': self.caught_up,
+            'latency_p50': percentile(0.50),
+            'latency_p99': percentile(0.99),
+        }
+
     def stop(self):
         self.observer.stop()
         self.observer.join()
+        self.event_queue.close()
+        for thread in self.worker_threads:
+            thread.join()
+        self.worker_threads = []
+        if self.catch_up_thread:
+            self.catch_up_thread.join()
+            self.catch_up_thread = None
+        if self.tree_state:
+            # Written on shutdown: whatever was scanned is now part of the state
+            self.tree_state.close()
         print('Real-time protection stopped.')
@@ -0,0 +1,136 @@
+# scan_cache.py
+
+import os
+import time
+import sqlite3
+import threading
+import hashlib
+import logging
+
+# Per-user, so the GUI, CLI, daemon and scan service share one cache wherever they are started
+DATA_DIR = os.path.join(os.environ.get('XDG_DATA_HOME') or os.environ.get('LOCALAPPDATA')
+                        or os.path.join(os.path.expanduser('~'), '.local', 'share'), 'antivirus')
+CACHE_PATH = os.path.join(DATA_DIR, 'scan_cache.db')
+
+# Pending writes are committed in groups to avoid one fsync per scanned file
+COMMIT_EVERY = 256
+
+# Bumped when the verdicts table changes; older caches are dropped and rebuilt
+SCHEMA_VERSION = 2
+
+# Several processes (GUI, daemon, scan service) share the file and may run different
+# engines during a swap or rollback, so verdicts of the most recently used engine versions
+# are kept, and verdicts older than MAX_AGE_SECONDS are pruned whatever their engine
+KEEP_ENGINE_VERSIONS = 4
+MAX_AGE_SECONDS = 30 * 24 * 3600
+
+def file_key(stat_result):
+    # ctime cannot be set from user space, so restoring mtime after a write still misses
+    return (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns,
+            stat_result.st_ctime_ns)
+
+def content_digest(file_path, chunk_size=1024 * 1024):
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            sha256.update(chunk)
+    return sha256.digest()
+
+class ScanCache:
+    # Verdicts keyed by (device, inode, size, mtime_ns, ctime_ns) and tied to the engine
+    # version, so retraining the model or changing signatures invalidates every entry.
+
+    def __init__(self, path=CACHE_PATH, engine_version='', verify_content=False):
+        self.path = path
+        self.engine_version = engine_version
+        # Re-hash files on a hit and compare with the stored digest (slower, survives mtime tampering)
+        self.verify_content = verify_content
+        self.hits = 0
+        self.misses = 0
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        if self.conn.execute('PRAGMA user_version').fetchone()[0] < SCHEMA_VERSION:
+            self.conn.execute('DROP TABLE IF EXISTS verdicts')
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS verdicts ('
+            'device INTEGER, inode INTEGER, size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, '
+            'engine_version TEXT, content_hash BLOB, status TEXT, scanned_at REAL, '
+            'PRIMARY KEY (device, inode, engine_version))')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS verdicts_by_engine ON verdicts (engine_version, scanned_at)')
+        self.conn.commit()
+        self.prune()
+
+    def prune(self):
+        # Drops verdicts of engines no longer among the recently used ones (never the current
+        # one) and verdicts past MAX_AGE_SECONDS. Reads only ever match the current engine.
+        with self._lock:
+            self.conn.execute(
+                'DELETE FROM verdicts WHERE scanned_at < ? OR (engine_version != ? AND engine_version NOT IN ('
+                'SELECT engine_version FROM verdicts GROUP BY engine_version ORDER BY MAX(scanned_at) DESC LIMIT ?))',
+                (time.time() - MAX_AGE_SECONDS, self.engine_version, KEEP_ENGINE_VERSIONS))
+            self.conn.commit()
+            self._pending = 0
+
+    def get(self, file_path, stat_result):
+        device, inode, size, mtime_ns, ctime_ns = file_key(stat_result)
+        with self._lock:
+            row = self.conn.execute(
+                'SELECT status, content_hash FROM verdicts WHERE device = ? AND inode = ? AND engine_version = ? '
+                'AND size = ? AND mtime_ns = ? AND ctime_ns = ?',
+                (device, inode, self.engine_version, size, mtime_ns, ctime_ns)).fetchone()
+        if row is not None and self.verify_content:
+            if row[1] is None or content_digest(file_path) != row[1]:
+                row = None
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return row[0]
+
+    def put(self, stat_result, status, content_hash=None):
+        if self.verify_content and content_hash is None:
+            return
+        with self._lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO verdicts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (*file_key(stat_result), self.engine_version, content_hash, status, time.time()))
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.conn.commit()
+                self._pending = 0
+
+    def set_engine_version(self, engine_version):
+        # After an engine swap. Verdicts of the previous engine stay for other processes
+        # still running it (and for a rollback) until prune() ages them out.
+        with self._lock:
+            self.engine_version = engine_version
+        self.prune()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self.conn.commit()
+                self._pending = 0
+
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate()}
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+        logging.debug(f'Scan cache closed: {self.stats()}')
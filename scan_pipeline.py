@@ -0,0 +1,303 @@
+# scan_pipeline.py
+
+import os
+import time
+import queue
+import threading
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import numpy as np
+from archive import ArchiveLimits, ArchiveMembers, archive_kind, sample_archive
+import metrics
+
+# Marks the end of a stage's output
+_DONE = object()
+
+def walk_entries(directory, prune=None):
+    # Iterative os.scandir walk yielding the DirEntry of every regular file: no per-directory
+    # list of names and no recursion limit. Directories for which prune(entry) is true are skipped.
+    stack = [directory]
+    while stack:
+        path = stack.pop()
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if prune is None or not prune(entry):
+                                stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry
+                    except OSError:
+                        continue
+        except OSError as e:
+            logging.warning(f'Cannot list directory {path}: {e}')
+
+def walk_files(directory, rules=None):
+    # With ScanRules, excluded directories are never listed, excluded files are skipped and
+    # the rest come out highest priority first
+    if rules is None:
+        return (entry.path for entry in walk_entries(directory))
+    return rules.order(walk_entries(directory, rules.prune))
+
+class ScanProgress:
+    # Counters shared between pipeline stages. The total is only known once the walk
+    # finishes, until then files_found is the best estimate.
+
+    def __init__(self):
+        self.files_found = 0
+        self.files_scanned = 0
+        self.walk_done = False
+        self.started = time.perf_counter()
+
+    def estimated_total(self):
+        return max(self.files_found, self.files_scanned)
+
+    def fraction(self):
+        total = self.estimated_total()
+        if not total:
+            return 1.0 if self.walk_done else 0.0
+        return self.files_scanned / total
+
+    def files_per_second(self):
+        elapsed = time.perf_counter() - self.started
+        return self.files_scanned / elapsed if elapsed > 0 else 0.0
+
+class ScanPipeline:
+    # walk -> bounded queue -> reader threads (hash, cache, features) -> bounded queue -> batched inference.
+    # Queues are bounded, so memory stays flat no matter how large the tree is.
+
+    def __init__(self, antivirus, workers=4, batch_size=64, queue_size=1024, linger=0.005, rules=None):
+        self.antivirus = antivirus
+        # ScanRules applied by scan_directory (None walks everything)
+        self.rules = rules
+        self.workers = workers
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        # How long inference waits for a partial batch to fill before running it
+        self.linger = linger
+        self.progress = ScanProgress()
+
+    def scan_directory(self, directory):
+        return self.scan_paths(walk_files(directory, self.rules))
+
+    def scan_paths(self, file_paths):
+        # Yields (file_path, message, status) as batches complete (not in walk order)
+        self.progress = progress = ScanProgress()
+        stop = threading.Event()
+        path_queue = queue.Queue(self.queue_size)
+        prepared_queue = queue.Queue(self.queue_size)
+
+        def put(target, item):
+            while not stop.is_set():
+                try:
+                    target.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def walker():
+            try:
+                for file_path in file_paths:
+                    progress.files_found += 1
+                    if not put(path_queue, file_path):
+                        return
+            finally:
+                progress.walk_done = True
+                for _ in range(self.workers):
+                    put(path_queue, _DONE)
+
+        def reader():
+            while not stop.is_set():
+                try:
+                    file_path = path_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if file_path is _DONE:
+                    put(prepared_queue, _DONE)
+                    return
+                if not put(prepared_queue, (file_path, self.antivirus.prepare_file(file_path))):
+                    return
+
+        threads = [threading.Thread(target=walker, name='scan-walker', daemon=True)]
+        threads += [threading.Thread(target=reader, name=f'scan-reader-{i}', daemon=True) for i in range(self.workers)]
+        for thread in threads:
+            thread.start()
+
+        finished_readers = 0
+        try:
+            while finished_readers < self.workers:
+                # Block for the first item, then collect up to batch_size for at most linger seconds
+                batch = []
+                item = prepared_queue.get()
+                deadline = time.perf_counter() + self.linger
+                while True:
+                    if item is _DONE:
+                        finished_readers += 1
+                    else:
+                        batch.append(item)
+                    if len(batch) >= self.batch_size or finished_readers == self.workers:
+                        break
+                    try:
+                        item = prepared_queue.get(timeout=max(deadline - time.perf_counter(), 0))
+                    except queue.Empty:
+                        break
+                for result in self.antivirus.classify_batch(batch):
+                    progress.files_scanned += 1
+                    yield result
+        finally:
+            stop.set()
+            self.antivirus.flush_cache()
+
+def extract_chunk(task):
+    # Runs in a worker process: hash and sample each file, then featurise the whole chunk in
+    # one call. Only per-file records and one float32 matrix go back, never the sampled bytes.
+    # Archives are unpacked here too (archive_limits None scans them as plain files).
+    file_paths, feature_version, max_read_bytes, max_hash_bytes, archive_limits = task
+    from feature_extractor import get_feature_spec
+    from signature_db import hash_file, within_hash_limit
+
+    spec = get_feature_spec(feature_version)
+    records, samples, sizes = [], [], []
+    hashed_bytes = sampled_bytes = 0
+    for file_path in file_paths:
+        # (file_path, stat, md5, sha256, feature row or -1 or ArchiveMembers, error)
+        try:
+            stat = os.stat(file_path)
+            md5_digest = sha256_digest = None
+            if within_hash_limit(stat.st_size, max_hash_bytes):
+                md5_digest, sha256_digest = hash_file(file_path)
+                hashed_bytes += stat.st_size
+            sample = spec.read_sample(file_path, max_read_bytes)
+            sampled_bytes += len(sample)
+            archive = None
+            if archive_limits is not None and archive_kind(sample):
+                archive = sample_archive(file_path, spec, max_read_bytes, archive_limits)
+        except Exception as e:
+            records.append((file_path, None, None, None, -1, str(e)))
+            continue
+        if archive is not None:
+            sampled_bytes += archive.decompressed_bytes
+            records.append((file_path, stat, md5_digest, sha256_digest, archive, None))
+            continue
+        row = -1
+        if sample:
+            row = len(samples)
+            samples.append(sample)
+            sizes.append(stat.st_size)
+        records.append((file_path, stat, md5_digest, sha256_digest, row, None))
+    if samples:
+        features = spec.features_from_samples(samples, sizes)
+    else:
+        features = np.empty((0, spec.n_features), dtype=np.float32)
+    return records, features, hashed_bytes, sampled_bytes
+
+class ProcessScanPipeline:
+    # Multi-process mode: feature extraction is partly Python-bound, so threads stop scaling
+    # after a few cores. Worker processes hash, sample and featurise chunks of batch_size files;
+    # the parent keeps the cache, signatures and model and runs one inference per chunk.
+
+    def __init__(self, antivirus, workers=None, batch_size=64, max_pending_chunks=None, rules=None):
+        self.antivirus = antivirus
+        self.rules = rules
+        self.workers = workers or os.cpu_count() or 4
+        self.batch_size = batch_size
+        # Chunks submitted but not yet classified; bounds parent memory on huge trees
+        self.max_pending_chunks = max_pending_chunks or 2 * self.workers
+        self.progress = ScanProgress()
+
+    def scan_directory(self, directory):
+        return self.scan_paths(walk_files(directory, self.rules))
+
+    def scan_paths(self, file_paths):
+        # Yields (file_path, message, status) as chunks complete (not in walk order)
+        self.progress = progress = ScanProgress()
+        antivirus = self.antivirus
+        # Workers extract features for this engine; a swap mid-scan applies to the next scan
+        engine = antivirus.engine
+        archive_limits = (antivirus.archive_limits or ArchiveLimits()) if antivirus.scan_archives else None
+        task_args = (engine.feature_spec.version, antivirus.max_read_bytes, antivirus.max_hash_bytes, archive_limits)
+        pending = set()
+        chunk = []
+        resolved = []
+
+        def classify(batch):
+            for result in antivirus.classify_batch(batch):
+                progress.files_scanned += 1
+                yield result
+
+        def collect(block):
+            nonlocal pending
+            done, pending = wait(pending, timeout=None if block else 0, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from classify(self.chunk_batch(future.result(), engine))
+
+        # Never fork: this process runs the engine loader and bundle watcher threads, and a
+        # fork taken while one of them holds a lock (logging, imports) can deadlock a worker
+        start_method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+        pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context(start_method))
+        try:
+            for file_path in file_paths:
+                progress.files_found += 1
+                # Missing files and cache hits never leave the parent
+                result = self.resolve_locally(file_path)
+                if result is not None:
+                    resolved.append((file_path, result))
+                    if len(resolved) >= self.batch_size:
+                        yield from classify(resolved)
+                        resolved = []
+                    continue
+                chunk.append(file_path)
+                if len(chunk) >= self.batch_size:
+                    pending.add(pool.submit(extract_chunk, (chunk, *task_args)))
+                    chunk = []
+                    yield from collect(block=len(pending) >= self.max_pending_chunks)
+            progress.walk_done = True
+            if chunk:
+                pending.add(pool.submit(extract_chunk, (chunk, *task_args)))
+            if resolved:
+                yield from classify(resolved)
+            while pending:
+                yield from collect(block=True)
+        finally:
+            progress.walk_done = True
+            pool.shutdown(wait=False, cancel_futures=True)
+            antivirus.flush_cache()
+
+    def resolve_locally(self, file_path):
+        if not os.path.isfile(file_path):
+            return f'File not found: {file_path}', None
+        try:
+            return self.antivirus.cached_verdict(file_path, os.stat(file_path))
+        except OSError as e:
+            return f'Error scanning {file_path}: {str(e)}', 'Unknown'
+
+    def chunk_batch(self, chunk_result, engine=None):
+        # Turn a worker's records into the (file_path, prepared) pairs classify_batch takes
+        from antivirus import PreparedFile
+        records, features, hashed_bytes, sampled_bytes = chunk_result
+        metrics.READ_BYTES.inc('hash', amount=hashed_bytes)
+        metrics.READ_BYTES.inc('features', amount=sampled_bytes)
+        batch = []
+        for file_path, stat, md5_digest, sha256_digest, row, error in records:
+            if error is not None:
+                logging.error(f'Exception occurred during scanning of {file_path}: {error}')
+                batch.append((file_path, (f'Error scanning {file_path}: {error}', 'Unknown')))
+                continue
+            result = None
+            if md5_digest is not None:
+                result = self.antivirus.match_hashes(file_path, md5_digest, sha256_digest)
+            else:
+                self.antivirus.skipped_hash(file_path, stat.st_size)
+            if result is None and isinstance(row, ArchiveMembers):
+                result = (self.antivirus.match_members(file_path, row, sha256_digest) or
+                          PreparedFile(None, stat, sha256_digest, row.features, engine, row))
+            if result is None and row < 0:
+                logging.error(f"No data in file: {file_path}")
+                result = f'Could not extract features from {file_path}. Classified as Unknown.', 'Unknown'
+            if result is None:
+                result = PreparedFile(None, stat, sha256_digest, features[row], engine)
+            batch.append((file_path, result))
+        return batch
@@ -0,0 +1,183 @@
+# scan_rules.py
+#
+# Which files a directory scan or watch looks at, and in what order. Rules are compiled
+# once (one regex for all name globs, one for all path globs, sets for directory names,
+# extensions and excluded paths), so checking a file costs a few set lookups and at most
+# two regex matches. Directories are pruned during the walk and never listed.
+#
+# Priorities: executables, files under a download directory and recently modified files
+# are scanned first, bulk data (media, logs, plain text, very large files) last.
+
+import os
+import re
+import time
+import heapq
+import fnmatch
+from scan_cache import CACHE_PATH
+
+HIGH, NORMAL, LOW = 0, 1, 2
+
+# Directories never worth walking: VCS metadata, dependency trees and caches
+DEFAULT_PRUNE_DIRS = ('.git', '.hg', '.svn', 'node_modules', '__pycache__', '.cache', '.pytest_cache', '.mypy_cache')
+
+EXECUTABLE_EXTENSIONS = frozenset((
+    '.exe', '.dll', '.sys', '.scr', '.com', '.cpl', '.msi', '.bat', '.cmd', '.ps1', '.vbs', '.vbe', '.js', '.jse',
+    '.wsf', '.hta', '.lnk', '.jar', '.apk', '.elf', '.so', '.dylib', '.sh', '.docm', '.xlsm', '.pptm'))
+
+LOW_RISK_EXTENSIONS = frozenset((
+    '.txt', '.log', '.csv', '.tsv', '.json', '.md', '.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp',
+    '.mp3', '.wav', '.flac', '.ogg', '.mp4', '.mkv', '.avi', '.mov', '.webm', '.parquet'))
+
+DOWNLOAD_DIRS = ('Downloads',)
+
+# Modified this recently counts as new
+RECENT_SECONDS = 24 * 3600
+
+# Files at least this large are scanned last (they only add read time)
+LARGE_BYTES = 256 * 1024 * 1024
+
+# Files buffered while a walk is reordered by priority; bounds memory on huge trees
+PRIORITY_WINDOW = 4096
+
+# The app's own state, which it rewrites while scanning
+APP_PATHS = ('quarantine', 'antivirus.log', CACHE_PATH, 'threat_history.db', 'tree_state.db')
+SQLITE_SUFFIXES = ('-wal', '-shm', '-journal')
+
+def compile_globs(patterns):
+    # Patterns without a separator match the file name, the others the end of the path
+    # ('build/*.o' matches under any build directory; '/srv/*' only from the root)
+    name_patterns = [fnmatch.translate(pattern) for pattern in patterns if '/' not in pattern]
+    path_patterns = [fnmatch.translate(pattern if pattern.startswith(('/', '*')) else '*/' + pattern)
+                     for pattern in patterns if '/' in pattern]
+    return (re.compile('|'.join(name_patterns)) if name_patterns else None,
+            re.compile('|'.join(path_patterns)) if path_patterns else None)
+
+def normalize_extensions(extensions):
+    return frozenset(('.' + extension.lower().lstrip('.')) for extension in extensions)
+
+class ScanRules:
+    def __init__(self, exclude_globs=(), include_globs=(), prune_dirs=DEFAULT_PRUNE_DIRS, exclude_paths=(),
+                 include_extensions=None, exclude_extensions=(), min_size=0, max_size=None,
+                 download_dirs=DOWNLOAD_DIRS, recent_seconds=RECENT_SECONDS, window=PRIORITY_WINDOW):
+        self.exclude_name, self.exclude_path = compile_globs(exclude_globs)
+        self.include_name, self.include_path = compile_globs(include_globs)
+        self.has_includes = bool(include_globs)
+        self.prune_dirs = frozenset(prune_dirs)
+        self.exclude_paths = frozenset(os.path.abspath(path) for path in exclude_paths)
+        # Only entries with one of these names need their absolute path compared
+        self.exclude_path_names = frozenset(os.path.basename(path) for path in self.exclude_paths)
+        self.include_extensions = None if include_extensions is None else normalize_extensions(include_extensions)
+        self.exclude_extensions = normalize_extensions(exclude_extensions)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.download_markers = tuple(f'{os.sep}{name}{os.sep}' for name in download_dirs)
+        self.recent_seconds = recent_seconds
+        self.window = window
+
+    @staticmethod
+    def _posix(path):
+        # Always with a leading separator, so relative walk paths match suffix patterns too
+        if os.sep != '/':
+            path = path.replace(os.sep, '/')
+        return path if path.startswith('/') else '/' + path
+
+    def _excluded_by_glob(self, name, path):
+        return bool((self.exclude_name and self.exclude_name.match(name)) or
+                    (self.exclude_path and self.exclude_path.match(self._posix(path))))
+
+    def _excluded_path(self, path, name):
+        return name in self.exclude_path_names and os.path.abspath(path) in self.exclude_paths
+
+    def prune(self, entry):
+        # True if the walk should skip this directory (a DirEntry) entirely
+        return (entry.name in self.prune_dirs or self._excluded_by_glob(entry.name, entry.path) or
+                self._excluded_path(entry.path, entry.name))
+
+    def priority(self, path, name, stat_result=None):
+        # Scan priority of a file that passed the rules; None if it is excluded. Its parent
+        # directories are assumed to be allowed (the walk prunes them, path_priority checks them).
+        # Without stat_result the size limits, exec bit and recency are not checked.
+        dot = name.rfind('.')
+        extension = name[dot:].lower() if dot > 0 else ''
+        if extension in self.exclude_extensions or self._excluded_by_glob(name, path):
+            return None
+        if self.include_extensions is not None and extension not in self.include_extensions:
+            return None
+        if self.has_includes and not ((self.include_name and self.include_name.match(name)) or
+                                      (self.include_path and self.include_path.match(self._posix(path)))):
+            return None
+        if self._excluded_path(path, name):
+            return None
+        if stat_result is not None:
+            if stat_result.st_size < self.min_size or (self.max_size is not None and stat_result.st_size > self.max_size):
+                return None
+        if extension in EXECUTABLE_EXTENSIONS or (stat_result is not None and stat_result.st_mode & 0o111):
+            return HIGH
+        if self.download_markers and any(marker in os.sep + path for marker in self.download_markers):
+            return HIGH
+        # Bulk data stays last even when it is new, so a fresh log never delays an executable
+        if extension in LOW_RISK_EXTENSIONS or (stat_result is not None and stat_result.st_size >= LARGE_BYTES):
+            return LOW
+        if stat_result is not None and stat_result.st_mtime > time.time() - self.recent_seconds:
+            return HIGH
+        return NORMAL
+
+    def entry_priority(self, entry):
+        try:
+            stat_result = entry.stat(follow_symlinks=False)
+        except OSError:
+            # Scanned anyway; the scan reports why the file cannot be read
+            stat_result = None
+        return self.priority(entry.path, entry.name, stat_result)
+
+    def path_priority(self, path):
+        # For watch events: also checks every parent directory, since events from inside
+        # pruned or excluded directories arrive with their full path
+        absolute = os.path.abspath(path)
+        parent = os.path.dirname(absolute)
+        while True:
+            name = os.path.basename(parent)
+            if not name:
+                break
+            if name in self.prune_dirs or self._excluded_path(parent, name) or self._excluded_by_glob(name, parent):
+                return None
+            next_parent = os.path.dirname(parent)
+            if next_parent == parent:
+                break
+            parent = next_parent
+        try:
+            stat_result = os.stat(path, follow_symlinks=False)
+        except OSError:
+            stat_result = None
+        return self.priority(path, os.path.basename(path), stat_result)
+
+    def order(self, entries):
+        # Yields the paths of the accepted DirEntry objects, highest priority first within
+        # a sliding window of self.window files (a full sort would hold the whole tree)
+        heap = []
+        for sequence, entry in enumerate(entries):
+            priority = self.entry_priority(entry)
+            if priority is None:
+                continue
+            heapq.heappush(heap, (priority, sequence, entry.path))
+            if len(heap) > self.window:
+                yield heapq.heappop(heap)[2]
+        while heap:
+            yield heapq.heappop(heap)[2]
+
+def app_paths(antivirus=None, state_path=None):
+    # Files and directories the app itself writes to while running: the default locations,
+    # plus the quarantine, cache and tree state actually configured
+    paths = [os.path.abspath(path) for path in APP_PATHS]
+    if antivirus is not None:
+        paths.append(antivirus.quarantine_dir)
+        if antivirus.cache_path:
+            paths.append(os.path.abspath(antivirus.cache_path))
+    if state_path:
+        paths.append(os.path.abspath(state_path))
+    return paths + [path + suffix for path in paths for suffix in SQLITE_SUFFIXES]
+
+def default_rules(antivirus=None, state_path=None, **kwargs):
+    # Rules for scans and watches started by the app: skip its own quarantine, log and databases
+    exclude_paths = list(kwargs.pop('exclude_paths', ())) + app_paths(antivirus, state_path)
+    return ScanRules(exclude_paths=exclude_paths, **kwargs)
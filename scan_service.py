@@ -0,0 +1,349 @@
+# scan_service.py
+#
+# Long-running scan service: one process loads the model, many clients send scan requests
+# over a Unix domain socket (or localhost TCP). The protocol is one JSON object per line:
+#   request  {"id": 1, "path": "/some/file"}
+#   response {"id": 1, "message": "File is clean: /some/file", "status": "Clean"}
+# Requests from all connections are coalesced into inference micro-batches.
+#
+# Only the user running the service (and root) may connect: the socket lives in a private
+# per-user directory with mode 0600, and the peer's uid is checked on every connection
+# (SO_PEERCRED for the Unix socket, /proc/net/tcp for localhost TCP).
+
+import os
+import sys
+import json
+import time
+import stat
+import struct
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+UID = os.getuid() if hasattr(os, 'getuid') else None
+
+# $XDG_RUNTIME_DIR is private to the user already; otherwise a 0700 directory in the temp dir
+SOCKET_DIR = os.environ.get('XDG_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f'antivirus-{UID}')
+SOCKET_PATH = os.path.join(SOCKET_DIR, 'antivirus.sock')
+
+def make_private_dir(directory):
+    # Creates directory with mode 0700, and refuses one that another user owns or can write to
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    dir_stat = os.stat(directory)
+    if dir_stat.st_uid != UID or dir_stat.st_mode & 0o077:
+        raise PermissionError(f'{directory} must be owned by uid {UID} and private (mode 0700)')
+
+def remove_stale_socket(socket_path):
+    # Removes a socket left behind by an earlier service of this user. Anything else at the
+    # path (another user's file, a regular file, a live service) is left alone.
+    try:
+        path_stat = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(path_stat.st_mode) or path_stat.st_uid != UID:
+        raise FileExistsError(f'{socket_path} exists and is not a socket of this user; not replacing it')
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(socket_path)
+    except ConnectionRefusedError:
+        os.remove(socket_path)
+        return
+    finally:
+        probe.close()
+    raise FileExistsError(f'A scan service is already listening on {socket_path}')
+
+def tcp_peer_uid(peer_address, local_address):
+    # Owner of the client end of a localhost TCP connection, from /proc/net/tcp (Linux only)
+    try:
+        with open('/proc/net/tcp') as f:
+            lines = f.readlines()[1:]
+    except OSError:
+        return None
+    for line in lines:
+        fields = line.split()
+        (client_ip, client_port), (server_ip, server_port) = [
+            (socket.inet_ntoa(struct.pack('=I', int(ip, 16))), int(port, 16))
+            for ip, port in (address.split(':') for address in fields[1:3])]
+        if (client_ip, client_port) == peer_address[:2] and (server_ip, server_port) == local_address[:2]:
+            return int(fields[7])
+    return None
+
+def peer_uid(sock):
+    # uid of the process at the other end of an accepted connection, None if it cannot be told
+    if sock.family == socket.AF_UNIX:
+        if not hasattr(socket, 'SO_PEERCRED'):
+            return None
+        _, uid, _ = struct.unpack('3i', sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+        return uid
+    return tcp_peer_uid(sock.getpeername(), sock.getsockname())
+
+class MicroBatcher:
+    # File reads run in a thread pool as requests arrive; prepared files wait at most
+    # max_delay for others to join them before one classify_batch call.
+
+    def __init__(self, antivirus, batch_size=64, max_delay=0.002, io_workers=8):
+        self.antivirus = antivirus
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.io_executor = ThreadPoolExecutor(max_workers=io_workers, thread_name_prefix='scan-io')
+        # A single inference thread keeps model calls serialised and batches large
+        self.inference_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='scan-inference')
+        self.pending = None
+        self.batches = 0
+        self.batched_files = 0
+
+    async def start(self):
+        self.pending = asyncio.Queue()
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def submit(self, file_path):
+        loop = asyncio.get_running_loop()
+        prepared = await loop.run_in_executor(self.io_executor, self.antivirus.prepare_file, file_path)
+        if isinstance(prepared, tuple):
+            # Resolved without the model (missing file, cache hit, signature, allowlist, error)
+            for _, message, status in self.antivirus.classify_batch([(file_path, prepared)]):
+                return message, status
+        future = loop.create_future()
+        await self.pending.put((file_path, prepared, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.pending.get()]
+            deadline = loop.time() + self.max_delay
+            while len(items) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self.pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            batch = [(file_path, prepared) for file_path, prepared, _ in items]
+            try:
+                results = await loop.run_in_executor(
+                    self.inference_executor, lambda: list(self.antivirus.classify_batch(batch)))
+            except Exception as e:
+                # Futures of disconnected clients are already cancelled
+                for _, _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            self.batches += 1
+            self.batched_files += len(items)
+            for (_, _, future), (_, message, status) in zip(items, results):
+                if not future.done():
+                    future.set_result((message, status))
+
+    def close(self):
+        self.task.cancel()
+        self.io_executor.shutdown(wait=False)
+        self.inference_executor.shutdown(wait=False)
+        self.antivirus.flush_cache()
+
+class ScanService:
+    def __init__(self, antivirus, socket_path=SOCKET_PATH, port=None, batch_size=64, max_delay=0.002, io_workers=8):
+        self.socket_path = socket_path
+        self.port = port
+        self.batcher = MicroBatcher(antivirus, batch_size, max_delay, io_workers)
+        self.requests = 0
+        self.rejected = 0
+        # (st_dev, st_ino) of the socket this service bound, so only that file is removed
+        self._socket_id = None
+
+    def authorized(self, writer):
+        sock = writer.get_extra_info('socket')
+        uid = peer_uid(sock)
+        if uid is None:
+            # Without peer credentials only the socket's 0600 mode keeps other users out;
+            # TCP has no such protection, so unknown TCP peers are refused
+            return sock.family == socket.AF_UNIX
+        return uid == UID or uid == 0
+
+    async def handle_connection(self, reader, writer):
+        if not self.authorized(writer):
+            self.rejected += 1
+            logging.warning(f'Refused scan service connection from {writer.get_extra_info("peername")!r}: '
+                            f'not uid {UID}')
+            writer.close()
+            return
+        write_lock = asyncio.Lock()
+        tasks = set()
+
+        async def answer(request):
+            try:
+                message, status = await self.batcher.submit(request['path'])
+                response = {'id': request.get('id'), 'message': message, 'status': status}
+            except Exception as e:
+                logging.exception('Scan request failed')
+                response = {'id': request.get('id'), 'error': str(e)}
+            async with write_lock:
+                writer.write((json.dumps(response) + '\n').encode())
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError:
+                    continue
+                self.requests += 1
+                # Requests on one connection are answered as they finish, matched by id
+                task = asyncio.get_running_loop().create_task(answer(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+        finally:
+            writer.close()
+
+    async def serve(self, ready=None):
+        await self.batcher.start()
+        if self.port is not None:
+            server = await asyncio.start_server(self.handle_connection, '127.0.0.1', self.port)
+            address = f'127.0.0.1:{self.port}'
+        else:
+            socket_dir = os.path.dirname(os.path.abspath(self.socket_path))
+            if socket_dir == os.path.abspath(SOCKET_DIR):
+                make_private_dir(socket_dir)
+            remove_stale_socket(self.socket_path)
+            # Created as 0600: nobody else may connect, wherever the socket is placed
+            umask = os.umask(0o177)
+            try:
+                server = await asyncio.start_unix_server(self.handle_connection, self.socket_path)
+            finally:
+                os.umask(umask)
+            socket_stat = os.stat(self.socket_path)
+            self._socket_id = (socket_stat.st_dev, socket_stat.st_ino)
+            address = self.socket_path
+        logging.info(f'Scan service listening on {address}')
+        if ready is not None:
+            ready.set()
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.batcher.close()
+            self.remove_socket()
+
+    def remove_socket(self):
+        # Only the socket this service created, never a file that has replaced it since
+        if self._socket_id is None:
+            return
+        try:
+            socket_stat = os.lstat(self.socket_path)
+        except FileNotFoundError:
+            return
+        if (socket_stat.st_dev, socket_stat.st_ino) == self._socket_id:
+            os.remove(self.socket_path)
+        self._socket_id = None
+
+class ScanClient:
+    # Blocking client with the same scan_file interface as Antivirus. One connection per
+    # client; use one client per thread (or share it, calls are serialised by a lock).
+
+    def __init__(self, socket_path=SOCKET_PATH, port=None, timeout=60):
+        if port is not None:
+            self.sock = socket.create_connection(('127.0.0.1', port), timeout=timeout)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.settimeout(timeout)
+            self.sock.connect(socket_path)
+        self.file = self.sock.makefile('rwb')
+        self.lock = threading.Lock()
+        self.next_id = 0
+
+    def scan_file(self, file_path):
+        [(_, message, status)] = self.scan_files([file_path])
+        return message, status
+
+    def scan_files(self, file_paths):
+        # Sends every request before reading responses, so the service can batch them
+        file_paths = list(file_paths)
+        with self.lock:
+            ids = {}
+            for file_path in file_paths:
+                self.next_id += 1
+                ids[self.next_id] = file_path
+                self.file.write((json.dumps({'id': self.next_id, 'path': os.path.abspath(file_path)}) + '\n').encode())
+            self.file.flush()
+            results = {}
+            while len(results) < len(ids):
+                line = self.file.readline()
+                if not line:
+                    raise ConnectionError('Scan service closed the connection')
+                response = json.loads(line)
+                # A failed request is reported like a failed local scan; raising here would
+                # leave the other responses unread and the next call would read them
+                if 'error' in response:
+                    file_path = ids.get(response['id'])
+                    results[response['id']] = (f"Error scanning {file_path}: {response['error']}", 'Unknown')
+                else:
+                    results[response['id']] = (response['message'], response['status'])
+        return [(ids[request_id], *results[request_id]) for request_id in ids]
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+def load_test(file_paths, clients=16, requests_per_client=200, socket_path=SOCKET_PATH, port=None):
+    # Each client thread sends one request at a time and records its latency
+    latencies = []
+    lock = threading.Lock()
+
+    def run_client(offset):
+        client = ScanClient(socket_path, port)
+        local = []
+        try:
+            for i in range(requests_per_client):
+                file_path = file_paths[(offset + i) % len(file_paths)]
+                start = time.perf_counter()
+                client.scan_file(file_path)
+                local.append(time.perf_counter() - start)
+        finally:
+            client.close()
+        with lock:
+            latencies.extend(local)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=run_client, args=(i * requests_per_client,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def percentile(p):
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000 if latencies else 0.0
+    return {
+        'requests': len(latencies),
+        'clients': clients,
+        'requests_per_second': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(0.50), 3),
+        'p99_ms': round(percentile(0.99), 3),
+    }
+
+if __name__ == '__main__':
+    # The service itself is started with: python -m cli serve [--socket PATH | --port N]
+    parser = argparse.ArgumentParser(description='Load test a running scan service.')
+    parser.add_argument('--socket', default=SOCKET_PATH)
+    parser.add_argument('--port', type=int, help='Listen on/connect to localhost TCP instead of a Unix socket')
+    parser.add_argument('directory')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--requests', type=int, default=200, help='Requests per client')
+    args = parser.parse_args()
+
+    from scan_pipeline import walk_files
+    paths = [os.path.abspath(path) for path in walk_files(args.directory)]
+    if not paths:
+        sys.exit(f'No files under {args.directory}')
+    print(json.dumps(load_test(paths, args.clients, args.requests, args.socket, args.port), indent=2))
@@ -1,4 +1,182 @@
+# signature_db.py
+
+import os
+import time
+import hashlib
+import argparse
+import logging
+import numpy as np
+from inference import MODEL_DIR
+
 malware_signatures = {
     'EICAR Test File': '44d88612fea8a8f36de82e1278abb02f',
     # Add other signatures if needed
 }
+
+SIGNATURE_PATH = os.path.join(MODEL_DIR, 'signatures.npz')
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Files larger than this are not hashed, so signatures cannot match them (None: hash every
+# file). Signatures are whole-file digests and padding a known sample is trivial, so only
+# set this where reading huge files in full is unaffordable; skipped files are logged and
+# counted in antivirus_unhashed_files_total. Independent of the feature read limit.
+MAX_HASH_BYTES = None
+
+def within_hash_limit(size, max_hash_bytes=MAX_HASH_BYTES):
+    return max_hash_bytes is None or size <= max_hash_bytes
+
+def hash_file(file_path, chunk_size=HASH_CHUNK_SIZE):
+    # Stream the file once and compute both digests
+    md5 = hashlib.md5()
+    sha256 = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            md5.update(chunk)
+            sha256.update(chunk)
+    return md5.digest(), sha256.digest()
+
+class SignatureIndex:
+    # Digests are kept as sorted fixed-width byte arrays (16 bytes per MD5, 32 per SHA-256)
+    # and searched with np.searchsorted, so millions of entries cost tens of MB, not GBs of str objects.
+
+    def __init__(self, md5_digests=(), sha256_digests=(), names=None):
+        self.md5 = self._sorted_array(md5_digests, 16)
+        self.sha256 = self._sorted_array(sha256_digests, 32)
+        # Optional display names for a small set of well-known digests
+        self.names = dict(names or {})
+
+    def __len__(self):
+        return len(self.md5) + len(self.sha256)
+
+    @staticmethod
+    def _sorted_array(digests, width):
+        array = np.asarray(digests if len(digests) else [], dtype=f'S{width}')
+        return np.unique(array)
+
+    @staticmethod
+    def _contains(array, digests):
+        digests = np.asarray(digests, dtype=array.dtype)
+        if len(array) == 0:
+            return np.zeros(len(digests), dtype=bool)
+        positions = np.searchsorted(array, digests)
+        positions[positions == len(array)] = 0
+        return array[positions] == digests
+
+    def contains_md5(self, digests):
+        return self._contains(self.md5, digests)
+
+    def contains_sha256(self, digests):
+        return self._contains(self.sha256, digests)
+
+    def version(self):
+        sha256 = hashlib.sha256()
+        sha256.update(self.md5.tobytes())
+        sha256.update(self.sha256.tobytes())
+        return sha256.hexdigest()[:16]
+
+    def lookup(self, md5_digest, sha256_digest):
+        # Returns a signature name on a match, otherwise None
+        for digest, array in ((md5_digest, self.md5), (sha256_digest, self.sha256)):
+            if self._contains(array, [digest])[0]:
+                return self.names.get(digest, digest.hex())
+        return None
+
+    def lookup_file(self, file_path):
+        return self.lookup(*hash_file(file_path))
+
+    def save(self, path=SIGNATURE_PATH):
+        np.savez(path, md5=self.md5, sha256=self.sha256)
+
+    @classmethod
+    def load(cls, path=SIGNATURE_PATH):
+        # .npz files come from save(); anything else is a text file with one hex digest per line
+        if path.endswith('.npz'):
+            with np.load(path) as data:
+                return cls(data['md5'], data['sha256'])
+
+        md5_digests, sha256_digests = [], []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if not line:
+                    continue
+                digest = bytes.fromhex(line.split()[0])
+                if len(digest) == 16:
+                    md5_digests.append(digest)
+                elif len(digest) == 32:
+                    sha256_digests.append(digest)
+                else:
+                    logging.warning(f'Skipping signature with unexpected length in {path}: {line}')
+        return cls(md5_digests, sha256_digests)
+
+    def merge(self, other):
+        merged = SignatureIndex(np.concatenate([self.md5, other.md5]), np.concatenate([self.sha256, other.sha256]))
+        merged.names = {**other.names, **self.names}
+        return merged
+
+def builtin_index():
+    names = {bytes.fromhex(digest): name for name, digest in malware_signatures.items()}
+    md5_digests = [digest for digest in names if len(digest) == 16]
+    sha256_digests = [digest for digest in names if len(digest) == 32]
+    return SignatureIndex(md5_digests, sha256_digests, names)
+
+def load_signatures(path=SIGNATURE_PATH):
+    # Built-in signatures plus the optional on-disk signature set
+    index = builtin_index()
+    if path and os.path.isfile(path):
+        index = index.merge(SignatureIndex.load(path))
+    logging.debug(f'Loaded {len(index)} signatures.')
+    return index
+
+def benchmark_lookups(count, queries, batch_size):
+    rng = np.random.default_rng(0)
+    md5_digests = rng.bytes(16 * count)
+    md5_digests = [md5_digests[i:i + 16] for i in range(0, len(md5_digests), 16)]
+
+    start = time.perf_counter()
+    index = SignatureIndex(md5_digests)
+    build_time = time.perf_counter() - start
+
+    # Half the queries hit, half are random misses
+    hits = [md5_digests[i] for i in rng.integers(0, count, queries // 2)]
+    misses = [rng.bytes(16) for _ in range(queries - len(hits))]
+    digests = hits + misses
+
+    start = time.perf_counter()
+    for digest in digests[:min(queries, 100000)]:
+        index.lookup(digest, b'')
+    single_rate = min(queries, 100000) / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    found = 0
+    for i in range(0, len(digests), batch_size):
+        found += int(index.contains_md5(digests[i:i + batch_size]).sum())
+    batch_rate = len(digests) / (time.perf_counter() - start)
+
+    print(f'Signatures: {count:,} MD5 ({index.md5.nbytes / 1e6:.1f} MB), built in {build_time:.2f}s')
+    print(f'Single lookups: {single_rate:,.0f}/s')
+    print(f'Batched lookups ({batch_size} per call): {batch_rate:,.0f}/s, {found:,} hits of {len(digests):,}')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build or benchmark the signature index.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help='Convert a text file of hex digests to a compact .npz index')
+    build_parser.add_argument('source')
+    build_parser.add_argument('--output', default=SIGNATURE_PATH)
+
+    bench_parser = subparsers.add_parser('bench', help='Measure lookups per second')
+    bench_parser.add_argument('--count', type=int, default=5000000)
+    bench_parser.add_argument('--queries', type=int, default=1000000)
+    bench_parser.add_argument('--batch-size', type=int, default=4096)
+
+    args = parser.parse_args()
+    if args.command == 'build':
+        index = SignatureIndex.load(args.source)
+        index.save(args.output)
+        print(f'Saved {len(index):,} signatures to {args.output}')
+    else:
+        benchmark_lookups(args.count, args.queries, args.batch_size)
@@ -0,0 +1,60 @@
+# tests/test_archive.py
+
+import io
+import struct
+import zipfile
+import numpy as np
+from antivirus import Antivirus, PreparedFile
+from archive import sample_archive
+from feature_extractor import get_feature_spec
+
+def encrypt_member(data, name):
+    # zipfile cannot write encrypted members, so set the encryption flag of one by hand in
+    # its local header and its central directory entry; reading it then needs a password
+    with zipfile.ZipFile(io.BytesIO(bytes(data))) as container:
+        flag_offsets = [container.getinfo(name).header_offset + 6]
+    start = data.find(b'PK\x01\x02')
+    while start >= 0:
+        name_length = struct.unpack_from('<H', data, start + 28)[0]
+        if data[start + 46:start + 46 + name_length] == name.encode():
+            flag_offsets.append(start + 8)
+        start = data.find(b'PK\x01\x02', start + 4)
+    for offset in flag_offsets:
+        flags = struct.unpack_from('<H', data, offset)[0] | 0x1
+        struct.pack_into('<H', data, offset, flags)
+    return data
+
+def write_zip(path, members, encrypted=()):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as container:
+        for name, content in members.items():
+            container.writestr(name, content)
+    data = bytearray(buffer.getvalue())
+    for name in encrypted:
+        data = encrypt_member(data, name)
+    path.write_bytes(bytes(data))
+    return path
+
+def test_encrypted_member_makes_archive_incomplete(tmp_path):
+    path = write_zip(tmp_path / 'mixed.zip', {'readme.txt': b'hello world\n' * 50, 'payload.exe': b'MZ' + bytes(500)},
+                     encrypted=['payload.exe'])
+    archive = sample_archive(str(path), get_feature_spec(1))
+
+    assert archive.names == ['readme.txt']
+    assert archive.unreadable == 1
+    assert archive.incomplete == '1 unreadable members'
+
+    # Clean probabilities for the readable members do not make the archive Clean
+    antivirus = Antivirus.__new__(Antivirus)
+    prepared = PreparedFile(None, None, archive=archive)
+    message, status = antivirus.archive_verdict(str(path), np.zeros(len(archive.names)), prepared)
+    assert status == 'Unknown'
+    assert 'unreadable' in message
+
+def test_readable_archive_is_complete(tmp_path):
+    path = write_zip(tmp_path / 'plain.zip', {'readme.txt': b'hello world\n' * 50, 'data.bin': bytes(range(256))})
+    archive = sample_archive(str(path), get_feature_spec(1))
+
+    assert sorted(archive.names) == ['data.bin', 'readme.txt']
+    assert archive.incomplete is None
+    assert [name for name, _, _ in archive.hashes] == ['readme.txt', 'data.bin']
@@ -0,0 +1,74 @@
+# tests/test_inference.py
+
+import numpy as np
+import pytest
+from sklearn.preprocessing import StandardScaler
+from inference import NumpyBackend, export_npz, export_float16, compare_backends, fold_scaler
+
+def write_npz(path, rng, feature_version=1, sizes=(54, 16, 1)):
+    arrays = {'layer_count': np.array(len(sizes) - 1), 'feature_version': np.array(feature_version)}
+    for i, (rows, columns) in enumerate(zip(sizes, sizes[1:])):
+        arrays[f'kernel_{i}'] = rng.normal(size=(rows, columns)).astype(np.float32)
+        arrays[f'bias_{i}'] = rng.normal(size=columns).astype(np.float32)
+        arrays[f'activation_{i}'] = np.array('sigmoid' if i == len(sizes) - 2 else 'relu')
+    np.savez(path, **arrays)
+    return path
+
+def test_float16_export_matches_float32(tmp_path):
+    rng = np.random.default_rng(0)
+    reference = NumpyBackend(write_npz(tmp_path / 'model.npz', rng))
+    candidate = NumpyBackend(export_float16(tmp_path / 'model.npz', tmp_path / 'model_fp16.npz'))
+    features = rng.dirichlet(np.ones(54), size=500).astype(np.float32)
+
+    assert candidate.name == 'numpy-float16'
+    assert candidate.feature_version == reference.feature_version
+    assert candidate.weight_bytes * 2 == reference.weight_bytes
+    assert candidate.predict(features).dtype == np.float32
+    report = compare_backends(reference, candidate, features, repeats=1)
+    assert report['max_probability_diff'] < 1e-2
+    assert report['verdict_agreement'] > 0.99
+
+def fitted_scaler(rng, n_features):
+    scaler = StandardScaler()
+    scaler.fit(rng.normal(loc=rng.uniform(-2, 2, n_features), scale=rng.uniform(0.1, 3, n_features),
+                          size=(200, n_features)))
+    return scaler
+
+def test_fold_scaler_matches_scaling_first():
+    rng = np.random.default_rng(1)
+    scaler = fitted_scaler(rng, 6)
+    kernel, bias = rng.normal(size=(6, 4)), rng.normal(size=4)
+    features = rng.normal(size=(10, 6))
+
+    folded_kernel, folded_bias = fold_scaler(kernel, bias, scaler)
+    expected = (features - scaler.mean_) / scaler.scale_ @ kernel + bias
+    assert np.allclose(features @ folded_kernel + folded_bias, expected)
+
+def test_numpy_backend_matches_hand_computed_forward_pass(tmp_path):
+    rng = np.random.default_rng(2)
+    backend = NumpyBackend(write_npz(tmp_path / 'model.npz', rng, sizes=(54, 8, 4, 1)))
+    features = rng.dirichlet(np.ones(54), size=20).astype(np.float32)
+
+    with np.load(tmp_path / 'model.npz') as data:
+        hidden = np.maximum(features @ data['kernel_0'] + data['bias_0'], 0)
+        hidden = np.maximum(hidden @ data['kernel_1'] + data['bias_1'], 0)
+        expected = 1.0 / (1.0 + np.exp(-(hidden @ data['kernel_2'] + data['bias_2'])))[:, 0]
+    assert backend.n_features == 54 and backend.feature_version == 1
+    assert np.allclose(backend.predict(features), expected, atol=1e-6)
+
+def test_numpy_export_matches_keras(tmp_path):
+    tf = pytest.importorskip('tensorflow')
+    rng = np.random.default_rng(3)
+    scaler = fitted_scaler(rng, 54)
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(54,)),
+        tf.keras.layers.Dense(16, activation='relu'),
+        tf.keras.layers.Dropout(0.5),
+        tf.keras.layers.Dense(8, activation='relu'),
+        tf.keras.layers.Dense(1, activation='sigmoid'),
+    ])
+    backend = NumpyBackend(export_npz(model, scaler, tmp_path / 'model.npz', feature_version=1))
+    features = rng.normal(size=(100, 54)).astype(np.float32)
+
+    expected = model.predict(scaler.transform(features), verbose=0)[:, 0]
+    assert np.allclose(backend.predict(features), expected, atol=1e-5)
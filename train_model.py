@@ -1,46 +1,84 @@
 # train_model.py
 
-import os
 import numpy as np
-from feature_extractor import extract_features
+from feature_store import build_feature_store, load_feature_store, STORE_DIR
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, confusion_matrix, ConfusionMatrixDisplay
 from sklearn.preprocessing import StandardScaler
 from sklearn.utils import class_weight
+from sklearn.linear_model import SGDClassifier
 import matplotlib.pyplot as plt
 import tensorflow as tf
 from tensorflow.keras import layers, models
 from tensorflow.keras.callbacks import EarlyStopping
 import joblib
-
-def create_dataset(benign_dir, malware_dir):
-    data = []
-    labels = []
-
-    # Process benign files
-    for filename in os.listdir(benign_dir):
-        file_path = os.path.join(benign_dir, filename)
-        features = extract_features(file_path)
-        if features is not None:
-            data.append(features)
-            labels.append(0)  # Label for benign files
-
-    # Process malware files
-    for filename in os.listdir(malware_dir):
-        file_path = os.path.join(malware_dir, filename)
-        features = extract_features(file_path)
-        if features is not None:
-            data.append(features)
-            labels.append(1)  # Label for malware files
-
-    return np.array(data), np.array(labels)
+from inference import export_npz, export_float16, write_model_info, compare_backends, format_comparison, NumpyBackend
+from inference import MODEL_PATH, SCALER_PATH, NPZ_PATH
+from feature_extractor import LATEST_FEATURE_VERSION
+from cascade import LinearTier, evaluate_cascade, CASCADE_PATH
+
+# Rows read from the memory-mapped feature matrix at a time
+CHUNK_SIZE = 65536
+
+def create_dataset(benign_dir, malware_dir, store_dir=STORE_DIR, workers=None, feature_version=LATEST_FEATURE_VERSION):
+    # Extract features in a process pool, reusing stored vectors for unchanged files
+    build_feature_store([(benign_dir, 0), (malware_dir, 1)], store_dir, workers, version=feature_version)
+    features, labels, _ = load_feature_store(store_dir, feature_version)
+    return np.asarray(features), np.asarray(labels)
+
+def fit_scaler(features, indices, chunk_size=CHUNK_SIZE):
+    # Fit the scaler chunk by chunk so the training split is never fully in memory
+    scaler = StandardScaler()
+    for start in range(0, len(indices), chunk_size):
+        scaler.partial_fit(features[np.sort(indices[start:start + chunk_size])])
+    return scaler
+
+def batch_generator(features, labels, indices, scaler, batch_size, shuffle=False, seed=42):
+    # Returns a generator factory: tf.data calls it once per epoch, and each call reshuffles
+    rng = np.random.default_rng(seed)
+
+    def generate():
+        order = rng.permutation(indices) if shuffle else indices
+        for start in range(0, len(order), batch_size):
+            # Sorted indices keep memmap reads sequential within a batch
+            batch = np.sort(order[start:start + batch_size])
+            yield scaler.transform(features[batch]).astype(np.float32), labels[batch].astype(np.float32)
+    return generate
+
+def train_linear_tier(features, labels, indices, scaler, class_weights, epochs=5, chunk_size=CHUNK_SIZE):
+    # Logistic regression streamed over the memmap, used as the cheap first cascade tier
+    classifier = SGDClassifier(loss='log_loss', alpha=1e-4, random_state=42)
+    classes = np.array([0, 1])
+    rng = np.random.default_rng(42)
+    for _ in range(epochs):
+        order = rng.permutation(indices)
+        for start in range(0, len(order), chunk_size):
+            batch = np.sort(order[start:start + chunk_size])
+            batch_labels = labels[batch]
+            weights = np.array([class_weights[label] for label in batch_labels])
+            classifier.partial_fit(scaler.transform(features[batch]), batch_labels, classes=classes,
+                                   sample_weight=weights)
+    return classifier
+
+def make_dataset(features, labels, indices, scaler, batch_size, shuffle=False):
+    signature = (
+        tf.TensorSpec(shape=(None, features.shape[1]), dtype=tf.float32),
+        tf.TensorSpec(shape=(None,), dtype=tf.float32),
+    )
+    dataset = tf.data.Dataset.from_generator(
+        batch_generator(features, labels, indices, scaler, batch_size, shuffle), output_signature=signature)
+    return dataset.prefetch(tf.data.AUTOTUNE)
 
 if __name__ == '__main__':
     benign_dir = 'data/benign'
     malware_dir = 'data/malware'
+    batch_size = 32
+    feature_version = LATEST_FEATURE_VERSION
 
-    print("Creating dataset...")
-    X, y = create_dataset(benign_dir, malware_dir)
+    print(f"Creating dataset (feature spec v{feature_version})...")
+    build_feature_store([(benign_dir, 0), (malware_dir, 1)], version=feature_version)
+    # X stays on disk; batches are read from the memory map as training needs them
+    X, y, _ = load_feature_store(version=feature_version)
 
     # Handle missing values (if any)
     if len(X) == 0 or len(y) == 0:
@@ -49,17 +87,17 @@ if __name__ == '__main__':
 
     print(f"Dataset size: {len(X)} samples.")
 
-    # Split dataset
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.2, random_state=42, stratify=y)
+    # Split dataset (indices only)
+    train_idx, test_idx = train_test_split(
+        np.arange(len(y)), test_size=0.2, random_state=42, stratify=y)
+    test_idx = np.sort(test_idx)
+    y_train, y_test = y[train_idx], y[test_idx]
 
     # Scale features
-    scaler = StandardScaler()
-    X_train = scaler.fit_transform(X_train)
-    X_test = scaler.transform(X_test)
+    scaler = fit_scaler(X, train_idx)
 
     # Save the scaler
-    scaler_path = 'models/scaler.pkl'
+    scaler_path = SCALER_PATH
     joblib.dump(scaler, scaler_path)
     print(f"Scaler saved to {scaler_path}")
 
@@ -71,10 +109,13 @@ if __name__ == '__main__':
     )
     class_weights = dict(enumerate(class_weights))
 
+    train_data = make_dataset(X, y, train_idx, scaler, batch_size, shuffle=True)
+    test_data = make_dataset(X, y, test_idx, scaler, batch_size)
+
     # Build the neural network model
     print("Building the model...")
     model = models.Sequential()
-    model.add(layers.Input(shape=(X_train.shape[1],)))
+    model.add(layers.Input(shape=(X.shape[1],)))
     model.add(layers.Dense(64, activation='relu'))
     model.add(layers.Dropout(0.5))
     model.add(layers.Dense(32, activation='relu'))
@@ -90,17 +131,16 @@ if __name__ == '__main__':
     # Train the model
     print("Training the model...")
     history = model.fit(
-        X_train, y_train,
+        train_data,
         epochs=50,
-        batch_size=32,
-        validation_data=(X_test, y_test),
+        validation_data=test_data,
         callbacks=[early_stopping],
         class_weight=class_weights
     )
 
     # Evaluate the model
     print("Evaluating the model...")
-    y_pred_prob = model.predict(X_test)
+    y_pred_prob = model.predict(test_data)
     y_pred = (y_pred_prob > 0.5).astype("int32")
     print(classification_report(y_test, y_pred))
 
@@ -111,6 +151,36 @@ if __name__ == '__main__':
     plt.show()
 
     # Save the model
-    model_path = 'models/malware_detector.h5'
+    model_path = MODEL_PATH
     model.save(model_path)
+    write_model_info(feature_version)
     print(f"Model saved to {model_path}")
+
+    # Export weights with the scaler folded in for the TensorFlow-free scanner
+    npz_path = NPZ_PATH
+    export_npz(model, scaler, npz_path, feature_version)
+    print(f"NumPy inference weights saved to {npz_path}")
+
+    # Held-out rows (up to CHUNK_SIZE) for comparing exports and the cascade
+    eval_idx = test_idx[:CHUNK_SIZE]
+    X_eval = np.asarray(X[eval_idx])
+
+    # Half-precision weights, compared with the float32 export on the test split
+    float16_path = export_float16(npz_path)
+    print(f"float16 weights saved to {float16_path}")
+    print(format_comparison(compare_backends(NumpyBackend(npz_path), NumpyBackend(float16_path), X_eval, y[eval_idx])))
+
+    # Cheap first tier of the scanning cascade
+    print("Training the linear cascade tier...")
+    classifier = train_linear_tier(X, y, train_idx, scaler, class_weights)
+    linear = LinearTier.from_sklearn(classifier, scaler, feature_version)
+    linear.save(CASCADE_PATH)
+    print(f"Linear tier saved to {CASCADE_PATH}")
+
+    # Accuracy vs throughput of the cascade on the held-out rows
+    model_predict = lambda features: model.predict(scaler.transform(features), verbose=0)[:, 0]
+    print("Cascade evaluation (benign threshold 0.0 = neural network only):")
+    for row in evaluate_cascade(linear, model_predict, X_eval, y[eval_idx]):
+        print(f"  threshold {row['benign_threshold']:<6} resolved by linear {row['resolved_by_linear']:6.1%}  "
+              f"accuracy {row['accuracy']:.4f}  missed malware {row['missed_malware']:4d}  "
+              f"{row['files_per_second']:10,.0f} files/s")
@@ -0,0 +1,172 @@
+# tree_state.py
+#
+# Persisted state of watched trees (path, inode, size, mtime) so real-time protection can
+# catch up on changes made while it was not running. Keys are paths relative to the root,
+# encoded so that byte order equals the order of a sorted depth-first walk. Reconciling is
+# then a merge of two sorted streams, holding one directory listing per level and one chunk
+# of stored rows in memory, however many files the tree has.
+
+import os
+import sqlite3
+import threading
+import logging
+from scan_rules import NORMAL
+
+TREE_STATE_PATH = 'tree_state.db'
+
+# Pending writes are committed in groups, like the scan cache
+COMMIT_EVERY = 256
+
+# Stored rows fetched per query while reconciling
+READ_CHUNK = 1000
+
+_SEP = os.fsencode(os.sep)
+
+def path_key(relative_path):
+    # Separators become NUL bytes (never part of a name), so 'a/b' sorts before 'a.txt'
+    # exactly as a walk that lists each directory in sorted order visits them
+    return os.fsencode(relative_path).replace(_SEP, b'\x00')
+
+def key_path(root, key):
+    return os.path.join(root, os.fsdecode(key.replace(b'\x00', _SEP)))
+
+def stat_state(stat_result):
+    return stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns
+
+def sorted_entries(directory):
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(entries, key=lambda entry: os.fsencode(entry.name))
+    except OSError as e:
+        logging.warning(f'Cannot list directory {directory}: {e}')
+        return []
+
+def sorted_walk(root, rules=None):
+    # Yields (key, stat_result, priority) for every regular file under root, in key order.
+    # With ScanRules, excluded directories are not entered and excluded files are skipped.
+    stack = [(b'', iter(sorted_entries(root)))]
+    while stack:
+        prefix, entries = stack[-1]
+        entry = next(entries, None)
+        if entry is None:
+            stack.pop()
+            continue
+        key = prefix + os.fsencode(entry.name)
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                if rules is None or not rules.prune(entry):
+                    stack.append((key + b'\x00', iter(sorted_entries(entry.path))))
+            elif entry.is_file(follow_symlinks=False):
+                stat_result = entry.stat(follow_symlinks=False)
+                priority = NORMAL if rules is None else rules.priority(entry.path, entry.name, stat_result)
+                if priority is not None:
+                    yield key, stat_result, priority
+        except OSError:
+            continue
+
+class TreeState:
+    def __init__(self, root, path=TREE_STATE_PATH):
+        self.root = os.path.abspath(root)
+        self.path = path
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS roots (root TEXT PRIMARY KEY)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS files ('
+            'root TEXT, key BLOB, inode INTEGER, size INTEGER, mtime_ns INTEGER, '
+            'PRIMARY KEY (root, key)) WITHOUT ROWID')
+        self.conn.commit()
+
+    def has_baseline(self):
+        with self._lock:
+            return self.conn.execute('SELECT 1 FROM roots WHERE root = ?', (self.root,)).fetchone() is not None
+
+    def _write(self, sql, params):
+        with self._lock:
+            self.conn.execute(sql, params)
+            self._pending += 1
+            if self._pending >= COMMIT_EVERY:
+                self.conn.commit()
+                self._pending = 0
+
+    def _put(self, key, stat_result):
+        self._write('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)', (self.root, key, *stat_state(stat_result)))
+
+    def _forget(self, key):
+        self._write('DELETE FROM files WHERE root = ? AND key = ?', (self.root, key))
+
+    def record(self, file_path):
+        # Remember a file as it is now, after it was scanned (or forget it if it is gone)
+        relative_path = os.path.relpath(os.path.abspath(file_path), self.root)
+        if relative_path == os.pardir or relative_path.startswith(os.pardir + os.sep):
+            return
+        key = path_key(relative_path)
+        try:
+            stat_result = os.stat(file_path, follow_symlinks=False)
+        except OSError:
+            self._forget(key)
+            return
+        self._put(key, stat_result)
+
+    def rows(self):
+        # Stored (key, inode, size, mtime_ns) rows in key order, one short query per chunk
+        # so scans recording their results are never blocked for long
+        last_key = b''
+        while True:
+            with self._lock:
+                rows = self.conn.execute(
+                    'SELECT key, inode, size, mtime_ns FROM files WHERE root = ? AND key > ? ORDER BY key LIMIT ?',
+                    (self.root, last_key, READ_CHUNK)).fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_key = rows[-1][0]
+
+    def reconcile(self, rules=None):
+        # Yields (path, priority) for files added or changed since the state was last written
+        # and forgets files that are gone (or now excluded by rules). Changed files keep their old row until record() is
+        # called after their scan, so a crash before that finds them again next time.
+        # Without a stored state for this root, the tree as it is becomes the baseline.
+        if not self.has_baseline():
+            files = 0
+            for key, stat_result, _ in sorted_walk(self.root, rules):
+                self._put(key, stat_result)
+                files += 1
+            with self._lock:
+                self.conn.execute('INSERT OR IGNORE INTO roots VALUES (?)', (self.root,))
+                self.conn.commit()
+                self._pending = 0
+            logging.info(f'Recorded a baseline of {files} files under {self.root}')
+            return
+
+        stored = self.rows()
+        row = next(stored, None)
+        for key, stat_result, priority in sorted_walk(self.root, rules):
+            while row is not None and row[0] < key:
+                self._forget(row[0])
+                row = next(stored, None)
+            if row is not None and row[0] == key:
+                if tuple(row[1:]) != stat_state(stat_result):
+                    yield key_path(self.root, key), priority
+                row = next(stored, None)
+            else:
+                yield key_path(self.root, key), priority
+        while row is not None:
+            self._forget(row[0])
+            row = next(stored, None)
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self.conn.commit()
+                self._pending = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self.conn.close()